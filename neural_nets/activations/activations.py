@@ -1,10 +1,21 @@
 import re
+from functools import partial
 from abc import ABC, abstractmethod
 
 import numpy as np
 
 
+def _float_empty(z):
+    # an uninitialized output buffer for `z` that is safe for in-place
+    # transcendentals, keeping the precision of floating point inputs
+    return np.empty_like(z, dtype=np.result_type(z, np.float16))
+
+
 class ActivationBase(ABC):
+    # True if `grad_from_output` can recover the derivative from the
+    # activation output alone
+    output_grad = False
+
     def __init__(self, **kwargs):
         super().__init__()
 
@@ -12,26 +23,69 @@ class ActivationBase(ABC):
         return self.fn(z)
 
     @abstractmethod
-    def fn(self, z):
+    def fn(self, z, out=None):
         raise NotImplementedError
 
     @abstractmethod
     def grad(self, x, **kwargs):
         raise NotImplementedError
 
+    def grad_from_output(self, y):
+        """
+        Compute the derivative of the activation wrt. its input using only the
+        activation output `y` = fn(x). This avoids recomputing fn(x) in the
+        backward pass and lets layers discard the pre-activation.
+        """
+        fstr = "{} does not support computing its gradient from its output"
+        raise NotImplementedError(fstr.format(str(self)))
+
+    def fn_and_grad(self, z, out=None):
+        """
+        Compute the activation and its derivative wrt. `z` in a single pass.
+
+        Parameters
+        ----------
+        z : numpy array
+            The pre-activation values
+        out : numpy array or None (default: None)
+            An optional buffer to write the activation into. May be `z` itself.
+
+        Returns
+        -------
+        y : numpy array
+            The activation fn(z)
+        dydz : numpy array
+            The elementwise derivative of fn wrt. z
+        """
+        if self.output_grad:
+            y = self.fn(z, out=out)
+            return y, self.grad_from_output(y)
+        dydz = self.grad(z)
+        return self.fn(z, out=out), dydz
+
 
 class Sigmoid(ActivationBase):
+    output_grad = True
+
     def __init__(self):
         super().__init__()
 
     def __str__(self):
         return "Sigmoid"
 
-    def fn(self, z):
-        return 1 / (1 + np.exp(-z))
+    def fn(self, z, out=None):
+        if out is None:
+            out = _float_empty(z)
+        np.negative(z, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
 
     def grad(self, x):
-        return self.fn(x) * (1 - self.fn(x))
+        return self.grad_from_output(self.fn(x))
+
+    def grad_from_output(self, y):
+        return y * (1 - y)
 
 
 class ReLU(ActivationBase):
@@ -52,19 +106,24 @@ class ReLU(ActivationBase):
     - Andrej Karpathy
     """
 
+    output_grad = True
+
     def __init__(self):
         super().__init__()
 
     def __str__(self):
         return "ReLU"
 
-    def fn(self, z):
-        return np.clip(z, 0, np.inf)
+    def fn(self, z, out=None):
+        return np.maximum(z, 0, out=out)
 
     def grad(self, x):
         with np.errstate(invalid="raise"):
             return (x > 0).astype(int)
 
+    def grad_from_output(self, y):
+        return (y > 0).astype(int)
+
 
 class LeakyReLU(ActivationBase):
     def __init__(self, alpha=0.3):
@@ -74,32 +133,56 @@ class LeakyReLU(ActivationBase):
     def __str__(self):
         return "Leaky ReLU(alpha={})".format(self.alpha)
 
-    def fn(self, z):
-        _z = z.copy()
-        _z[z < 0] = _z[z < 0] * self.alpha
-        return _z
+    @property
+    def output_grad(self):
+        # the sign of the output only identifies the input region when the
+        # negative slope is positive
+        return self.alpha > 0
+
+    def fn(self, z, out=None):
+        mask = z < 0
+        if out is None:
+            out = _float_empty(z)
+        if out is not z:
+            out[...] = z
+        out[mask] *= self.alpha
+        return out
 
     def grad(self, x):
         out = np.ones_like(x)
         out[x < 0] *= self.alpha
         return out
 
+    def grad_from_output(self, y):
+        if not self.output_grad:
+            return super().grad_from_output(y)
+        out = np.ones_like(y)
+        out[y < 0] *= self.alpha
+        return out
+
 
 class Tanh(ActivationBase):
+    output_grad = True
+
     def __init__(self):
         super().__init__()
 
     def __str__(self):
         return "Tanh"
 
-    def fn(self, z):
-        return np.tanh(z)
+    def fn(self, z, out=None):
+        return np.tanh(z, out=out)
 
     def grad(self, x):
-        return 1 - np.tanh(x) ** 2
+        return self.grad_from_output(np.tanh(x))
+
+    def grad_from_output(self, y):
+        return 1 - y ** 2
 
 
 class Affine(ActivationBase):
+    output_grad = True
+
     def __init__(self, slope=1, intercept=0):
         self.slope = slope
         self.intercept = intercept
@@ -108,12 +191,19 @@ class Affine(ActivationBase):
     def __str__(self):
         return "Affine(slope={}, intercept={})".format(self.slope, self.intercept)
 
-    def fn(self, z):
-        return self.slope * z + self.intercept
+    def fn(self, z, out=None):
+        if out is None:
+            return self.slope * z + self.intercept
+        np.multiply(z, self.slope, out=out)
+        out += self.intercept
+        return out
 
     def grad(self, x):
         return self.slope * np.ones_like(x)
 
+    def grad_from_output(self, y):
+        return self.slope * np.ones_like(y)
+
 
 class Softmax(ActivationBase):
     def __init__(self):
@@ -122,15 +212,67 @@ class Softmax(ActivationBase):
     def __str__(self):
         return "Softmax"
 
-    def fn(self, z):
+    def fn(self, z, out=None):
         # center data to avoid overflow
-        e_z = np.exp(z - np.max(z, axis=1, keepdims=True))
-        return e_z / e_z.sum(axis=1, keepdims=True)
+        if out is None:
+            out = _float_empty(z)
+        e_z = np.subtract(z, np.max(z, axis=1, keepdims=True), out=out)
+        np.exp(e_z, out=e_z)
+        e_z /= e_z.sum(axis=1, keepdims=True)
+        return e_z
 
     def grad(self, z):
-        pass
-
-    #      p = self.fn(z)
-    #      gr = np.outer(p, 1 - p)
-    #      np.fill_diagonal(gr, [pi * (1 - pi) for pi in p])
-    #      return gr
+        """
+        The softmax Jacobian is not diagonal, so it has no elementwise
+        derivative. Use `jvp_from_output` to backpropagate through it.
+        """
+        raise NotImplementedError(
+            "Softmax has no elementwise gradient; use `jvp_from_output`"
+        )
+
+    def fn_and_grad(self, z, out=None):
+        """
+        Compute the softmax and a function backpropagating through it in a
+        single pass.
+
+        Since the softmax Jacobian is not diagonal, the second return value is
+        not an elementwise derivative but a callable computing the
+        Jacobian-vector product from the softmax output (see
+        `jvp_from_output`).
+
+        Parameters
+        ----------
+        z : numpy array
+            The pre-activation values
+        out : numpy array or None (default: None)
+            An optional buffer to write the softmax into. May be `z` itself.
+
+        Returns
+        -------
+        y : numpy array
+            The softmax of z
+        jvp : callable
+            A function mapping dL/dy to dL/dz
+        """
+        y = self.fn(z, out=out)
+        return y, partial(self.jvp_from_output, y)
+
+    def jvp_from_output(self, y, dLdy):
+        """
+        Backpropagate `dLdy` through the softmax using only its output `y`:
+
+            dL/dz_i = y_i * (dL/dy_i - sum_j dL/dy_j * y_j)
+
+        Parameters
+        ----------
+        y : numpy array
+            The softmax output, normalized along axis 1
+        dLdy : numpy array of the same shape as `y`
+            The gradient of the loss wrt. the softmax output
+
+        Returns
+        -------
+        dLdz : numpy array of the same shape as `y`
+            The gradient of the loss wrt. the softmax input
+        """
+        return y * (dLdy - (dLdy * y).sum(axis=1, keepdims=True))
@@ -4,7 +4,7 @@ from ast import literal_eval as eval
 
 import numpy as np
 
-from optimizers import OptimizerBase, SGD, AdaGrad, RMSProp
+from optimizers import OptimizerBase, SGD, AdaGrad, RMSProp, Adam, LARS, LAMB, KFAC
 from activations import ActivationBase, Affine, ReLU, Tanh, Sigmoid, Softmax, LeakyReLU
 
 from utils import he_normal, he_uniform, glorot_normal, glorot_uniform, truncated_normal
@@ -82,7 +82,7 @@ class OptimizerInitializer(object):
         return opt
 
     def init_from_str(self, opt_str):
-        r = r"([a-zA-Z]*)=([^,)]*)"
+        r = r"([a-zA-Z_][a-zA-Z0-9_]*)=([^,)]*)"
         kwargs = dict([(i, eval(j)) for (i, j) in re.findall(r, opt_str)])
         opt_str = opt_str.lower()
         if opt_str is None:
@@ -93,6 +93,14 @@ class OptimizerInitializer(object):
             optimizer = AdaGrad(**kwargs)
         elif "rmsprop" in opt_str:
             optimizer = RMSProp(**kwargs)
+        elif "adam" in opt_str:
+            optimizer = Adam(**kwargs)
+        elif "lars" in opt_str:
+            optimizer = LARS(**kwargs)
+        elif "lamb" in opt_str:
+            optimizer = LAMB(**kwargs)
+        elif "kfac" in opt_str:
+            optimizer = KFAC(**kwargs)
         else:
             raise NotImplementedError("{}".format(opt_str))
         return optimizer
@@ -101,6 +109,7 @@ class OptimizerInitializer(object):
         O = opt_dict
         cc = O["cache"] if "cache" in O else None
         op = O["hyperparameters"] if "hyperparameters" in O else None
+        mm = O["masks"] if "masks" in O else {}
 
         if op is None:
             raise ValueError("Must have `hyperparemeters` key: {}".format(opt_dict))
@@ -111,8 +120,20 @@ class OptimizerInitializer(object):
             optimizer = RMSProp().set_params(op, cc)
         elif op and op["id"] == "AdaGrad":
             optimizer = AdaGrad().set_params(op, cc)
+        elif op and op["id"] == "Adam":
+            optimizer = Adam().set_params(op, cc)
+        elif op and op["id"] == "LARS":
+            optimizer = LARS().set_params(op, cc)
+        elif op and op["id"] == "LAMB":
+            optimizer = LAMB().set_params(op, cc)
+        elif op and op["id"] == "KFAC":
+            optimizer = KFAC().set_params(op, cc)
         elif op:
             raise NotImplementedError("{}".format(op["id"]))
+
+        # pruning masks (see `OptimizerBase.set_mask`)
+        for param_name, mask in mm.items():
+            optimizer.set_mask(param_name, mask)
         return optimizer
 
 
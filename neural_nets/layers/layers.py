@@ -2,16 +2,22 @@ from abc import ABC, abstractmethod
 
 import numpy as np
 
+from activations import Affine, ReLU, LeakyReLU, Softmax
 from initializers import WeightInitializer, OptimizerInitializer, ActivationInitializer
 from wrappers import init_wrappers
 
 from utils import (
+    Profiler,
     pad1D,
     pad2D,
+    plan_pad2D,
+    plan_conv2D,
     conv1D,
     conv2D,
     im2col,
     col2im,
+    im2col_1D,
+    col2im_1D,
     dilate,
     deconv2D_naive,
     calc_pad_dims_2D,
@@ -27,9 +33,19 @@ class LayerBase(ABC):
         self.gradients = {}
         self.parameters = {}
         self.derived_variables = {}
+        self._profiler = None
 
         super().__init__()
 
+    def __getstate__(self):
+        # profilers cannot be copied or pickled, and the profiled methods are
+        # bound to this instance; copies are not profiled
+        state = self.__dict__.copy()
+        state["_profiler"] = None
+        for phase in ["forward", "backward", "update"]:
+            state.pop(phase, None)
+        return state
+
     @abstractmethod
     def _init_params(self, **kwargs):
         raise NotImplementedError
@@ -48,6 +64,177 @@ class LayerBase(ABC):
     def unfreeze(self):
         self.trainable = True
 
+    def enable_profiling(self, profiler=None, name=None):
+        """
+        Record the wall time, estimated FLOPs, and bytes allocated for each
+        `forward`, `backward`, and `update` call on the layer.
+
+        Parameters
+        ----------
+        profiler : `utils.Profiler` instance (default: None)
+            The profiler to record events with. If `None`, create a new one.
+        name : str (default: None)
+            The name to use for the layer in the profiling report
+
+        Returns
+        -------
+        profiler : `utils.Profiler` instance
+            The profiler recording events for the layer
+        """
+        profiler = Profiler() if profiler is None else profiler
+        profiler.attach(self, name)
+        return profiler
+
+    def disable_profiling(self):
+        if self._profiler is not None:
+            self._profiler.detach(self)
+
+    def _bias_act(self, Z, b, retain_derived=True):
+        """
+        Fused bias + activation epilogue. Adds the bias and applies the
+        activation in-place on the (freshly allocated) linear output `Z`,
+        caching only what `_act_grad` needs for the backward pass:
+
+            ReLU / LeakyReLU : a bit-packed sign mask (1 bit per element)
+            Affine           : nothing
+            Softmax          : the layer output
+            other            : the layer output if the activation supports
+                               `grad_from_output`, else the pre-activation Z
+
+        NB. `Z` is overwritten with the layer output.
+
+        Parameters
+        ----------
+        Z : numpy array of shape (n_ex, ..., out_ch)
+            The output of the layer's linear transform. Must not be referenced
+            elsewhere.
+        b : numpy array
+            The layer bias, broadcastable against `Z`
+        retain_derived : bool (default: True)
+            Whether to cache the values needed for the backward pass. If
+            False, nothing is written to the layer's `derived_variables`.
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, ..., out_ch)
+            The layer output, act_fn(Z + b)
+        """
+        act = self.act_fn
+        if not np.issubdtype(Z.dtype, np.floating):
+            Z = Z.astype(float)
+        Z += b
+
+        if not retain_derived:
+            return act.fn(Z, out=Z)
+
+        if isinstance(act, ReLU):
+            mask = Z > 0
+            np.maximum(Z, 0, out=Z)
+            cache = (np.packbits(mask, axis=None), Z.shape)
+        elif isinstance(act, LeakyReLU):
+            mask = Z < 0
+            Z[mask] *= act.alpha
+            cache = (np.packbits(mask, axis=None), Z.shape)
+        elif isinstance(act, Affine):
+            cache = None
+            if act.slope != 1 or act.intercept != 0:
+                act.fn(Z, out=Z)
+        elif act.output_grad or isinstance(act, Softmax):
+            cache = act.fn(Z, out=Z)
+        else:
+            cache = Z.copy()
+            act.fn(Z, out=Z)
+
+        self.derived_variables["act_cache"] = cache
+        return Z
+
+    def _act_grad(self, dLdY):
+        """
+        Compute the gradient of the loss wrt. the pre-activation Z using the
+        values cached by `_bias_act`.
+        """
+        act = self.act_fn
+        cache = self.derived_variables["act_cache"]
+
+        if isinstance(act, (ReLU, LeakyReLU)):
+            packed, shape = cache
+            n = int(np.prod(shape))
+            mask = np.unpackbits(packed, count=n).reshape(shape).view(bool)
+            if isinstance(act, ReLU):
+                return dLdY * mask
+            dLdZ = dLdY.astype(float)
+            dLdZ[mask] *= act.alpha
+            return dLdZ
+        elif isinstance(act, Affine):
+            return dLdY * act.slope
+        elif isinstance(act, Softmax):
+            # the softmax Jacobian is not diagonal, so apply the full
+            # Jacobian-vector product rather than an elementwise derivative
+            return act.jvp_from_output(cache, dLdY)
+        elif act.output_grad:
+            return dLdY * act.grad_from_output(cache)
+        return dLdY * act.grad(cache)
+
+    def fold_batchnorm(self, batchnorm):
+        """
+        Fold the running statistics and affine parameters of a frozen
+        `BatchNorm1D` / `BatchNorm2D` layer applied to this layer's output into
+        this layer's weights and bias, so that the batchnorm layer can be
+        dropped from the inference graph.
+
+        Equations:
+            Y      = act_fn(X . W + b)          (act_fn affine: a * z + c)
+            BN(Y)  = scaler * (Y - running_mean) / sqrt(running_var + eps) + intercept
+                   = X . W' + b'
+
+            g  = scaler / sqrt(running_var + eps)
+            W' = W * a * g
+            b' = g * (a * b + c - running_mean) + intercept
+
+        Since the batchnorm layer normalizes each output channel independently,
+        this applies to any layer whose output is an affine function of its
+        weights with the output channel along the final axis (e.g.,
+        `FullyConnected`, `Conv1D`, `Conv2D`, `Deconv2D`). The layer's
+        activation must be affine, since BN cannot be moved through a
+        nonlinearity.
+
+        Parameters
+        ----------
+        batchnorm : `BatchNorm1D` or `BatchNorm2D` instance
+            A frozen, initialized batchnorm layer whose input is the output of
+            this layer
+
+        Returns
+        -------
+        self : `LayerBase` instance
+            The layer with the folded weights and an identity activation
+        """
+        bn = batchnorm
+        if "W" not in self.parameters or "b" not in self.parameters:
+            raise ValueError("Cannot fold batchnorm into {}".format(type(self).__name__))
+
+        if not getattr(self, "is_initialized", True) or not bn.is_initialized:
+            raise ValueError("Layers must be initialized before folding")
+
+        if bn.trainable:
+            raise ValueError("Batchnorm layer must be frozen before folding")
+
+        if not isinstance(self.act_fn, Affine):
+            fstr = "Cannot fold batchnorm through the nonlinearity {}"
+            raise ValueError(fstr.format(self.act_fn))
+
+        W, b = self.parameters["W"], self.parameters["b"]
+        a, c = self.act_fn.slope, self.act_fn.intercept
+
+        P = bn.parameters
+        g = P["scaler"] / np.sqrt(P["running_var"] + bn.epsilon)
+        b_new = g * (a * b.ravel() + c - P["running_mean"]) + P["intercept"]
+
+        self.parameters["W"] = W * (a * g)
+        self.parameters["b"] = np.reshape(b_new, b.shape)
+        self.act_fn = Affine(slope=1, intercept=0)
+        return self
+
     def flush_gradients(self):
         assert self.trainable, "Layer is frozen"
         self.X = []
@@ -57,11 +244,25 @@ class LayerBase(ABC):
         for k, v in self.gradients.items():
             self.gradients[k] = np.zeros_like(v)
 
-    def update(self):
+    def update(self, grad_scale=None):
+        """
+        Update the layer parameters using the accrued gradients and the layer
+        optimizer, then flush the gradients.
+
+        Parameters
+        ----------
+        grad_scale : float (default: None)
+            If not None, multiply each gradient by `grad_scale` in place of the
+            optimizer's per-parameter `clip_norm` clipping. Used to apply a
+            global norm clip computed across every layer in a model (see
+            `utils.clip_grad_norm`).
+        """
         assert self.trainable, "Layer is frozen"
         for k, v in self.gradients.items():
             if k in self.parameters:
-                self.parameters[k] = self.optimizer(self.parameters[k], v, k)
+                self.parameters[k] = self.optimizer(
+                    self.parameters[k], v, k, grad_scale=grad_scale
+                )
         self.flush_gradients()
 
     def set_params(self, summary_dict):
@@ -99,10 +300,35 @@ class LayerBase(ABC):
 
 
 class RestrictedBoltzmannMachine(LayerBase):
-    def __init__(self, n_out, K=1, init="glorot_uniform", optimizer=None):
+    def __init__(
+        self,
+        n_out,
+        K=1,
+        persistent=False,
+        n_particles=None,
+        n_temperatures=1,
+        init="glorot_uniform",
+        optimizer=None,
+    ):
         """
         A Restricted Boltzmann machine with Bernoulli visible and hidden units.
 
+        By default, the model is trained with contrastive divergence (CD-k),
+        which restarts the Gibbs chain from the data on each minibatch. If
+        `persistent` is True, the model is instead trained with persistent
+        contrastive divergence (PCD-k), which keeps a set of "fantasy
+        particles" across updates and advances them `K` Gibbs steps per
+        minibatch. See Tieleman (2008) at
+        https://www.cs.toronto.edu/~tijmen/pcd/pcd.pdf.
+
+        If `n_temperatures` > 1, the persistent chains are run with parallel
+        tempering: `n_temperatures` copies of the particles are sampled at
+        inverse temperatures evenly spaced in (0, 1], and adjacent
+        temperatures exchange states via Metropolis swaps after each Gibbs
+        step. Only the chain at temperature 1 contributes to the gradient.
+        See Desjardins et al. (2010) at
+        http://proceedings.mlr.press/v9/desjardins10a/desjardins10a.pdf.
+
         Parameters
         ----------
         n_out : int
@@ -110,6 +336,14 @@ class RestrictedBoltzmannMachine(LayerBase):
         K : int (default: 1)
             The number of contrastive divergence steps to run before computing
             a single gradient update.
+        persistent : bool (default: False)
+            Whether to use persistent contrastive divergence
+        n_particles : int (default: None)
+            The number of persistent fantasy particles. If None, use the size
+            of the first minibatch. Unused if `persistent` is False.
+        n_temperatures : int (default: 1)
+            The number of parallel tempering chains. Unused if `persistent` is
+            False.
         init : str (default: 'glorot_uniform')
             The weight initialization strategy. Valid entries are
             {'glorot_normal', 'glorot_uniform', 'he_normal', 'he_uniform'}
@@ -124,12 +358,18 @@ class RestrictedBoltzmannMachine(LayerBase):
         self.init = init
         self.n_in = None
         self.n_out = n_out
+        self.persistent = persistent
+        self.n_particles = n_particles
+        self.n_temperatures = n_temperatures
         self.act_fn_V = ActivationInitializer("Sigmoid")()
         self.act_fn_H = ActivationInitializer("Sigmoid")()
         self.is_initialized = False
         self.parameters = {"W": None, "b_in": None, "b_out": None}
 
-        self._init_params()
+        # persistent chain states; kept outside `derived_variables` so they
+        # survive `flush_gradients`
+        self.chains = None
+        self.betas = np.linspace(1, 0, n_temperatures, endpoint=False)
 
     def _init_params(self):
         init_weights = WeightInitializer(str(self.act_fn_V), mode=self.init)
@@ -164,9 +404,13 @@ class RestrictedBoltzmannMachine(LayerBase):
             "n_in": self.n_in,
             "n_out": self.n_out,
             "init": self.init,
+            "persistent": self.persistent,
+            "n_particles": self.n_particles,
+            "n_temperatures": self.n_temperatures,
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -222,7 +466,6 @@ class RestrictedBoltzmannMachine(LayerBase):
         K = self.K if K is None else K
 
         W = self.parameters["W"]
-        b_in = self.parameters["b_in"]
         b_out = self.parameters["b_out"]
 
         # compute hidden unit probabilities
@@ -240,9 +483,26 @@ class RestrictedBoltzmannMachine(LayerBase):
         self.derived_variables["p_H"] = p_H
         self.derived_variables["positive_grad"] = positive_grad
 
-        # perform CD-k
-        # TODO: use persistent CD-k
-        # https://www.cs.toronto.edu/~tijmen/pcd/pcd.pdf
+        if self.persistent:
+            p_V_prime, p_H_prime = self._pcd_negative_phase(V, K)
+        else:
+            p_V_prime, p_H_prime = self._gibbs_chain(H, K)
+
+        negative_grad = np.dot(p_V_prime.T, p_H_prime)
+
+        self.derived_variables["p_V_prime"] = p_V_prime
+        self.derived_variables["p_H_prime"] = p_H_prime
+        self.derived_variables["negative_grad"] = negative_grad
+
+    def _gibbs_chain(self, H, K):
+        """
+        Run K steps of block Gibbs sampling starting from the binary hidden
+        states H, returning the final visible and hidden unit probabilities.
+        """
+        W = self.parameters["W"]
+        b_in = self.parameters["b_in"]
+        b_out = self.parameters["b_out"]
+
         H_prime = H.copy()
         for k in range(K):
             # resample v' given h (H_prime is binary for all but final step)
@@ -259,15 +519,74 @@ class RestrictedBoltzmannMachine(LayerBase):
             # if this is the final iteration of CD, keep hidden state
             # probabilities (don't sample)
             H_prime = p_H_prime
-            if k != self.K - 1:
+            if k != K - 1:
                 H_prime = np.random.rand(*p_H_prime.shape) <= p_H_prime
                 H_prime = H_prime.astype(float)
+        return p_V_prime, p_H_prime
 
-        negative_grad = np.dot(p_V_prime.T, p_H_prime)
+    def _pcd_negative_phase(self, V, K):
+        """
+        Advance the persistent fantasy particles K Gibbs steps (with parallel
+        tempering swaps if `n_temperatures` > 1) and return the visible states
+        and hidden unit probabilities of the temperature 1 chain.
+        """
+        W = self.parameters["W"]
+        b_in = self.parameters["b_in"]
+        b_out = self.parameters["b_out"]
 
-        self.derived_variables["p_V_prime"] = p_V_prime
-        self.derived_variables["p_H_prime"] = p_H_prime
-        self.derived_variables["negative_grad"] = negative_grad
+        # initialize the particles from the data
+        if self.chains is None:
+            n_particles = V.shape[0] if self.n_particles is None else self.n_particles
+            ix = np.random.randint(0, V.shape[0], n_particles)
+            V0 = (np.random.rand(n_particles, self.n_in) <= V[ix]).astype(float)
+            self.n_particles = n_particles
+            self.chains = np.repeat(V0[None, :, :], self.n_temperatures, axis=0)
+
+        # inverse temperatures, broadcast over (n_temperatures, n_particles, n)
+        B = self.betas[:, None, None]
+
+        V_c = self.chains
+        for k in range(K):
+            p_H_c = self.act_fn_H.fn(B * (np.matmul(V_c, W) + b_out))
+            H_c = (np.random.rand(*p_H_c.shape) <= p_H_c).astype(float)
+
+            p_V_c = self.act_fn_V.fn(B * (np.matmul(H_c, W.T) + b_in))
+            V_c = (np.random.rand(*p_V_c.shape) <= p_V_c).astype(float)
+
+            if self.n_temperatures > 1:
+                V_c = self._tempering_swaps(V_c, k)
+
+        self.chains = V_c
+        p_H_prime = self.act_fn_H.fn(np.dot(V_c[0], W) + b_out)
+        return V_c[0], p_H_prime
+
+    def _tempering_swaps(self, V_c, step):
+        """
+        Propose swapping the visible states of adjacent temperature chains i
+        and j, accepting each swap with probability
+
+            min(1, p_i(v_j) p_j(v_i) / (p_i(v_i) p_j(v_j)))
+
+        where p_b(v) is the marginal of the tempered RBM at inverse temperature
+        b. Alternates between even and odd pairs on successive steps.
+        """
+        W = self.parameters["W"]
+        b_in = self.parameters["b_in"]
+        b_out = self.parameters["b_out"]
+
+        def log_p(beta, V):
+            # unnormalized log p_b(v) = b * b_in . v + sum(softplus(b * (v . W + b_out)))
+            Z = beta * (np.dot(V, W) + b_out)
+            return beta * np.dot(V, b_in.T)[:, 0] + np.logaddexp(0, Z).sum(axis=1)
+
+        V_c = V_c.copy()
+        for i in range(step % 2, self.n_temperatures - 1, 2):
+            j = i + 1
+            bi, bj, Vi, Vj = self.betas[i], self.betas[j], V_c[i], V_c[j]
+            log_accept = log_p(bi, Vj) + log_p(bj, Vi) - log_p(bi, Vi) - log_p(bj, Vj)
+            swap = np.log(np.random.rand(len(log_accept))) < log_accept
+            V_c[i, swap], V_c[j, swap] = V_c[j, swap], V_c[i, swap]
+        return V_c
 
     def backward(self, *args):
         V = self.derived_variables["V"]
@@ -277,9 +596,16 @@ class RestrictedBoltzmannMachine(LayerBase):
         positive_grad = self.derived_variables["positive_grad"]
         negative_grad = self.derived_variables["negative_grad"]
 
-        self.gradients["b_in"] = V - p_V_prime
-        self.gradients["b_out"] = p_H - p_H_prime
-        self.gradients["W"] = positive_grad - negative_grad
+        # the negative phase may use a different number of samples than the
+        # positive phase (e.g., for PCD), so rescale it to the minibatch size
+        scale = V.shape[0] / p_V_prime.shape[0]
+
+        # gradients of the negative log-likelihood
+        self.gradients["b_in"] = scale * p_V_prime.sum(axis=0, keepdims=True)
+        self.gradients["b_in"] -= V.sum(axis=0, keepdims=True)
+        self.gradients["b_out"] = scale * p_H_prime.sum(axis=0, keepdims=True)
+        self.gradients["b_out"] -= p_H.sum(axis=0, keepdims=True)
+        self.gradients["W"] = scale * negative_grad - positive_grad
 
     def reconstruct(self, X, n_steps=10, return_prob=False):
         """
@@ -309,11 +635,17 @@ class RestrictedBoltzmannMachine(LayerBase):
             true) of the visual input X after running the Gibbs sampler for
             `n_steps`.
         """
-        self.forward(X, K=n_steps)
-        p_V_prime = self.derived_variables["p_V_prime"]
+        if not self.is_initialized:
+            self.n_in = X.shape[1]
+            self._init_params()
 
-        # ignore the gradients produced during this reconstruction
-        self.flush_gradients()
+        W = self.parameters["W"]
+        b_out = self.parameters["b_out"]
+
+        # always start the Gibbs chain from the data, even if training with PCD
+        p_H = self.act_fn_H.fn(np.dot(X, W) + b_out)
+        H = (np.random.rand(*p_H.shape) <= p_H).astype(float)
+        p_V_prime, _ = self._gibbs_chain(H, n_steps)
 
         # sample V_prime reconstruction if return_prob is False
         V = p_V_prime
@@ -321,6 +653,124 @@ class RestrictedBoltzmannMachine(LayerBase):
             V = (np.random.rand(*p_V_prime.shape) <= p_V_prime).astype(float)
         return V
 
+    def sample(
+        self,
+        n_samples,
+        n_chains=None,
+        burn_in=100,
+        thin=1,
+        anneal=None,
+        V0=None,
+        return_prob=False,
+        seed=None,
+    ):
+        """
+        Draw samples from the model by running `n_chains` independent Gibbs
+        chains in parallel as a single batched matrix computation.
+
+        All random numbers are drawn from a single `np.random.Generator`
+        stream into preallocated buffers, and each Gibbs step writes into
+        preallocated activation buffers, so sampling throughput is bound by
+        the two GEMMs per step.
+
+        Parameters
+        ----------
+        n_samples : int
+            The total number of samples to return
+        n_chains : int (default: None)
+            The number of independent chains to run. Each chain contributes
+            ceil(n_samples / n_chains) samples, spaced `thin` steps apart. If
+            None, run one chain per sample.
+        burn_in : int (default: 100)
+            The number of Gibbs steps to discard before collecting samples
+        thin : int (default: 1)
+            The number of Gibbs steps between successive samples from the same
+            chain
+        anneal : float in (0, 1] (default: None)
+            If not None, linearly anneal the inverse temperature of the chains
+            from `anneal` to 1 over the burn-in period, which helps the chains
+            mix between modes. If None, sample at temperature 1 throughout.
+        V0 : numpy array of shape (n_chains, n_in) (default: None)
+            The initial visible states for each chain. If None, initialize each
+            visible unit uniformly at random.
+        return_prob : bool (default: False)
+            Whether to return the real-valued visible unit probabilities at
+            each sampled step rather than the binary samples
+        seed : int or `np.random.Generator` (default: None)
+            The seed or generator to use for the random number stream
+
+        Returns
+        -------
+        V : numpy array of shape (n_samples, n_in)
+            The samples (or visible unit probabilities if `return_prob` is
+            True)
+        """
+        assert self.is_initialized, "Must train the model before sampling"
+
+        rng = np.random.default_rng(seed)
+        n_chains = n_samples if n_chains is None else n_chains
+        n_per_chain = int(np.ceil(n_samples / n_chains))
+        n_steps = burn_in + (n_per_chain - 1) * thin + 1
+
+        W = self.parameters["W"]
+        b_in = self.parameters["b_in"]
+        b_out = self.parameters["b_out"]
+        n_in, n_out = W.shape
+
+        # preallocate the state, activation, and random number buffers
+        V = np.empty((n_chains, n_in))
+        H = np.empty((n_chains, n_out))
+        Z_V, U_V = np.empty_like(V), np.empty_like(V)
+        Z_H, U_H = np.empty_like(H), np.empty_like(H)
+        V_bool, H_bool = np.empty(V.shape, dtype=bool), np.empty(H.shape, dtype=bool)
+
+        if V0 is None:
+            rng.random(out=U_V)
+            np.less_equal(U_V, 0.5, out=V_bool)
+            np.copyto(V, V_bool)
+        else:
+            np.copyto(V, V0)
+
+        def sigmoid_(Z, beta):
+            # in-place logistic sigmoid of beta * Z
+            if beta != 1:
+                Z *= beta
+            np.negative(Z, out=Z)
+            np.exp(Z, out=Z)
+            Z += 1
+            return np.reciprocal(Z, out=Z)
+
+        out = np.empty((n_per_chain * n_chains, n_in))
+        betas = np.ones(n_steps)
+        if anneal is not None and burn_in > 0:
+            betas[:burn_in] = np.linspace(anneal, 1, burn_in)
+
+        n_collected = 0
+        for step in range(n_steps):
+            beta = betas[step]
+
+            # sample h ~ p(h | v)
+            np.dot(V, W, out=Z_H)
+            Z_H += b_out
+            sigmoid_(Z_H, beta)
+            rng.random(out=U_H)
+            np.less_equal(U_H, Z_H, out=H_bool)
+            np.copyto(H, H_bool)
+
+            # sample v ~ p(v | h)
+            np.dot(H, W.T, out=Z_V)
+            Z_V += b_in
+            sigmoid_(Z_V, beta)
+            rng.random(out=U_V)
+            np.less_equal(U_V, Z_V, out=V_bool)
+            np.copyto(V, V_bool)
+
+            if step >= burn_in and (step - burn_in) % thin == 0:
+                ix = slice(n_collected, n_collected + n_chains)
+                np.copyto(out[ix], Z_V if return_prob else V)
+                n_collected += n_chains
+        return out[:n_samples]
+
 
 class Add(LayerBase):
     def __init__(self, act_fn=None, optimizer=None):
@@ -353,6 +803,7 @@ class Add(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -427,6 +878,7 @@ class Multiply(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -549,6 +1001,7 @@ class BatchNorm2D(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -723,6 +1176,7 @@ class BatchNorm1D(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -856,7 +1310,7 @@ class FullyConnected(LayerBase):
         W = init_weights((self.n_in, self.n_out))
 
         self.parameters = {"W": W, "b": b}
-        self.derived_variables = {"Z": None, "Y": None}
+        self.derived_variables = {"act_cache": None}
         self.gradients = {"W": np.zeros_like(W), "b": np.zeros_like(b)}
         self.is_initialized = True
 
@@ -871,10 +1325,11 @@ class FullyConnected(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
-    def forward(self, X):
+    def forward(self, X, retain_derived=True, out=None):
         """
         Compute the layer output on a single minibatch.
 
@@ -886,6 +1341,15 @@ class FullyConnected(LayerBase):
         X : numpy array of shape (n_ex, n_in)
             Layer input, representing the `n_in`-dimensional features for a
             minibatch of `n_ex` examples
+        retain_derived : bool (default: True)
+            Whether to retain the variables calculated during the forward pass
+            for use later during backprop. If False, the layer's state is not
+            modified, which saves memory and makes it safe to run `forward`
+            on a trained layer from several threads at once.
+        out : numpy array of shape (n_ex, n_out) or None (default: None)
+            An optional C-contiguous buffer to write the output into. The
+            bias and activation are applied in place in `out`, which must not
+            overlap with `X`. If None, allocate a new array.
 
         Returns
         -------
@@ -897,19 +1361,18 @@ class FullyConnected(LayerBase):
             self._init_params()
 
         # save input for gradient calc during backward pass
-        self.X = X
+        if retain_derived:
+            self.X = X
 
         # Retrieve parameters
         W = self.parameters["W"]
         b = self.parameters["b"]
 
         # compute next activation state
-        Z = np.dot(X, W) + b
-        Y = self.act_fn.fn(Z)
-        self.derived_variables = {"Z": Z, "Y": Y}
+        Y = self._bias_act(np.dot(X, W, out=out), b, retain_derived)
         return Y
 
-    def backward(self, dLdY):
+    def backward(self, dLdY, out=None):
         """
         Backprop from layer outputs to inputs
 
@@ -917,6 +1380,10 @@ class FullyConnected(LayerBase):
         ----------
         dLdY : numpy array of shape (n_ex, n_out)
             The gradient of the loss wrt. the layer output Y
+        out : numpy array of shape (n_ex, n_in) or None (default: None)
+            An optional C-contiguous buffer to write dLdX into. Must not
+            overlap with `dLdY` or the cached forward-pass values. If None,
+            allocate a new array.
 
         Returns
         -------
@@ -928,18 +1395,158 @@ class FullyConnected(LayerBase):
 
         X = self.X
         W = self.parameters["W"]
-        Z = self.derived_variables["Z"]
 
         # compute gradients
-        dZ = dLdY * self.act_fn.grad(Z)
+        dZ = self._act_grad(dLdY)
         dW = np.dot(X.T, dZ)
         dB = dZ.sum(axis=0, keepdims=True)
-        dX = np.dot(dZ, W.T)
+        dX = np.dot(dZ, W.T, out=out)
+
+        if self.optimizer.requires_factors:
+            self.optimizer.update_factors(X, dZ)
 
         self.gradients = {"W": dW, "b": dB, "Z": dZ, "Y": dLdY}
         return dX
 
 
+class Embedding(LayerBase):
+    def __init__(
+        self, n_out, vocab_size, pool=None, init="glorot_uniform", optimizer=None
+    ):
+        """
+        An embedding layer. Maps each integer token ID in the input to a
+        learned `n_out`-dimensional vector.
+
+        Equations:
+            Y[i, t] = W[X[i, t]]
+
+        Unlike `FullyConnected` on one-hot inputs, the backward pass only
+        touches the rows of W for the tokens in the batch. The gradient wrt. W
+        is stored as a sparse `(row indices, row gradients)` tuple, which the
+        optimizers apply to the touched rows only, so the cost of each training
+        step scales with the number of tokens in the batch rather than
+        `vocab_size`.
+
+        Parameters
+        ----------
+        n_out : int
+            The dimensionality of the embeddings
+        vocab_size : int
+            The total number of items in the vocabulary. Token IDs must lie in
+            [0, vocab_size).
+        pool : str (default: None)
+            The pooling operation to apply over the token axis. Valid entries
+            are {None, 'sum', 'mean'}. If None, return the embedding for each
+            token.
+        init : str (default: 'glorot_uniform')
+            The weight initialization strategy. Valid entries are
+            {'glorot_normal', 'glorot_uniform', 'he_normal', 'he_uniform'}
+        optimizer : str or `OptimizerBase` instance (default: None)
+            The optimization strategy to use when performing gradient updates
+            within the `update` method.  If `None`, use the `SGD` optimizer with
+            default parameters.
+        """
+        super().__init__(optimizer)
+
+        if pool not in [None, "sum", "mean"]:
+            raise ValueError("Unrecognized pool: {}".format(pool))
+
+        self.init = init
+        self.pool = pool
+        self.n_out = n_out
+        self.vocab_size = vocab_size
+        self.parameters = {"W": None}
+        self.is_initialized = False
+        self._init_params()
+
+    def _init_params(self):
+        init_weights = WeightInitializer("Affine(slope=1, intercept=0)", mode=self.init)
+        W = init_weights((self.vocab_size, self.n_out))
+
+        self.parameters = {"W": W}
+        self.derived_variables = {}
+        self.gradients = {"W": self._empty_grad()}
+        self.is_initialized = True
+
+    def _empty_grad(self):
+        return (np.zeros(0, dtype=int), np.zeros((0, self.n_out)))
+
+    @property
+    def hyperparameters(self):
+        return {
+            "layer": "Embedding",
+            "init": self.init,
+            "pool": self.pool,
+            "n_out": self.n_out,
+            "vocab_size": self.vocab_size,
+            "optimizer": {
+                "cache": self.optimizer.cache,
+                "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
+            },
+        }
+
+    def forward(self, X):
+        """
+        Compute the layer output on a single minibatch.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, n_t)
+            The integer token IDs for each of the `n_t` tokens in each of the
+            `n_ex` examples
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, n_t, n_out) or (n_ex, n_out)
+            The embeddings for each token. If `pool` is not None, the embeddings
+            are pooled over the token axis.
+        """
+        self.X = X
+        Y = self.parameters["W"][X]
+
+        if self.pool == "sum":
+            Y = Y.sum(axis=1)
+        elif self.pool == "mean":
+            Y = Y.mean(axis=1)
+        return Y
+
+    def backward(self, dLdY):
+        """
+        Compute the (sparse) gradient of the loss wrt. the embedding weights.
+        Since the layer inputs are discrete, there is no gradient wrt. X.
+
+        Parameters
+        ----------
+        dLdY : numpy array of shape (n_ex, n_t, n_out) or (n_ex, n_out)
+            The gradient of the loss wrt. the layer output
+        """
+        assert self.trainable, "Layer is frozen"
+
+        X = self.X
+        n_ex, n_t = X.shape
+
+        # gradient wrt. the embedding of each token in the batch
+        if self.pool is None:
+            dTok = dLdY.reshape(-1, self.n_out)
+        else:
+            dTok = np.repeat(dLdY, n_t, axis=0)
+            if self.pool == "mean":
+                dTok = dTok / n_t
+
+        # sum the gradients for repeated tokens
+        ix, inv = np.unique(X.ravel(), return_inverse=True)
+        dW = np.zeros((len(ix), self.n_out))
+        np.add.at(dW, inv.ravel(), dTok)
+
+        self.gradients["W"] = (ix, dW)
+
+    def flush_gradients(self):
+        assert self.trainable, "Layer is frozen"
+        self.X = []
+        self.gradients = {"W": self._empty_grad()}
+
+
 class RNNCell(LayerBase):
     def __init__(self, n_out, act_fn="Tanh", init="glorot_uniform", optimizer=None):
         """
@@ -1015,6 +1622,7 @@ class RNNCell(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -1113,7 +1721,10 @@ class RNNCell(LayerBase):
 
         # compute gradient components at timestep t
         dA = dLdAt + dA_acc
-        dZ = self.act_fn.grad(Zs[t]) * dA
+        if self.act_fn.output_grad:
+            dZ = self.act_fn.grad_from_output(As[t + 1]) * dA
+        else:
+            dZ = self.act_fn.grad(Zs[t]) * dA
         dXt = np.dot(dZ, Wax.T)
 
         # update parameter gradients with signal from current step
@@ -1135,6 +1746,7 @@ class RNNCell(LayerBase):
 
         self.derived_variables["n_timesteps"] = 0
         self.derived_variables["current_step"] = 0
+        self.derived_variables["dLdA_accumulator"] = None
 
         # reset parameter gradients to 0
         for k, v in self.parameters.items():
@@ -1290,6 +1902,7 @@ class LSTMCell(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -1418,20 +2031,32 @@ class LSTMCell(LayerBase):
         # Gradient calculations
         # ---------------------
 
-        dA = dLdAt + dA_acc
-        dC = dC_acc + dA * Got * self.act_fn.grad(Ct)
+        # derivatives of the gate and cell activations. when possible these
+        # are computed from the cached activation outputs, which avoids
+        # recomputing the gate pre-activations
+        act_Ct = self.act_fn.fn(Ct)
+        if self.gate_fn.output_grad:
+            dGo, dGf, dGu = [self.gate_fn.grad_from_output(G) for G in [Got, Gft, Gut]]
+        else:
+            dGo = self.gate_fn.grad(np.dot(Zt, Wo) + bo)
+            dGf = self.gate_fn.grad(np.dot(Zt, Wf) + bf)
+            dGu = self.gate_fn.grad(np.dot(Zt, Wu) + bu)
+
+        if self.act_fn.output_grad:
+            dAct = self.act_fn.grad_from_output(act_Ct)
+            dCc = self.act_fn.grad_from_output(Cct)
+        else:
+            dAct = self.act_fn.grad(Ct)
+            dCc = self.act_fn.grad(np.dot(Zt, Wc) + bc)
 
-        # compute the input to the gate functions at timestep t
-        _Go = np.dot(Zt, Wo) + bo
-        _Gf = np.dot(Zt, Wf) + bo
-        _Gu = np.dot(Zt, Wu) + bo
-        _Gc = np.dot(Zt, Wc) + bc
+        dA = dLdAt + dA_acc
+        dC = dC_acc + dA * Got * dAct
 
         # compute gradients wrt the *input* to each gate
-        dGot = dA * self.act_fn.fn(Ct) * self.gate_fn.grad(_Go)
-        dCct = dC * Gut * self.act_fn.grad(_Gc)
-        dGut = dC * Cct * self.gate_fn.grad(_Gu)
-        dGft = dC * C_prev * self.gate_fn.grad(_Gf)
+        dGot = dA * act_Ct * dGo
+        dCct = dC * Gut * dCc
+        dGut = dC * Cct * dGu
+        dGft = dC * C_prev * dGf
 
         dZ = (
             np.dot(dGft, Wf.T)
@@ -1464,6 +2089,8 @@ class LSTMCell(LayerBase):
 
         self.derived_variables["n_timesteps"] = 0
         self.derived_variables["current_step"] = 0
+        self.derived_variables["dLdA_accumulator"] = None
+        self.derived_variables["dLdC_accumulator"] = None
 
         # reset parameter gradients to 0
         for k, v in self.parameters.items():
@@ -1520,28 +2147,34 @@ class Pool2D(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
-    def forward(self, X):
+    def forward(self, X, retain_derived=True):
         """
-        Backprop from layer outputs to inputs
+        Compute the layer output given input volume `X`.
 
         Parameters
         ----------
-        dLdY : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
-            The gradient of the loss wrt. the layer output Y
+        X : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
+            The input volume consisting of `n_ex` examples, each with dimension
+            (in_rows x in_cols x in_ch)
+        retain_derived : bool (default: True)
+            Whether to retain the variables calculated during the forward pass
+            for use later during backprop. If False, the layer's state is not
+            modified, which saves memory and makes it safe to run `forward`
+            on a trained layer from several threads at once.
 
         Returns
         -------
-        dX : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
-            The gradient of the loss wrt. the layer input X
+        Y : numpy array of shape (n_ex, out_rows, out_cols, out_ch)
+            The layer output
         """
         if not self.is_initialized:
             self.in_ch = self.out_ch = X.shape[3]
             self._init_params()
 
-        self.X = X
         n_ex, in_rows, in_cols, nc_in = X.shape
         (fr, fc), s, p = self.kernel_shape, self.stride, self.pad
         X_pad, (pr1, pr2, pc1, pc2) = pad2D(X, p, self.kernel_shape, s)
@@ -1549,8 +2182,10 @@ class Pool2D(LayerBase):
         out_rows = np.floor(1 + (in_rows + pr1 + pr2 - fr) / s).astype(int)
         out_cols = np.floor(1 + (in_cols + pc1 + pc2 - fc) / s).astype(int)
 
-        self.derived_variables["out_rows"] = out_rows
-        self.derived_variables["out_cols"] = out_cols
+        if retain_derived:
+            self.X = X
+            self.derived_variables["out_rows"] = out_rows
+            self.derived_variables["out_cols"] = out_cols
 
         if self.mode == "max":
             pool_fn = np.max
@@ -1649,11 +2284,13 @@ class Flatten(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
-    def forward(self, X):
-        self.in_dims = X.shape
+    def forward(self, X, retain_derived=True):
+        if retain_derived:
+            self.in_dims = X.shape
         if self.keep_dim == -1:
             return X.flatten().reshape(1, -1)
         rs = (X.shape[0], -1) if self.keep_dim == "first" else (-1, X.shape[-1])
@@ -1726,6 +2363,7 @@ class Conv1D(LayerBase):
         self.act_fn = ActivationInitializer(act_fn)()
         self.parameters = {"W": None, "b": None}
         self.is_initialized = False
+        self.reset_stream()
 
     def _init_params(self):
         init_weights = WeightInitializer(str(self.act_fn), mode=self.init)
@@ -1736,7 +2374,7 @@ class Conv1D(LayerBase):
         self.parameters = {"W": W, "b": b}
 
         self.gradients = {"W": np.zeros_like(W), "b": np.zeros_like(b)}
-        self.derived_variables = {"Z": None, "out_rows": None, "out_cols": None}
+        self.derived_variables = {"act_cache": None, "out_rows": None, "out_cols": None}
         self.is_initialized = True
 
     @property
@@ -1754,6 +2392,7 @@ class Conv1D(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -1783,22 +2422,28 @@ class Conv1D(LayerBase):
         n_ex, l_in, in_ch = X.shape
         s, p, d = self.stride, self.pad, self.dilation
 
-        # pad the input and perform the forward convolution
-        Z = conv1D(X, W, s, p, d) + b
-        Y = self.act_fn.fn(Z)
+        if p == "causal" and s == 1:
+            # use the same per-frame product as `forward_stream`, so that
+            # streaming and offline outputs are bitwise identical
+            X_pad, _ = pad1D(X, ((self.kernel_width - 1) * (d + 1), 0))
+            Z = self._frame_conv(X_pad, np.arange(l_in))
+        else:
+            # pad the input and perform the forward convolution
+            Z = conv1D(X, W, s, p, d)
+
+        Y = self._bias_act(Z, b)
 
-        self.derived_variables["out_rows"] = Z.shape[1]
-        self.derived_variables["out_cols"] = Z.shape[2]
-        self.derived_variables["Z"] = Z
+        self.derived_variables["out_rows"] = Y.shape[1]
+        self.derived_variables["out_cols"] = Y.shape[2]
 
         return Y
 
     def backward(self, dLdY):
         """
         Compute the gradient of the loss with respect to the layer parameters.
-        Relies on `im2col` and `col2im` to vectorize the gradient calculation.
-        See the private method `_backward_naive` for a more straightforward
-        implementation.
+        Relies on `im2col_1D` and `col2im_1D` to vectorize the gradient
+        calculation. See the private method `_backward_naive` for a more
+        straightforward implementation.
 
         Parameters
         ----------
@@ -1812,39 +2457,111 @@ class Conv1D(LayerBase):
         """
         X = self.X
         W = self.parameters["W"]
-        Z = self.derived_variables["Z"]
 
-        # add a row dimension to X, W, and dZ to permit us to use im2col/col2im
-        X2D = np.expand_dims(X, axis=1)
-        W2D = np.expand_dims(W, axis=0)
-        dLdZ = np.expand_dims(dLdY * self.act_fn.grad(Z), axis=1)
+        fw, in_ch, out_ch = W.shape
+        s, d = self.stride, self.dilation
 
-        d = self.dilation
-        fr, fc, in_ch, out_ch = W2D.shape
-        n_ex, l_out, out_ch = dLdY.shape
-        fr, fc, s = 1, self.kernel_width, self.stride
+        # columnize X and dLdZ
+        dLdZ = self._act_grad(dLdY)
+        X_col, p = im2col_1D(X, W.shape, self.pad, s, d)
 
-        # use pad1D here in order to correctly handle self.pad = 'causal',
-        # which isn't defined for pad2D
-        _, p = pad1D(X, self.pad, self.kernel_width, s, d)
-        p2D = (0, 0, p[0], p[1])
-
-        # columnize W, X, and dLdY
-        dLdZ_col = dLdZ.transpose(3, 1, 2, 0).reshape(out_ch, -1)
-        W_col = W2D.transpose(3, 2, 0, 1).reshape(out_ch, -1).T
-        X_col, _ = im2col(X2D, W2D.shape, p2D, s, d)
+        n_ex, l_out = X_col.shape[:2]
+        X_col = X_col.reshape(n_ex * l_out, fw * in_ch)
+        dLdZ_col = dLdZ.reshape(n_ex * l_out, out_ch)
 
         # compute gradients via matrix multiplication and reshape
-        dB = dLdZ_col.sum(axis=1).reshape(1, 1, -1)
-        dW = dLdZ_col.dot(X_col.T).reshape(out_ch, in_ch, fr, fc).transpose(2, 3, 1, 0)
+        dB = dLdZ_col.sum(axis=0).reshape(1, 1, -1)
+        dW = np.dot(X_col.T, dLdZ_col).reshape(fw, in_ch, out_ch)
 
-        # reshape columnized dX back into the same format as the input volume
-        dX_col = np.dot(W_col, dLdZ_col)
-        dX = col2im(dX_col, X2D.shape, W2D.shape, p2D, s, d).transpose(0, 2, 3, 1)
+        # sum the columnized dX back into the same format as the input volume
+        dX_col = np.dot(dLdZ_col, W.reshape(fw * in_ch, out_ch).T)
+        dX = col2im_1D(dX_col.reshape(n_ex, l_out, fw, in_ch), X.shape, W.shape, p, s, d)
 
-        self.gradients["W"] = np.squeeze(dW, axis=0)
+        self.gradients["W"] = dW
         self.gradients["b"] = dB
-        return np.squeeze(dX, axis=1)
+        return dX
+
+    def _frame_conv(self, X, start):
+        """
+        Compute the (pre-activation) output frame for each window of `X`
+        beginning at `start`, for a unit stride. Indices past the end of `X`
+        wrap around, so `X` may be a ring buffer.
+        """
+        W = self.parameters["W"]
+        fw, in_ch, out_ch = W.shape
+
+        # gather the dilated kernel taps for each output frame
+        taps = np.arange(fw) * (self.dilation + 1)
+        ix = (start[:, None] + taps[None, :]) % X.shape[1]
+        X_col = X[:, ix].reshape(X.shape[0], len(start), 1, fw * in_ch)
+
+        # a stacked matmul keeps each frame's product independent of the
+        # number of frames
+        return np.matmul(X_col, W.reshape(fw * in_ch, out_ch))[:, :, 0]
+
+    def reset_stream(self):
+        """
+        Clear the input history used by `forward_stream`. Call before
+        processing a new stream.
+        """
+        self._stream_buffer = None
+        self._stream_pos = 0
+
+    def forward_stream(self, X):
+        """
+        Compute the layer output for the next chunk of a stream, for causal
+        convolutions with unit stride.
+
+        The layer keeps the last `(kernel_width - 1) * (dilation + 1)` input
+        frames from previous calls in a ring buffer, so each chunk is
+        convolved with its own context without re-sending (or re-padding)
+        overlapping input. Before the first chunk the history is zero, as with
+        causal padding.
+
+        Each output frame is computed by the same matrix-vector product as in
+        `forward`, regardless of how the stream is chunked, so the
+        concatenated output is bitwise identical to `forward` on the
+        concatenated stream.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, l_chunk, in_ch)
+            The next `l_chunk` frames of the stream for each example
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, l_chunk, out_ch)
+            The layer output for the chunk
+        """
+        if self.pad != "causal" or self.stride != 1:
+            raise ValueError("Streaming requires pad='causal' and stride=1")
+
+        if not self.is_initialized:
+            self.in_ch = X.shape[2]
+            self._init_params()
+
+        b = self.parameters["b"]
+        n_ex, l_chunk, in_ch = X.shape
+        context = (self.kernel_width - 1) * (self.dilation + 1)
+
+        buf, pos = self._stream_buffer, self._stream_pos
+        if buf is not None and buf.shape[0] != n_ex:
+            fstr = "Stream has {} examples but the chunk has {}"
+            raise ValueError(fstr.format(buf.shape[0], n_ex))
+
+        if buf is None or buf.shape[1] < context + l_chunk:
+            # (re)allocate the ring, keeping the history at its start
+            ring = np.zeros((n_ex, context + l_chunk, in_ch), dtype=X.dtype)
+            if buf is not None:
+                ring[:, :context] = buf[:, (pos - context + np.arange(context)) % buf.shape[1]]
+            buf, pos = ring, context
+
+        size = buf.shape[1]
+        buf[:, (pos + np.arange(l_chunk)) % size] = X
+
+        Z = self._frame_conv(buf, pos - context + np.arange(l_chunk))
+        self._stream_buffer, self._stream_pos = buf, (pos + l_chunk) % size
+        return self._bias_act(Z, b, retain_derived=False)
 
     def _backward_naive(self, dLdY):
         """
@@ -1863,14 +2580,13 @@ class Conv1D(LayerBase):
         """
         W = self.parameters["W"]
         b = self.parameters["b"]
-        Z = self.derived_variables["Z"]
 
         X, d = self.X, self.dilation
         n_ex, l_out, out_ch = dLdY.shape
         fw, s, p = self.kernel_width, self.stride, self.pad
         X_pad, (pr1, pr2) = pad1D(X, p, self.kernel_width, s, d)
 
-        dZ = dLdY * self.act_fn.grad(Z)
+        dZ = self._act_grad(dLdY)
 
         dX = np.zeros_like(X_pad)
         dW, dB = np.zeros_like(W), np.zeros_like(b)
@@ -1903,6 +2619,7 @@ class Conv2D(LayerBase):
         pad=0,
         stride=1,
         dilation=0,
+        groups=1,
         act_fn=None,
         init="glorot_uniform",
         optimizer=None,
@@ -1935,6 +2652,12 @@ class Conv2D(LayerBase):
             Number of pixels inserted between kernel elements. Effective kernel
             shape after dilation is:
                 [kernel_rows * (d + 1) - d, kernel_cols * (d + 1) - d]
+        groups : int (default: 1)
+            The number of groups to split the input and output channels into.
+            Each group of out_ch // groups filters only sees its own group of
+            in_ch // groups input channels, reducing the parameters and FLOPs
+            by a factor of `groups`. If groups = in_ch, this is a depthwise
+            convolution. Both in_ch and out_ch must be divisible by `groups`.
         init : str (default: 'glorot_uniform')
             The weight initialization strategy. Valid entries are
             {'glorot_normal', 'glorot_uniform', 'he_normal', 'he_uniform'}
@@ -1950,6 +2673,7 @@ class Conv2D(LayerBase):
         self.in_ch = None
         self.out_ch = out_ch
         self.stride = stride
+        self.groups = groups
         self.dilation = dilation
         self.kernel_shape = kernel_shape
         self.act_fn = ActivationInitializer(act_fn)()
@@ -1959,13 +2683,17 @@ class Conv2D(LayerBase):
     def _init_params(self):
         init_weights = WeightInitializer(str(self.act_fn), mode=self.init)
 
+        if self.in_ch % self.groups or self.out_ch % self.groups:
+            fstr = "in_ch ({}) and out_ch ({}) must be divisible by groups ({})"
+            raise ValueError(fstr.format(self.in_ch, self.out_ch, self.groups))
+
         fr, fc = self.kernel_shape
-        W = init_weights((fr, fc, self.in_ch, self.out_ch))
+        W = init_weights((fr, fc, self.in_ch // self.groups, self.out_ch))
         b = np.zeros((1, 1, 1, self.out_ch))
 
         self.parameters = {"W": W, "b": b}
         self.gradients = {"W": np.zeros_like(W), "b": np.zeros_like(b)}
-        self.derived_variables = {"Z": None, "out_rows": None, "out_cols": None}
+        self.derived_variables = {"act_cache": None, "out_rows": None, "out_cols": None}
         self.is_initialized = True
 
     @property
@@ -1977,16 +2705,18 @@ class Conv2D(LayerBase):
             "in_ch": self.in_ch,
             "out_ch": self.out_ch,
             "stride": self.stride,
+            "groups": self.groups,
             "dilation": self.dilation,
             "act_fn": str(self.act_fn),
             "kernel_shape": self.kernel_shape,
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
-    def forward(self, X):
+    def forward(self, X, retain_derived=True):
         """
         Compute the layer output given input volume `X`.
 
@@ -1995,6 +2725,11 @@ class Conv2D(LayerBase):
         X : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
             The input volume consisting of `n_ex` examples, each with dimension
             (in_rows x in_cols x in_ch)
+        retain_derived : bool (default: True)
+            Whether to retain the variables calculated during the forward pass
+            for use later during backprop. If False, the layer's state is not
+            modified, which saves memory and makes it safe to run `forward`
+            on a trained layer from several threads at once.
 
         Returns
         -------
@@ -2005,21 +2740,19 @@ class Conv2D(LayerBase):
             self.in_ch = X.shape[3]
             self._init_params()
 
-        self.X = X
-
         W = self.parameters["W"]
         b = self.parameters["b"]
 
         n_ex, in_rows, in_cols, in_ch = X.shape
-        s, p, d = self.stride, self.pad, self.dilation
+        s, p, d, g = self.stride, self.pad, self.dilation, self.groups
 
         # pad the input and perform the forward convolution
-        Z = conv2D(X, W, s, p, d) + b
-        Y = self.act_fn.fn(Z)
+        Y = self._bias_act(conv2D(X, W, s, p, d, g), b, retain_derived)
 
-        self.derived_variables["out_rows"] = Z.shape[1]
-        self.derived_variables["out_cols"] = Z.shape[2]
-        self.derived_variables["Z"] = Z
+        if retain_derived:
+            self.X = X
+            self.derived_variables["out_rows"] = Y.shape[1]
+            self.derived_variables["out_cols"] = Y.shape[2]
 
         return Y
 
@@ -2042,27 +2775,54 @@ class Conv2D(LayerBase):
         """
         X = self.X
         W = self.parameters["W"]
-        Z = self.derived_variables["Z"]
 
-        d = self.dilation
+        d, g = self.dilation, self.groups
         fr, fc, in_ch, out_ch = W.shape
         n_ex, out_rows, out_cols, out_ch = dLdY.shape
         (fr, fc), s, p = self.kernel_shape, self.stride, self.pad
 
         # columnize W, X, and dLdY
-        dLdZ = dLdY * self.act_fn.grad(Z)
+        dLdZ = self._act_grad(dLdY)
         dLdZ_col = dLdZ.transpose(3, 1, 2, 0).reshape(out_ch, -1)
-        W_col = W.transpose(3, 2, 0, 1).reshape(out_ch, -1).T
         X_col, p = im2col(X, W.shape, p, s, d)
 
         # compute gradients via matrix multiplication and reshape
         dB = dLdZ_col.sum(axis=1).reshape(1, 1, 1, -1)
-        dW = dLdZ_col.dot(X_col.T).reshape(out_ch, in_ch, fr, fc).transpose(2, 3, 1, 0)
+
+        if g == 1:
+            W_col = W.transpose(3, 2, 0, 1).reshape(out_ch, -1).T
+            dW = dLdZ_col.dot(X_col.T).reshape(out_ch, in_ch, fr, fc).transpose(2, 3, 1, 0)
+            dX_col = np.dot(W_col, dLdZ_col)
+        else:
+            # one batched matmul over the groups; the rows of X_col for each
+            # group of input channels are contiguous
+            out_g = out_ch // g
+            M = dLdZ_col.shape[1]
+            X_col = X_col.reshape(g, -1, M)
+            dLdZ_col = dLdZ_col.reshape(g, out_g, M)
+            W_col = W.reshape(fr, fc, in_ch, g, out_g).transpose(3, 4, 2, 0, 1)
+            W_col = W_col.reshape(g, out_g, -1)
+
+            dW = np.matmul(dLdZ_col, X_col.transpose(0, 2, 1))
+            dW = dW.reshape(g, out_g, in_ch, fr, fc).transpose(3, 4, 2, 0, 1)
+            dW = dW.reshape(fr, fc, in_ch, out_ch)
+            dX_col = np.matmul(W_col.transpose(0, 2, 1), dLdZ_col).reshape(-1, M)
 
         # reshape columnized dX back into the same format as the input volume
-        dX_col = np.dot(W_col, dLdZ_col)
         dX = col2im(dX_col, X.shape, W.shape, p, s, d).transpose(0, 2, 3, 1)
 
+        if self.optimizer.requires_factors:
+            # reorder the patch features to match the rows of
+            # W.reshape(fr * fc * in_ch, out_ch), with one set of factors per
+            # group
+            if g == 1:
+                a = X_col.reshape(in_ch, fr, fc, -1).transpose(3, 1, 2, 0)
+                self.optimizer.update_factors(a.reshape(-1, fr * fc * in_ch), dLdZ_col.T)
+            else:
+                a = X_col.reshape(g, in_ch, fr, fc, -1).transpose(0, 4, 2, 3, 1)
+                a = a.reshape(g, -1, fr * fc * in_ch)
+                self.optimizer.update_factors(a, dLdZ_col.transpose(0, 2, 1))
+
         self.gradients["W"] = dW
         self.gradients["b"] = dB
         return dX
@@ -2084,14 +2844,16 @@ class Conv2D(LayerBase):
         """
         W = self.parameters["W"]
         b = self.parameters["b"]
-        Z = self.derived_variables["Z"]
 
         X, d = self.X, self.dilation
         n_ex, out_rows, out_cols, out_ch = dLdY.shape
         (fr, fc), s, p = self.kernel_shape, self.stride, self.pad
         X_pad, (pr1, pr2, pc1, pc2) = pad2D(X, p, self.kernel_shape, s, d)
 
-        dZ = dLdY * self.act_fn.grad(Z)
+        # each filter only sees the input channels of its own group
+        in_g, out_g = W.shape[2], out_ch // self.groups
+
+        dZ = self._act_grad(dLdY)
 
         dX = np.zeros_like(X_pad)
         dW, dB = np.zeros_like(W), np.zeros_like(b)
@@ -2103,13 +2865,14 @@ class Conv2D(LayerBase):
                         i0, i1 = i * s, (i * s) + fr * (d + 1) - d
                         j0, j1 = j * s, (j * s) + fc * (d + 1) - d
 
+                        k0 = (c // out_g) * in_g
                         wc = W[:, :, :, c]
                         kernel = dZ[m, i, j, c]
-                        window = X_pad[m, i0 : i1 : (d + 1), j0 : j1 : (d + 1), :]
+                        window = X_pad[m, i0 : i1 : (d + 1), j0 : j1 : (d + 1), k0 : k0 + in_g]
 
                         dB[:, :, :, c] += kernel
                         dW[:, :, :, c] += window * kernel
-                        dX[m, i0 : i1 : (d + 1), j0 : j1 : (d + 1), :] += wc * kernel
+                        dX[m, i0 : i1 : (d + 1), j0 : j1 : (d + 1), k0 : k0 + in_g] += wc * kernel
 
         self.gradients["W"] = dW
         self.gradients["b"] = dB
@@ -2120,6 +2883,231 @@ class Conv2D(LayerBase):
         return dX
 
 
+class DepthwiseSeparableConv2D(LayerBase):
+    def __init__(
+        self,
+        out_ch,
+        kernel_shape,
+        pad=0,
+        stride=1,
+        dilation=0,
+        depth_multiplier=1,
+        act_fn=None,
+        init="glorot_uniform",
+        optimizer=None,
+    ):
+        """
+        A depthwise-separable 2D convolution: a depthwise convolution, which
+        convolves each input channel with its own `depth_multiplier` spatial
+        kernels, followed by a 1x1 (pointwise) convolution mixing the
+        resulting channels.
+
+        Equations:
+            Z_dw = depthwise(pad(X), W_depthwise)
+            out  = act_fn(Z_dw . W_pointwise + b)
+
+        Compared to a `Conv2D` layer with the same kernel shape, this uses
+
+            in_ch * dm * (kernel_rows * kernel_cols + out_ch)
+
+        weights rather than in_ch * kernel_rows * kernel_cols * out_ch, where
+        dm is the depth multiplier. Both stages are fused in column layout:
+        the depthwise stage is a single batched matmul over the channels of
+        the `im2col` patches, and its output feeds the pointwise GEMM directly,
+        without being reshaped back into an image.
+
+        Parameters
+        ----------
+        out_ch : int
+            The number of output channels of the pointwise convolution
+        kernel_shape : 2-tuple
+            The dimension of a single 2D depthwise kernel
+        pad : int, tuple, or 'same' (default: 0)
+            The number of rows/columns to zero-pad the input with
+        stride : int (default: 1)
+            The stride/hop of the depthwise kernels as they move over the
+            input volume
+        dilation : int (default: 0)
+            Number of pixels inserted between depthwise kernel elements
+        depth_multiplier : int (default: 1)
+            The number of depthwise kernels applied to each input channel. The
+            depthwise stage produces in_ch * depth_multiplier channels.
+        act_fn : str or `activations.ActivationBase` instance (default: None)
+            The activation function applied to the output of the pointwise
+            convolution. If `None`, use the identity function f(X) = X by
+            default
+        init : str (default: 'glorot_uniform')
+            The weight initialization strategy. Valid entries are
+            {'glorot_normal', 'glorot_uniform', 'he_normal', 'he_uniform'}
+        optimizer : str or `OptimizerBase` instance (default: None)
+            The optimization strategy to use when performing gradient updates
+            within the `update` method.  If `None`, use the `SGD` optimizer with
+            default parameters.
+        """
+        super().__init__(optimizer)
+
+        self.pad = pad
+        self.init = init
+        self.in_ch = None
+        self.out_ch = out_ch
+        self.stride = stride
+        self.dilation = dilation
+        self.kernel_shape = kernel_shape
+        self.depth_multiplier = depth_multiplier
+        self.act_fn = ActivationInitializer(act_fn)()
+        self.parameters = {"W_depthwise": None, "W_pointwise": None, "b": None}
+        self.is_initialized = False
+
+    def _init_params(self):
+        init_weights = WeightInitializer(str(self.act_fn), mode=self.init)
+
+        fr, fc = self.kernel_shape
+        dm = self.depth_multiplier
+        W_dw = init_weights((fr, fc, self.in_ch, dm))
+        W_pw = init_weights((self.in_ch * dm, self.out_ch))
+        b = np.zeros((1, 1, 1, self.out_ch))
+
+        self.parameters = {"W_depthwise": W_dw, "W_pointwise": W_pw, "b": b}
+        self.gradients = {k: np.zeros_like(v) for k, v in self.parameters.items()}
+        self.derived_variables = {
+            "act_cache": None,
+            "Z_depthwise": None,
+            "out_rows": None,
+            "out_cols": None,
+        }
+        self.is_initialized = True
+
+    @property
+    def hyperparameters(self):
+        return {
+            "layer": "DepthwiseSeparableConv2D",
+            "pad": self.pad,
+            "init": self.init,
+            "in_ch": self.in_ch,
+            "out_ch": self.out_ch,
+            "stride": self.stride,
+            "dilation": self.dilation,
+            "depth_multiplier": self.depth_multiplier,
+            "act_fn": str(self.act_fn),
+            "kernel_shape": self.kernel_shape,
+            "optimizer": {
+                "cache": self.optimizer.cache,
+                "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
+            },
+        }
+
+    def _W_shape(self):
+        fr, fc = self.kernel_shape
+        return (fr, fc, self.in_ch, self.in_ch * self.depth_multiplier)
+
+    def _W_dw_col(self):
+        # (in_ch, dm, fr * fc), matching the per-channel row blocks of im2col
+        W_dw = self.parameters["W_depthwise"]
+        fr, fc, in_ch, dm = W_dw.shape
+        return W_dw.transpose(2, 3, 0, 1).reshape(in_ch, dm, fr * fc)
+
+    def forward(self, X, retain_derived=True):
+        """
+        Compute the layer output given input volume `X`.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
+            The input volume consisting of `n_ex` examples, each with dimension
+            (in_rows x in_cols x in_ch)
+        retain_derived : bool (default: True)
+            Whether to retain the variables calculated during the forward pass
+            for use later during backprop. If False, the layer's state is not
+            modified, which saves memory and makes it safe to run `forward`
+            on a trained layer from several threads at once.
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, out_rows, out_cols, out_ch)
+            The layer output
+        """
+        if not self.is_initialized:
+            self.in_ch = X.shape[3]
+            self._init_params()
+
+        W_pw = self.parameters["W_pointwise"]
+        b = self.parameters["b"]
+
+        n_ex, in_rows, in_cols, in_ch = X.shape
+        s, d, W_shape = self.stride, self.dilation, self._W_shape()
+        p, out_rows, out_cols = plan_conv2D(X.shape, W_shape, s, self.pad, d)
+
+        # depthwise: one (dm x fr*fc) . (fr*fc x M) product per input channel
+        X_col, _ = im2col(X, W_shape, p, s, d)
+        M = X_col.shape[1]
+        X_col = X_col.reshape(in_ch, -1, M)
+        Z_dw = np.matmul(self._W_dw_col(), X_col).reshape(-1, M)
+
+        # pointwise: a single GEMM on the columnized depthwise output
+        Z = (
+            np.dot(W_pw.T, Z_dw)
+            .reshape(self.out_ch, out_rows, out_cols, n_ex)
+            .transpose(3, 1, 2, 0)
+        )
+        Y = self._bias_act(Z, b, retain_derived)
+
+        if retain_derived:
+            self.X = X
+            self.derived_variables["Z_depthwise"] = Z_dw
+            self.derived_variables["out_rows"] = out_rows
+            self.derived_variables["out_cols"] = out_cols
+
+        return Y
+
+    def backward(self, dLdY):
+        """
+        Compute the gradient of the loss with respect to the layer parameters.
+        Both stages are backpropagated in column layout, using batched matrix
+        products for the depthwise stage and `col2im` to recover dX.
+
+        Parameters
+        ----------
+        dLdY : numpy array of shape (n_ex, out_rows, out_cols, out_ch)
+            The gradient of the loss with respect to the layer output.
+
+        Returns
+        -------
+        dX : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
+            The gradient of the loss with respect to the layer input volume
+        """
+        X = self.X
+        W_pw = self.parameters["W_pointwise"]
+        Z_dw = self.derived_variables["Z_depthwise"]
+
+        fr, fc = self.kernel_shape
+        in_ch, dm = self.in_ch, self.depth_multiplier
+        s, p, d, W_shape = self.stride, self.pad, self.dilation, self._W_shape()
+
+        dLdZ = self._act_grad(dLdY)
+        dLdZ_col = dLdZ.transpose(3, 1, 2, 0).reshape(self.out_ch, -1)
+        M = dLdZ_col.shape[1]
+
+        # pointwise stage
+        dB = dLdZ_col.sum(axis=1).reshape(1, 1, 1, -1)
+        dW_pw = np.dot(Z_dw, dLdZ_col.T)
+        dZ_dw = np.dot(W_pw, dLdZ_col).reshape(in_ch, dm, M)
+
+        # depthwise stage
+        X_col, p = im2col(X, W_shape, p, s, d)
+        X_col = X_col.reshape(in_ch, -1, M)
+        dW_dw = np.matmul(dZ_dw, X_col.transpose(0, 2, 1))
+        dW_dw = dW_dw.reshape(in_ch, dm, fr, fc).transpose(2, 3, 0, 1)
+
+        dX_col = np.matmul(self._W_dw_col().transpose(0, 2, 1), dZ_dw).reshape(-1, M)
+        dX = col2im(dX_col, X.shape, W_shape, p, s, d).transpose(0, 2, 3, 1)
+
+        self.gradients["W_depthwise"] = dW_dw
+        self.gradients["W_pointwise"] = dW_pw
+        self.gradients["b"] = dB
+        return dX
+
+
 class Deconv2D(LayerBase):
     def __init__(
         self,
@@ -2178,7 +3166,7 @@ class Deconv2D(LayerBase):
 
         self.parameters = {"W": W, "b": b}
         self.gradients = {"W": np.zeros_like(W), "b": np.zeros_like(b)}
-        self.derived_variables = {"Z": None, "out_rows": None, "out_cols": None}
+        self.derived_variables = {"act_cache": None, "out_rows": None, "out_cols": None}
         self.is_initialized = True
 
     @property
@@ -2195,6 +3183,7 @@ class Deconv2D(LayerBase):
             "optimizer": {
                 "cache": self.optimizer.cache,
                 "hyperparameters": self.optimizer.hyperparameters,
+                "masks": self.optimizer.masks,
             },
         }
 
@@ -2225,12 +3214,10 @@ class Deconv2D(LayerBase):
         n_ex, in_rows, in_cols, in_ch = X.shape
 
         # pad the input and perform the forward deconvolution
-        Z = deconv2D_naive(X, W, s, p, 0) + b
-        Y = self.act_fn.fn(Z)
+        Y = self._bias_act(deconv2D_naive(X, W, s, p, 0), b)
 
-        self.derived_variables["out_rows"] = Z.shape[1]
-        self.derived_variables["out_cols"] = Z.shape[2]
-        self.derived_variables["Z"] = Z
+        self.derived_variables["out_rows"] = Y.shape[1]
+        self.derived_variables["out_cols"] = Y.shape[2]
 
         return Y
 
@@ -2250,7 +3237,6 @@ class Deconv2D(LayerBase):
             The gradient of the loss with respect to the layer input volume
         """
         X = self.X
-        Z = self.derived_variables["Z"]
         W = np.rot90(self.parameters["W"], 2)
 
         s = self.stride
@@ -2262,21 +3248,25 @@ class Deconv2D(LayerBase):
         (fr, fc), p = self.kernel_shape, self.pad
         n_ex, out_rows, out_cols, out_ch = dLdY.shape
 
-        # pad X the first time
-        X_pad, p = pad2D(X, p, W.shape[:2], s)
-        n_ex, in_rows, in_cols, in_ch = X_pad.shape
+        # compute the input padding
+        p = plan_pad2D(X.shape, p, W.shape[:2], s)
         pr1, pr2, pc1, pc2 = p
 
+        n_ex, in_rows, in_cols, in_ch = X.shape
+        in_rows, in_cols = in_rows + pr1 + pr2, in_cols + pc1 + pc2
+
         # compute padding for the deconvolution
         out_rows = s * (in_rows - 1) - pr1 - pr2 + fr
         out_cols = s * (in_cols - 1) - pc1 - pc2 + fc
         out_dim = (out_rows, out_cols)
 
-        _p = calc_pad_dims_2D(X_pad.shape, out_dim, W.shape[:2], s, 0)
-        X_pad, _ = pad2D(X_pad, _p, W.shape[:2], s)
+        # pad X once with the combined padding
+        _p = calc_pad_dims_2D((n_ex, in_rows, in_cols, in_ch), out_dim, W.shape[:2], s, 0)
+        total_pad = tuple(i + j for i, j in zip(p, _p))
+        X_pad, _ = pad2D(X, total_pad)
 
         # columnize W, X, and dLdY
-        dLdZ = dLdY * self.act_fn.grad(Z)
+        dLdZ = self._act_grad(dLdY)
         dLdZ, _ = pad2D(dLdZ, p, W.shape[:2], s)
 
         dLdZ_col = dLdZ.transpose(3, 1, 2, 0).reshape(out_ch, -1)
@@ -2290,7 +3280,6 @@ class Deconv2D(LayerBase):
         # reshape columnized dX back into the same format as the input volume
         dX_col = np.dot(W_col, dLdZ_col)
 
-        total_pad = tuple(i + j for i, j in zip(p, _p))
         dX = col2im(dX_col, X.shape, W.shape, total_pad, s, 0).transpose(0, 2, 3, 1)
 
         # rotate gradient back
@@ -2395,8 +3384,8 @@ class RNN(LayerBase):
     def flush_gradients(self):
         self.cell.flush_gradients()
 
-    def update(self):
-        self.cell.update()
+    def update(self, grad_scale=None):
+        self.cell.update(grad_scale)
         self.flush_gradients()
 
 
@@ -2538,6 +3527,6 @@ class LSTM(LayerBase):
     def flush_gradients(self):
         self.cell.flush_gradients()
 
-    def update(self):
-        self.cell.update()
+    def update(self, grad_scale=None):
+        self.cell.update(grad_scale)
         self.flush_gradients()
@@ -156,6 +156,129 @@ class CrossEntropy(ObjectiveBase):
         return grad
 
 
+class SoftmaxCrossEntropy(ObjectiveBase):
+    def __init__(self):
+        """
+        Cross-entropy loss computed directly from the logits (ie., the input
+        to the softmax). Fusing the softmax into the loss avoids taking the
+        log of probabilities that may have underflowed, and computes the loss
+        and its gradient in a single pass over the logits.
+        """
+        super().__init__()
+
+    def __call__(self, y, logits):
+        return self.loss(y, logits)
+
+    def __str__(self):
+        return "SoftmaxCrossEntropy"
+
+    @staticmethod
+    def loss_and_grad(y, logits, out=None):
+        """
+        Compute the summed cross-entropy of softmax(logits) and its gradient
+        wrt. the logits.
+
+            log softmax(z)_j = z_j - max(z) - log sum_k exp(z_k - max(z))
+            loss             = -sum_ij y_ij * log softmax(z_i)_j
+            dloss / dz       = softmax(z) - y
+
+        The only temporary is the (n, m) buffer used for exp(z - max(z)),
+        which is normalized in-place and returned as the gradient.
+
+        Parameters
+        ----------
+        y : numpy array of shape (n, m) or (n,)
+            Either the class label for each of n examples as an integer array
+            of shape (n,), or the one-hot encoded (or, more generally,
+            stochastic) targets as an array of shape (n, m)
+        logits : numpy array of shape (n, m)
+            The unnormalized log probabilities of each of m classes for the n
+            examples in the batch
+        out : numpy array of shape (n, m) or None (default: None)
+            An optional buffer to write the gradient into. May be `logits`
+            itself if the logits are no longer needed.
+
+        Returns
+        -------
+        loss : float
+            The sum of the cross-entropy across classes and examples
+        grad : numpy array of shape (n, m)
+            The gradient of the loss wrt. the logits
+        """
+        y = np.asarray(y)
+        n_ex = logits.shape[0]
+        labels = y.ndim == 1
+
+        z_max = logits.max(axis=1, keepdims=True)
+        if labels:
+            ix = np.arange(n_ex)
+            z_y = logits[ix, y].sum()
+        else:
+            z_y = np.einsum("ij,ij->", y, logits)
+
+        if out is None:
+            out = np.array(logits, dtype=np.result_type(logits, np.float16))
+            np.subtract(out, z_max, out=out)
+        else:
+            np.subtract(logits, z_max, out=out)
+
+        np.exp(out, out=out)
+        denom = out.sum(axis=1, keepdims=True)
+
+        # logsumexp(z_i) = max(z_i) + log sum_k exp(z_ik - max(z_i))
+        lse = z_max + np.log(denom)
+        if labels:
+            loss = lse.sum() - z_y
+        else:
+            loss = np.dot(y.sum(axis=1), lse[:, 0]) - z_y
+
+        out /= denom
+        if labels:
+            out[ix, y] -= 1
+        else:
+            out -= y
+        return float(loss), out
+
+    @staticmethod
+    def loss(y, logits):
+        """
+        Cross-entropy loss of softmax(logits). Returns the sum (not average!)
+        of the losses per-sample.
+
+        Parameters
+        ----------
+        y : numpy array of shape (n, m) or (n,)
+            One-hot targets, or integer class labels, for each of n examples
+        logits : numpy array of shape (n, m)
+            The unnormalized log probabilities for the n examples in the batch
+
+        Returns
+        -------
+        loss : float
+            The sum of the cross-entropy across classes and examples
+        """
+        return SoftmaxCrossEntropy.loss_and_grad(y, logits)[0]
+
+    @staticmethod
+    def grad(y, logits):
+        """
+        Gradient of the cross-entropy loss wrt. the logits, softmax(z) - y.
+
+        Parameters
+        ----------
+        y : numpy array of shape (n, m) or (n,)
+            One-hot targets, or integer class labels, for each of n examples
+        logits : numpy array of shape (n, m)
+            The unnormalized log probabilities for the n examples in the batch
+
+        Returns
+        -------
+        grad : numpy array of shape (n, m)
+            The gradient of the loss wrt. the logits
+        """
+        return SoftmaxCrossEntropy.loss_and_grad(y, logits)[1]
+
+
 class VAELoss(ObjectiveBase):
     def __init__(self):
         super().__init__()
@@ -1,4 +1,5 @@
 from time import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
@@ -317,6 +318,111 @@ class BernoulliVAE(object):
         self._dv["t_log_var"] = t_log_var
         return X_recon
 
+    def _map_chunks(self, fn, X, chunksize, n_workers):
+        """
+        Apply `fn` to consecutive chunks of `X` (along the first axis) and
+        concatenate the results. If `n_workers` > 1, the chunks are processed
+        concurrently in a thread pool (numpy releases the GIL inside the
+        matrix multiplies that dominate each layer).
+        """
+        if self.decoder["FC2"].n_out is None:
+            raise ValueError("The VAE must be fit before running inference")
+
+        chunks = [X[i : i + chunksize] for i in range(0, X.shape[0], chunksize)]
+        if n_workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                outs = list(pool.map(fn, chunks))
+        else:
+            outs = [fn(chunk) for chunk in chunks]
+
+        if isinstance(outs[0], tuple):
+            return tuple(np.concatenate(o, axis=0) for o in zip(*outs))
+        return np.concatenate(outs, axis=0)
+
+    def _encode(self, X):
+        out = X
+        for k, v in self.encoder.items():
+            out = v.forward(out, retain_derived=False)
+        return out[:, : self.T], out[:, self.T :]
+
+    def _decode(self, t):
+        out = t
+        for k, v in self.decoder.items():
+            out = v.forward(out, retain_derived=False)
+        return out
+
+    def encode(self, X, chunksize=256, n_workers=1):
+        """
+        Compute the parameters of the variational distribution q(t | x) for
+        each example in `X`.
+
+        Unlike `forward`, no intermediate values are cached for the backward
+        pass, so the model state is left unchanged and memory use is bounded
+        by `chunksize`.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
+            The input images
+        chunksize : int (default: 256)
+            The number of examples to pass through the encoder at once
+        n_workers : int (default: 1)
+            The number of threads to process chunks with
+
+        Returns
+        -------
+        t_mean : numpy array of shape (n_ex, T)
+            Mean of q(t | x) for each example
+        t_log_var : numpy array of shape (n_ex, T)
+            Log variance of q(t | x) for each example
+        """
+        return self._map_chunks(self._encode, X, chunksize, n_workers)
+
+    def decode(self, t, chunksize=256, n_workers=1):
+        """
+        Compute the Bernoulli means of the reconstruction for each latent
+        vector in `t`, without caching intermediate values.
+
+        Parameters
+        ----------
+        t : numpy array of shape (n_ex, T)
+            Latent vectors
+        chunksize : int (default: 256)
+            The number of examples to pass through the decoder at once
+        n_workers : int (default: 1)
+            The number of threads to process chunks with
+
+        Returns
+        -------
+        X_recon : numpy array of shape (n_ex, in_rows * in_cols * in_ch)
+            The reconstruction probabilities for each example, flattened as
+            in `forward`
+        """
+        return self._map_chunks(self._decode, t, chunksize, n_workers)
+
+    def sample(self, n, chunksize=256, n_workers=1, seed=None):
+        """
+        Generate samples by decoding draws from the prior, t ~ N(0, I).
+
+        Parameters
+        ----------
+        n : int
+            The number of samples to generate
+        chunksize : int (default: 256)
+            The number of samples to pass through the decoder at once
+        n_workers : int (default: 1)
+            The number of threads to process chunks with
+        seed : int (default: None)
+            Seed for the random number generator used to draw from the prior
+
+        Returns
+        -------
+        X_gen : numpy array of shape (n, in_rows * in_cols * in_ch)
+            The Bernoulli means for each generated sample
+        """
+        t = np.random.default_rng(seed).standard_normal((n, self.T))
+        return self.decode(t, chunksize, n_workers)
+
     def backward(self, X_train, X_recon):
         """VAE backward pass"""
         n_ex = X_train.shape[0]
@@ -363,12 +469,12 @@ class BernoulliVAE(object):
         self._dv["dEncoder_Flatten3_out"] = dEncoder_Flatten3_out
         return dX
 
-    def update(self):
+    def update(self, grad_scale=None):
         """Perform gradient updates"""
         for k, v in reversed(list(self.decoder.items())):
-            v.update()
+            v.update(grad_scale)
         for k, v in reversed(list(self.encoder.items())):
-            v.update()
+            v.update(grad_scale)
         self.flush_gradients()
 
     def flush_gradients(self):
@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 import re
 import numpy as np
 
-from utils import calc_pad_dims_2D
+from utils import calc_pad_dims_2D, Profiler
 from activations import Tanh, Sigmoid, ReLU, LeakyReLU, Affine
 from layers import Conv1D, Conv2D, BatchNorm2D, Add, Multiply, LSTMCell
 
@@ -12,9 +13,24 @@ class ModuleBase(ABC):
     def __init__(self):
         self.X = None
         self.trainable = True
+        self._profiler = None
+        self._executor = None
+        self._owns_executor = False
 
         super().__init__()
 
+    def __getstate__(self):
+        # thread pools and profilers cannot be copied or pickled, and the
+        # profiled methods are bound to this instance; copies run serially
+        # and are not profiled
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_owns_executor"] = False
+        state["_profiler"] = None
+        for phase in ["forward", "backward", "update"]:
+            state.pop(phase, None)
+        return state
+
     @abstractmethod
     def _init_params(self, **kwargs):
         raise NotImplementedError
@@ -45,10 +61,92 @@ class ModuleBase(ABC):
         for c in self.components:
             c.unfreeze()
 
-    def update(self, lr):
+    def enable_profiling(self, profiler=None, name=None):
+        """
+        Record the wall time, estimated FLOPs, and bytes allocated for each
+        `forward`, `backward`, and `update` call on the module and each of its
+        components.
+
+        Parameters
+        ----------
+        profiler : `utils.Profiler` instance (default: None)
+            The profiler to record events with. If `None`, create a new one.
+        name : str (default: None)
+            The name to use for the module in the profiling report
+
+        Returns
+        -------
+        profiler : `utils.Profiler` instance
+            The profiler recording events for the module
+        """
+        profiler = Profiler() if profiler is None else profiler
+        profiler.attach(self, name)
+        return profiler
+
+    def disable_profiling(self):
+        if self._profiler is not None:
+            self._profiler.detach(self)
+
+    def enable_parallel_branches(self, executor=None, n_workers=2):
+        """
+        Run the independent branches of the module (e.g., the main and skip
+        paths of a residual block) concurrently in a thread pool during
+        `forward` and `backward`. Since numpy releases the GIL inside matrix
+        multiplications, this lets the branches overlap on multi-core
+        machines. The results are identical to serial execution.
+
+        Parameters
+        ----------
+        executor : `concurrent.futures.Executor` instance (default: None)
+            The thread pool to submit branches to. Sharing a single pool
+            across modules avoids creating one per module, and the caller
+            remains responsible for shutting it down. If None, create a new
+            pool with `n_workers` threads, owned by the module and shut down
+            when it is replaced or when parallel branches are disabled.
+        n_workers : int (default: 2)
+            The number of threads in the new pool. Unused if `executor` is
+            not None.
+
+        Returns
+        -------
+        executor : `concurrent.futures.Executor` instance
+            The thread pool used by the module
+        """
+        owns_executor = executor is None
+        if owns_executor:
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+
+        self.disable_parallel_branches()
+        self._executor, self._owns_executor = executor, owns_executor
+        return executor
+
+    def disable_parallel_branches(self):
+        """
+        Run the branches of the module serially (the default), shutting down
+        the thread pool if it was created by the module.
+        """
+        if self._owns_executor:
+            self._executor.shutdown()
+        self._executor, self._owns_executor = None, False
+
+    def _run_branches(self, *branches):
+        """
+        Call each of the (zero-argument) `branches` and return their results
+        in order. If parallel branches are enabled, all but the first branch
+        are submitted to the thread pool and the first runs on the calling
+        thread; the call returns once every branch has finished.
+        """
+        if self._executor is None or len(branches) < 2:
+            return [branch() for branch in branches]
+
+        futures = [self._executor.submit(branch) for branch in branches[1:]]
+        results = [branches[0]()]
+        return results + [f.result() for f in futures]
+
+    def update(self, grad_scale=None):
         assert self.trainable, "Layer is frozen"
         for c in self.components:
-            c.update(lr)
+            c.update(grad_scale)
         self.flush_gradients()
 
     def flush_gradients(self):
@@ -57,11 +155,27 @@ class ModuleBase(ABC):
         self.X = []
         self._dv = {}
         for c in self.components:
-            for k, v in c.derived_variables.items():
-                c.derived_variables[k] = None
+            c.flush_gradients()
 
-            for k, v in c.gradients.items():
-                c.gradients[k] = np.zeros_like(v)
+    def _batchnorm(self, bn, X):
+        # batchnorm layers folded into the preceding layer are the identity
+        if bn in getattr(self, "_folded", []):
+            return X
+        return getattr(self, bn).forward(X)
+
+    def _restore_folded(self, folded):
+        """
+        Mark the batchnorm layers in `folded` as folded into their preceding
+        convolutions without modifying any weights, e.g., when the folded
+        weights are loaded from a checkpoint. Each `batchnormX` layer follows
+        the convolution `convX`.
+        """
+        for bn in folded:
+            if bn not in self._folded:
+                # folding replaces the conv activation with the identity
+                conv = getattr(self, bn.replace("batchnorm", "conv"))
+                conv.act_fn = Affine(slope=1, intercept=0)
+                self._folded.append(bn)
 
     def set_params(self, summary_dict):
         cids = self.hyperparameters["component_ids"]
@@ -80,7 +194,9 @@ class ModuleBase(ABC):
                     if c in cids:
                         getattr(self, c).set_params(cd)
 
-            if k in self.hyperparameters:
+            if k == "folded":
+                self._restore_folded(v)
+            elif k in self.hyperparameters:
                 if k == "act_fn" and v == "ReLU":
                     self.hyperparameters[k] = ReLU()
                 elif v == "act_fn" and v == "Sigmoid":
@@ -155,6 +271,7 @@ class WavenetResidualModule(ModuleBase):
 
     def _init_params(self):
         self._dv = {}
+        self.reset_queue()
 
         self.conv_dilation = Conv1D(
             stride=1,
@@ -287,9 +404,11 @@ class WavenetResidualModule(ModuleBase):
         dMultiply_out = self.conv_1x1.backward(dConv_1x1_out)
         dTanh_out, dSigm_out = self.multiply_gate.backward(dMultiply_out)
 
-        conv_dilation_out = self.derived_variables["conv_dilation_out"]
-        dTanh_in = dTanh_out * self.tanh.grad(conv_dilation_out)
-        dSigm_in = dSigm_out * self.sigm.grad(conv_dilation_out)
+        # the gate derivatives are functions of the cached gate outputs
+        tanh_out = self.derived_variables["tanh_out"]
+        sigm_out = self.derived_variables["sigm_out"]
+        dTanh_in = dTanh_out * self.tanh.grad_from_output(tanh_out)
+        dSigm_in = dSigm_out * self.sigm.grad_from_output(sigm_out)
         dDilation_out = dTanh_in + dSigm_in
 
         conv_back = self.conv_dilation.backward(dDilation_out)
@@ -302,6 +421,121 @@ class WavenetResidualModule(ModuleBase):
         self._dv["dLdConv_dilation"] = dDilation_out
         return dX_main, dX_skip
 
+    def reset_queue(self):
+        """
+        Clear the queue of past inputs used by `forward_step`. Call before
+        generating a new sequence.
+        """
+        self._queue = None
+        self._step = 0
+
+    def forward_step(self, x_main, x_skip=None):
+        """
+        Compute the module output for a single new timestep during
+        autoregressive generation.
+
+        Rather than recomputing the causal dilated convolution over the whole
+        history (as `forward` would), the module keeps a ring buffer with the
+        last `(kernel_width - 1) * (dilation + 1)` inputs on the main path.
+        Each step reads the inputs at the dilated kernel taps from the queue,
+        applies the kernel once, and pushes the new input, so generating a
+        sequence of length T costs O(T) rather than O(T^2). The outputs match
+        those of `forward` on the full sequence, with the zero-initialized
+        queue playing the role of the causal zero padding.
+
+        See Paine et al. (2016) at https://arxiv.org/pdf/1611.09482.pdf for
+        further details.
+
+        Parameters
+        ----------
+        x_main : numpy array of shape (n_ex, ch_residual)
+            The input on the main path at the current timestep
+        x_skip : numpy array of shape (n_ex, ch_residual) or None
+            The skip path sum from the previous block at the current timestep.
+            If None, this is the first block and the skip sum starts at 0.
+
+        Returns
+        -------
+        y_main : numpy array of shape (n_ex, ch_residual)
+            The main path output at the current timestep
+        y_skip : numpy array of shape (n_ex, ch_residual)
+            The skip path output at the current timestep
+        """
+        if not self.conv_dilation.is_initialized:
+            self.conv_dilation.in_ch = x_main.shape[1]
+            self.conv_dilation._init_params()
+            self.conv_1x1.in_ch = self.ch_dilation
+            self.conv_1x1._init_params()
+
+        W = self.conv_dilation.parameters["W"]
+        b = self.conv_dilation.parameters["b"]
+        fw, gap = W.shape[0], self.dilation + 1
+        n_ex, ch = x_main.shape
+
+        # number of past inputs covered by the dilated kernel
+        q_len = (fw - 1) * gap
+        if self._queue is None or self._queue.shape[0] != n_ex:
+            self._queue = np.zeros((n_ex, max(q_len, 1), ch))
+            self._step = 0
+
+        # the kernel tap k is applied to x[t - (fw - 1 - k) * gap]
+        t = self._step
+        ix = [(t - (fw - 1 - k) * gap) % q_len for k in range(fw - 1)]
+        conv_out = np.dot(x_main, W[-1]) + b[0]
+        if len(ix) > 0:
+            conv_out += np.einsum("nkc,kco->no", self._queue[:, ix], W[:-1])
+
+        if q_len > 0:
+            self._queue[:, t % q_len] = x_main
+        self._step += 1
+
+        gate_out = self.tanh.fn(conv_out) * self.sigm.fn(conv_out)
+        W1, b1 = self.conv_1x1.parameters["W"], self.conv_1x1.parameters["b"]
+        conv_1x1_out = np.dot(gate_out, W1[0]) + b1[0]
+
+        y_skip = conv_1x1_out if x_skip is None else x_skip + conv_1x1_out
+        y_main = x_main + conv_1x1_out
+        return y_main, y_skip
+
+
+def wavenet_generate(modules, x0, n_steps, next_input):
+    """
+    Autoregressively generate a sequence from a stack of
+    `WavenetResidualModule`s using incremental (queue-based) inference.
+
+    Each step runs `forward_step` on every module, so the cost of generating
+    `n_steps` samples is linear in `n_steps`.
+
+    Parameters
+    ----------
+    modules : list of `WavenetResidualModule` instances
+        The residual blocks, in the order they are applied
+    x0 : numpy array of shape (n_ex, ch_residual)
+        The input to the first block at the first timestep
+    n_steps : int
+        The number of timesteps to generate
+    next_input : callable
+        A function mapping the final skip path output at timestep t, an array
+        of shape (n_ex, ch_residual), to the input at timestep t + 1 (e.g., by
+        applying the output layers and sampling)
+
+    Returns
+    -------
+    Y_skip : numpy array of shape (n_ex, n_steps, ch_residual)
+        The final skip path output at each timestep
+    """
+    for module in modules:
+        module.reset_queue()
+
+    x, Y_skip = x0, []
+    for t in range(n_steps):
+        x_main, x_skip = x, None
+        for module in modules:
+            x_main, x_skip = module.forward_step(x_main, x_skip)
+        Y_skip.append(x_skip)
+        x = next_input(x_skip)
+    return np.stack(Y_skip, axis=1)
+
 
 class SkipConnectionIdentityModule(ModuleBase):
     def __init__(
@@ -389,6 +623,9 @@ class SkipConnectionIdentityModule(ModuleBase):
         self.batchnorm2 = BatchNorm2D(epsilon=self.epsilon, momentum=self.momentum)
         self.add3 = Add(self.act_fn)
 
+        # batchnorm layers which have been folded into the preceding conv
+        self._folded = []
+
     def _init_conv2(self):
         self.conv2 = Conv2D(
             pad="same",
@@ -425,6 +662,7 @@ class SkipConnectionIdentityModule(ModuleBase):
             "act_fn": str(self.act_fn),
             "kernel_shape1": self.kernel_shape1,
             "kernel_shape2": self.kernel_shape2,
+            "folded": list(self._folded),
             "component_ids": ["conv1", "batchnorm1", "conv2", "batchnorm2", "add3"],
             "components": {
                 "add3": self.add3.hyperparameters,
@@ -465,15 +703,37 @@ class SkipConnectionIdentityModule(ModuleBase):
             }
         }
 
+    def fold_batchnorm(self):
+        """
+        Fold the frozen batchnorm layers into the preceding convolutions for
+        inference. `batchnorm2` is always folded into `conv2`. `batchnorm1` is
+        only folded into `conv1` if the module activation is affine, since it
+        is applied after the activation on `conv1`. Folded batchnorm layers are
+        skipped in subsequent forward passes.
+
+        The module must be frozen and have been run on at least one minibatch.
+        """
+        if not hasattr(self, "conv2"):
+            raise ValueError("Run a forward pass before folding batchnorm layers")
+
+        pairs = [("conv2", "batchnorm2")]
+        if isinstance(self.conv1.act_fn, Affine):
+            pairs.append(("conv1", "batchnorm1"))
+
+        for conv, bn in pairs:
+            if bn not in self._folded:
+                getattr(self, conv).fold_batchnorm(getattr(self, bn))
+                self._folded.append(bn)
+
     def forward(self, X):
         if not hasattr(self, "conv2"):
             self.in_ch = X.shape[3]
             self._init_conv2()
 
         conv1_out = self.conv1.forward(X)
-        bn1_out = self.batchnorm1.forward(conv1_out)
+        bn1_out = self._batchnorm("batchnorm1", conv1_out)
         conv2_out = self.conv2.forward(bn1_out)
-        bn2_out = self.batchnorm2.forward(conv2_out)
+        bn2_out = self._batchnorm("batchnorm2", conv2_out)
         Y = self.add3.forward([X, bn2_out])
 
         self._dv["conv1_out"] = conv1_out
@@ -616,6 +876,9 @@ class SkipConnectionConvModule(ModuleBase):
         self.batchnorm_skip = BatchNorm2D(epsilon=self.epsilon, momentum=self.momentum)
         self.add3 = Add(self.act_fn)
 
+        # batchnorm layers which have been folded into the preceding conv
+        self._folded = []
+
     def _calc_skip_padding(self, X):
         pads = []
         for p in [self.pad1, self.pad2]:
@@ -698,6 +961,7 @@ class SkipConnectionConvModule(ModuleBase):
             "kernel_shape2": self.kernel_shape2,
             "kernel_shape_skip": self.kernel_shape_skip,
             "pad_skip": self.pad_skip if hasattr(self, "pad_skip") else None,
+            "folded": list(self._folded),
             "component_ids": [
                 "add3",
                 "conv1",
@@ -760,6 +1024,29 @@ class SkipConnectionConvModule(ModuleBase):
             }
         }
 
+    def fold_batchnorm(self):
+        """
+        Fold the frozen batchnorm layers into the preceding convolutions for
+        inference. `batchnorm2` and `batchnorm_skip` are always folded into
+        `conv2` and `conv_skip`. `batchnorm1` is only folded into `conv1` if
+        the module activation is affine, since it is applied after the
+        activation on `conv1`. Folded batchnorm layers are skipped in
+        subsequent forward passes.
+
+        The module must be frozen and have been run on at least one minibatch.
+        """
+        if not hasattr(self, "conv_skip"):
+            raise ValueError("Run a forward pass before folding batchnorm layers")
+
+        pairs = [("conv2", "batchnorm2"), ("conv_skip", "batchnorm_skip")]
+        if isinstance(self.conv1.act_fn, Affine):
+            pairs.append(("conv1", "batchnorm1"))
+
+        for conv, bn in pairs:
+            if bn not in self._folded:
+                getattr(self, conv).fold_batchnorm(getattr(self, bn))
+                self._folded.append(bn)
+
     def forward(self, X):
         # now that we have the input dims for X we can initialize the proper
         # padding in the `conv_skip` layer
@@ -767,12 +1054,22 @@ class SkipConnectionConvModule(ModuleBase):
             self._init_conv_skip(X)
             self.in_ch = X.shape[3]
 
-        conv1_out = self.conv1.forward(X)
-        bn1_out = self.batchnorm1.forward(conv1_out)
-        conv2_out = self.conv2.forward(bn1_out)
-        bn2_out = self.batchnorm2.forward(conv2_out)
-        conv_skip_out = self.conv_skip.forward(X)
-        bn_skip_out = self.batchnorm_skip.forward(conv_skip_out)
+        def main_path():
+            conv1_out = self.conv1.forward(X)
+            bn1_out = self._batchnorm("batchnorm1", conv1_out)
+            conv2_out = self.conv2.forward(bn1_out)
+            bn2_out = self._batchnorm("batchnorm2", conv2_out)
+            return conv1_out, bn1_out, conv2_out, bn2_out
+
+        def skip_path():
+            conv_skip_out = self.conv_skip.forward(X)
+            bn_skip_out = self._batchnorm("batchnorm_skip", conv_skip_out)
+            return conv_skip_out, bn_skip_out
+
+        # the main and skip paths are independent until the final add
+        main_out, skip_out = self._run_branches(main_path, skip_path)
+        conv1_out, bn1_out, conv2_out, bn2_out = main_out
+        conv_skip_out, bn_skip_out = skip_out
         Y = self.add3.forward([bn_skip_out, bn2_out])
 
         self._dv["conv1_out"] = conv1_out
@@ -785,13 +1082,21 @@ class SkipConnectionConvModule(ModuleBase):
 
     def backward(self, dLdY):
         dBnskip_out, dBn2_out = self.add3.backward(dLdY)
-        dConvskip_out = self.batchnorm_skip.backward(dBnskip_out)
-        dX = self.conv_skip.backward(dConvskip_out)
 
-        dConv2_out = self.batchnorm2.backward(dBn2_out)
-        dBn1_out = self.conv2.backward(dConv2_out)
-        dConv1_out = self.batchnorm1.backward(dBn1_out)
-        dX += self.conv1.backward(dConv1_out)
+        def main_path():
+            dConv2_out = self.batchnorm2.backward(dBn2_out)
+            dBn1_out = self.conv2.backward(dConv2_out)
+            dConv1_out = self.batchnorm1.backward(dBn1_out)
+            return dConv2_out, dBn1_out, dConv1_out, self.conv1.backward(dConv1_out)
+
+        def skip_path():
+            dConvskip_out = self.batchnorm_skip.backward(dBnskip_out)
+            return dConvskip_out, self.conv_skip.backward(dConvskip_out)
+
+        main_out, skip_out = self._run_branches(main_path, skip_path)
+        dConv2_out, dBn1_out, dConv1_out, dX_main = main_out
+        dConvskip_out, dX = skip_out
+        dX += dX_main
 
         self._dv["dLdAdd3_X"] = dX
         self._dv["dLdBn1"] = dBn1_out
@@ -855,14 +1160,18 @@ class BidirectionalLSTM(ModuleBase):
         n_ex, self.n_in, n_t = X.shape
 
         # forward LSTM
-        for t in range(n_t):
-            yt, ct = self.cell_fwd.forward(X[:, :, t])
-            Y_fwd.append(yt)
+        def forward_pass():
+            for t in range(n_t):
+                yt, ct = self.cell_fwd.forward(X[:, :, t])
+                Y_fwd.append(yt)
 
         # backward LSTM
-        for t in reversed(range(n_t)):
-            yt, ct = self.cell_bwd.forward(X[:, :, t])
-            Y_bwd.insert(0, yt)
+        def backward_pass():
+            for t in reversed(range(n_t)):
+                yt, ct = self.cell_bwd.forward(X[:, :, t])
+                Y_bwd.insert(0, yt)
+
+        self._run_branches(forward_pass, backward_pass)
 
         # merge forward and backward states
         for t in range(n_t):
@@ -885,28 +1194,32 @@ class BidirectionalLSTM(ModuleBase):
         dLdX_f, dLdX_b, dLdX = [], [], []
 
         # forward LSTM
-        for t in reversed(range(n_t)):
-            if self.merge_mode == "concat":
-                dLdXt_f = self.cell_fwd.backward(dLdA[:, : self.n_out, t])
-            elif self.merge_mode == "sum":
-                dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t])
-            elif self.merge_mode == "multiplty":
-                dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t] * self.Y_bwd[t])
-            elif self.merge_mode == "average":
-                dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t] * 0.5)
-            dLdX_f.insert(0, dLdXt_f)
+        def forward_pass():
+            for t in reversed(range(n_t)):
+                if self.merge_mode == "concat":
+                    dLdXt_f = self.cell_fwd.backward(dLdA[:, : self.n_out, t])
+                elif self.merge_mode == "sum":
+                    dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t])
+                elif self.merge_mode == "multiplty":
+                    dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t] * self.Y_bwd[t])
+                elif self.merge_mode == "average":
+                    dLdXt_f = self.cell_fwd.backward(dLdA[:, :, t] * 0.5)
+                dLdX_f.insert(0, dLdXt_f)
 
         # backward LSTM
-        for t in range(n_t):
-            if self.merge_mode == "concat":
-                dLdXt_b = self.cell_bwd.backward(dLdA[:, self.n_out :, t])
-            elif self.merge_mode == "sum":
-                dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t])
-            elif self.merge_mode == "multiplty":
-                dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t] * self.Y_fwd[t])
-            elif self.merge_mode == "average":
-                dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t] * 0.5)
-            dLdX_b.append(dLdXt_b)
+        def backward_pass():
+            for t in range(n_t):
+                if self.merge_mode == "concat":
+                    dLdXt_b = self.cell_bwd.backward(dLdA[:, self.n_out :, t])
+                elif self.merge_mode == "sum":
+                    dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t])
+                elif self.merge_mode == "multiplty":
+                    dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t] * self.Y_fwd[t])
+                elif self.merge_mode == "average":
+                    dLdXt_b = self.cell_bwd.backward(dLdA[:, :, t] * 0.5)
+                dLdX_b.append(dLdXt_b)
+
+        self._run_branches(forward_pass, backward_pass)
 
         for t in range(n_t):
             dLdX.append(dLdX_f[t] + dLdX_b[t])
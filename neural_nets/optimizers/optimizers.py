@@ -6,13 +6,65 @@ from numpy.linalg import norm
 
 
 class OptimizerBase(ABC):
+    # whether the optimizer preconditions gradients using curvature factors
+    # collected during the layer backward pass (see `KFAC.update_factors`)
+    requires_factors = False
+
     def __init__(self):
         self.cache = {}
         self.hyperparameters = {}
-        pass
+        self.masks = {}
+        self._grad_scale = None
+
+    def __call__(self, param, param_grad, param_name, grad_scale=None):
+        # a scale factor computed from the global norm of all of a model's
+        # gradients (see `utils.clip_grad_norm`) replaces per-tensor clipping
+        self._grad_scale = grad_scale
+
+        # pruned entries (see `set_mask`) receive no gradient, and are reset
+        # to zero after the update in case the rule moves them anyway (e.g.,
+        # via momentum or weight decay)
+        mask = self.masks.get(param_name)
+
+        # sparse gradients are passed as a (row indices, row gradients) tuple
+        if isinstance(param_grad, tuple):
+            ix, grad_rows = param_grad
+            if len(ix) == 0:
+                return param
+
+            # sparse updates modify `param` in-place, so take ownership of
+            # read-only (e.g., memory-mapped) parameters on the first update
+            if not param.flags.writeable:
+                param = param.copy()
+
+            if mask is not None:
+                grad_rows = grad_rows * mask[ix]
+            param = self.sparse_update(param, ix, grad_rows, param_name)
+            if mask is not None:
+                param[ix] *= mask[ix]
+            return param
+
+        if mask is None:
+            return self.update(param, param_grad, param_name)
+        return self.update(param, param_grad * mask, param_name) * mask
+
+    def set_mask(self, param_name, mask):
+        """
+        Fix a subset of the entries of a parameter at zero during subsequent
+        updates (e.g., to fine-tune a pruned layer).
 
-    def __call__(self, param, param_grad, param_name):
-        return self.update(param, param_grad, param_name)
+        Parameters
+        ----------
+        param_name : str
+            The name of the parameter to mask
+        mask : numpy array of bools or None
+            An array with the same shape as the parameter, which is False for
+            each entry to keep at zero. If None, remove the current mask.
+        """
+        if mask is None:
+            self.masks.pop(param_name, None)
+        else:
+            self.masks[param_name] = np.asarray(mask, dtype=bool)
 
     def copy(self):
         return deepcopy(self)
@@ -24,13 +76,54 @@ class OptimizerBase(ABC):
                     self.hyperparameters[k] = v
         if cache_dict is not None:
             for k, v in cache_dict.items():
-                if k in self.cache:
-                    self.cache[k] = v
+                self.cache[k] = v
+        return self
 
     @abstractmethod
     def update(self, param, param_grad, param_name):
         raise NotImplementedError
 
+    def sparse_update(self, param, ix, grad_rows, param_name):
+        """
+        Apply an update to the rows `ix` of `param` only. The optimizer state
+        for the remaining rows is left untouched (ie., moment estimates are
+        updated lazily, only when a row receives a gradient).
+
+        Parameters
+        ----------
+        param : numpy array of shape (n, m)
+            The value of the parameter to be updated. Modified in-place.
+        ix : numpy array of shape (k,)
+            The unique indices of the rows of `param` with nonzero gradients
+        grad_rows : numpy array of shape (k, m)
+            The gradient of the loss function with respect to `param[ix]`
+        param_name : str
+            The name of the parameter
+
+        Returns
+        -------
+        updated_params : numpy array of shape (n, m)
+            The value of `param` after applying the update
+        """
+        raise NotImplementedError(
+            "{} does not support sparse updates".format(self.hyperparameters["id"])
+        )
+
+    def _clip(self, grad):
+        # scale gradient to avoid explosion
+        scale = self._grad_scale
+        if scale is not None:
+            return grad if scale == 1 else grad * scale
+
+        clip_norm = self.hyperparameters["clip_norm"]
+        if clip_norm is None:
+            return grad
+
+        grad_norm = norm(grad)
+        if grad_norm > clip_norm:
+            grad = grad * (clip_norm / grad_norm)
+        return grad
+
 
 class SGD(OptimizerBase):
     def __init__(self, lr=0.01, momentum=0.0, clip_norm=None, **kwargs):
@@ -88,20 +181,34 @@ class SGD(OptimizerBase):
         C = self.cache
         lr = self.hyperparameters["lr"]
         momentum = self.hyperparameters["momentum"]
-        clip_norm = self.hyperparameters["clip_norm"]
 
         if param_name not in C:
             C[param_name] = np.zeros_like(param_grad)
 
-        # scale gradient to avoid explosion
-        t = np.inf if clip_norm is None else clip_norm
-        if norm(param_grad) > t:
-            param_grad = param_grad * t / norm(param_grad)
+        param_grad = self._clip(param_grad)
 
         update = momentum * C[param_name] + lr * param_grad
         self.cache[param_name] = update
         return param - update
 
+    def sparse_update(self, param, ix, grad_rows, param_name):
+        """
+        Compute the momentum update for the rows `ix` of a given parameter.
+        Momentum for rows outside `ix` is not decayed (lazy momentum).
+        """
+        C = self.cache
+        lr = self.hyperparameters["lr"]
+        momentum = self.hyperparameters["momentum"]
+
+        if param_name not in C:
+            C[param_name] = np.zeros_like(param)
+
+        grad_rows = self._clip(grad_rows)
+        update = momentum * C[param_name][ix] + lr * grad_rows
+        C[param_name][ix] = update
+        param[ix] -= update
+        return param
+
 
 class AdaGrad(OptimizerBase):
     """
@@ -172,21 +279,35 @@ class AdaGrad(OptimizerBase):
         C = self.cache
         lr = self.hyperparameters["lr"]
         eps = self.hyperparameters["eps"]
-        clip_norm = self.hyperparameters["clip_norm"]
 
         if param_name not in C:
             C[param_name] = np.zeros_like(param_grad)
 
-        # scale gradient to avoid explosion
-        t = np.inf if clip_norm is None else clip_norm
-        if norm(param_grad) > t:
-            param_grad = param_grad * t / norm(param_grad)
+        param_grad = self._clip(param_grad)
 
         C[param_name] += param_grad ** 2
         update = lr * param_grad / (np.sqrt(C[param_name]) + eps)
         self.cache = C
         return param - update
 
+    def sparse_update(self, param, ix, grad_rows, param_name):
+        """
+        Compute the AdaGrad update for the rows `ix` of a given parameter.
+        Equivalent to the dense update, since rows with zero gradient are
+        unchanged.
+        """
+        C = self.cache
+        lr = self.hyperparameters["lr"]
+        eps = self.hyperparameters["eps"]
+
+        if param_name not in C:
+            C[param_name] = np.zeros_like(param)
+
+        grad_rows = self._clip(grad_rows)
+        C[param_name][ix] += grad_rows ** 2
+        param[ix] -= lr * grad_rows / (np.sqrt(C[param_name][ix]) + eps)
+        return param
+
 
 class RMSProp(OptimizerBase):
     def __init__(self, lr=0.001, decay=0.9, eps=1e-7, clip_norm=None, **kwargs):
@@ -254,21 +375,36 @@ class RMSProp(OptimizerBase):
         lr = self.hyperparameters["lr"]
         eps = self.hyperparameters["eps"]
         decay = self.hyperparameters["decay"]
-        clip_norm = self.hyperparameters["clip_norm"]
 
         if param_name not in C:
             C[param_name] = np.zeros_like(param_grad)
 
-        # scale gradient to avoid explosion
-        t = np.inf if clip_norm is None else clip_norm
-        if norm(param_grad) > t:
-            param_grad = param_grad * t / norm(param_grad)
+        param_grad = self._clip(param_grad)
 
         C[param_name] = decay * C[param_name] + (1 - decay) * param_grad ** 2
         update = lr * param_grad / (np.sqrt(C[param_name]) + eps)
         self.cache = C
         return param - update
 
+    def sparse_update(self, param, ix, grad_rows, param_name):
+        """
+        Compute the RMSProp update for the rows `ix` of a given parameter. The
+        moving average for rows outside `ix` is not decayed.
+        """
+        C = self.cache
+        lr = self.hyperparameters["lr"]
+        eps = self.hyperparameters["eps"]
+        decay = self.hyperparameters["decay"]
+
+        if param_name not in C:
+            C[param_name] = np.zeros_like(param)
+
+        grad_rows = self._clip(grad_rows)
+        C_ix = decay * C[param_name][ix] + (1 - decay) * grad_rows ** 2
+        C[param_name][ix] = C_ix
+        param[ix] -= lr * grad_rows / (np.sqrt(C_ix) + eps)
+        return param
+
 
 class Adam(OptimizerBase):
     def __init__(
@@ -336,7 +472,7 @@ class Adam(OptimizerBase):
         """
         C = self.cache
         H = self.hyperparameters
-        eps, clip_norm = H["eps"], H["clip_norm"]
+        eps = H["eps"]
         lr, d1, d2, = H["lr"], H["decay1"], H["decay2"]
 
         if param_name not in C:
@@ -346,10 +482,7 @@ class Adam(OptimizerBase):
                 "var": np.zeros_like(param_grad),
             }
 
-        # scale gradient to avoid explosion
-        t = np.inf if clip_norm is None else clip_norm
-        if norm(param_grad) > t:
-            param_grad = param_grad * t / norm(param_grad)
+        param_grad = self._clip(param_grad)
 
         t = C[param_name]["t"] + 1
         var = C[param_name]["var"]
@@ -366,3 +499,460 @@ class Adam(OptimizerBase):
         m_hat = C[param_name]["mean"] / (1 - d1 ** t)
         update = lr * m_hat / (np.sqrt(v_hat) + eps)
         return param - update
+
+    def sparse_update(self, param, ix, grad_rows, param_name):
+        """
+        Compute the Adam update for the rows `ix` of a given parameter. The
+        moment estimates for rows outside `ix` are not decayed (as in "lazy"
+        Adam); the bias correction uses the number of updates to `param`.
+        """
+        C = self.cache
+        H = self.hyperparameters
+        eps = H["eps"]
+        lr, d1, d2, = H["lr"], H["decay1"], H["decay2"]
+
+        if param_name not in C:
+            C[param_name] = {
+                "t": 0,
+                "mean": np.zeros_like(param),
+                "var": np.zeros_like(param),
+            }
+
+        grad_rows = self._clip(grad_rows)
+
+        t = C[param_name]["t"] + 1
+        var = d2 * C[param_name]["var"][ix] + (1 - d2) * grad_rows ** 2
+        mean = d1 * C[param_name]["mean"][ix] + (1 - d1) * grad_rows
+
+        # update cache
+        C[param_name]["t"] = t
+        C[param_name]["var"][ix] = var
+        C[param_name]["mean"][ix] = mean
+
+        # calc unbiased moment estimates and Adam update
+        v_hat = var / (1 - d2 ** t)
+        m_hat = mean / (1 - d1 ** t)
+        param[ix] -= lr * m_hat / (np.sqrt(v_hat) + eps)
+        return param
+
+
+class LARS(OptimizerBase):
+    def __init__(
+        self,
+        lr=0.01,
+        momentum=0.9,
+        eta=0.001,
+        weight_decay=0.0,
+        eps=1e-9,
+        clip_norm=None,
+        **kwargs
+    ):
+        """
+        Layer-wise adaptive rate scaling (LARS) optimizer. Scales the learning
+        rate for each parameter by a "trust ratio" computed from the norm of
+        the parameter and the norm of its gradient, so that the size of each
+        update is proportional to the size of the weights it modifies. This
+        keeps training stable at batch sizes where the global learning rate
+        would otherwise have to be retuned for each layer.
+
+        Equations:
+            trust[t]   = eta * ||param[t]|| / (||grad[t]|| + weight_decay * ||param[t]|| + eps)
+            update[t]  = cache[t] = momentum * cache[t-1] + lr * trust[t] * (grad[t] + weight_decay * param[t])
+            param[t+1] = param[t] - update[t]
+
+            If either ||param[t]|| or ||grad[t]|| is 0, trust[t] = 1.
+
+        Parameters
+        ----------
+        lr : float (default: 0.01)
+            Global learning rate
+        momentum : float in range [0, 1] (default: 0.9)
+            The fraction of the previous update to add to the current update
+        eta : float (default: 0.001)
+            The trust coefficient, ie., the target ratio between the norm of
+            each update (before scaling by `lr`) and the norm of the parameter
+        weight_decay : float (default: 0)
+            The l2 penalty coefficient
+        eps : float (default: 1e-9)
+            Constant term to avoid divide-by-zero errors in the trust ratio
+        clip_norm : float (default: None)
+            If not None, all param gradients are scaled to have maximum l2 norm of
+            `clip_norm` before computing update.
+        """
+        super().__init__()
+
+        self.cache = {}
+        self.hyperparameters = {
+            "id": "LARS",
+            "lr": lr,
+            "momentum": momentum,
+            "eta": eta,
+            "weight_decay": weight_decay,
+            "eps": eps,
+            "clip_norm": clip_norm,
+        }
+
+    def __str__(self):
+        H = self.hyperparameters
+        lr, mm, eta = H["lr"], H["momentum"], H["eta"]
+        wd, eps, cn = H["weight_decay"], H["eps"], H["clip_norm"]
+        return "LARS(lr={}, momentum={}, eta={}, weight_decay={}, eps={}, clip_norm={})".format(
+            lr, mm, eta, wd, eps, cn
+        )
+
+    def update(self, param, param_grad, param_name):
+        """
+        Compute the LARS update for a given parameter.
+
+        Parameters
+        ----------
+        param : numpy array of shape (n, m)
+            The value of the parameter to be updated
+        param_grad : numpy array of shape (n, m)
+            The gradient of the loss function with respect to `param_name`
+        param_name : str
+            The name of the parameter
+
+        Returns
+        -------
+        updated_params : numpy array of shape (n, m)
+            The value of `param` after applying the LARS update
+        """
+        C = self.cache
+        H = self.hyperparameters
+        lr, momentum, eta = H["lr"], H["momentum"], H["eta"]
+        wd, eps = H["weight_decay"], H["eps"]
+
+        if param_name not in C:
+            C[param_name] = np.zeros_like(param_grad)
+
+        param_grad = self._clip(param_grad)
+
+        w_norm, g_norm = norm(param), norm(param_grad)
+        trust = 1.0
+        if w_norm > 0 and g_norm > 0:
+            trust = eta * w_norm / (g_norm + wd * w_norm + eps)
+
+        if wd != 0:
+            param_grad = param_grad + wd * param
+
+        update = momentum * C[param_name] + (lr * trust) * param_grad
+        self.cache[param_name] = update
+        return param - update
+
+
+class LAMB(OptimizerBase):
+    def __init__(
+        self,
+        lr=0.001,
+        decay1=0.9,
+        decay2=0.999,
+        eps=1e-6,
+        weight_decay=0.0,
+        clip_norm=None,
+        **kwargs
+    ):
+        """
+        Layer-wise adaptive moments (LAMB) optimizer. Computes the Adam update
+        direction for each parameter and then rescales it by a per-parameter
+        trust ratio, so that the norm of the update is proportional to the
+        norm of the parameter. Designed for training with very large batches.
+
+        Equations:
+            mean[t]    = decay1 * mean[t-1] + (1 - decay1) * grad[t]
+            var[t]     = decay2 * var[t-1] + (1 - decay2) * grad[t] ** 2
+            r[t]       = m_hat[t] / (sqrt(v_hat[t]) + eps) + weight_decay * param[t]
+            trust[t]   = ||param[t]|| / ||r[t]||
+            param[t+1] = param[t] - lr * trust[t] * r[t]
+
+            where m_hat and v_hat are the bias-corrected moment estimates (as
+            in Adam). If either ||param[t]|| or ||r[t]|| is 0, trust[t] = 1.
+
+        Parameters
+        ----------
+        lr : float (default: 0.001)
+            Global learning rate
+        decay1: float (default: 0.9)
+            The rate of decay to use for in running estimate of the first
+            moment (mean) of the gradient
+        decay2: float (default: 0.999)
+            The rate of decay to use for in running estimate of the second
+            moment (var) of the gradient
+        eps : float (default: 1e-6)
+            Constant term to avoid divide-by-zero errors during the update calc
+        weight_decay : float (default: 0)
+            The coefficient for the decoupled weight decay term
+        clip_norm : float (default : None)
+            If not None, all param gradients are scaled to have maximum l2 norm of
+            `clip_norm` before computing update.
+        """
+        super().__init__()
+
+        self.cache = {}
+        self.hyperparameters = {
+            "id": "LAMB",
+            "lr": lr,
+            "eps": eps,
+            "decay1": decay1,
+            "decay2": decay2,
+            "weight_decay": weight_decay,
+            "clip_norm": clip_norm,
+        }
+
+    def __str__(self):
+        H = self.hyperparameters
+        lr, d1, d2 = H["lr"], H["decay1"], H["decay2"]
+        eps, wd, cn = H["eps"], H["weight_decay"], H["clip_norm"]
+        return "LAMB(lr={}, decay1={}, decay2={}, eps={}, weight_decay={}, clip_norm={})".format(
+            lr, d1, d2, eps, wd, cn
+        )
+
+    def update(self, param, param_grad, param_name):
+        """
+        Compute the LAMB update for a given parameter.
+
+        Parameters
+        ----------
+        param : numpy array of shape (n, m)
+            The value of the parameter to be updated
+        param_grad : numpy array of shape (n, m)
+            The gradient of the loss function with respect to `param_name`
+        param_name : str
+            The name of the parameter
+
+        Returns
+        -------
+        updated_params : numpy array of shape (n, m)
+            The value of `param` after applying the LAMB update
+        """
+        C = self.cache
+        H = self.hyperparameters
+        lr, d1, d2 = H["lr"], H["decay1"], H["decay2"]
+        eps, wd = H["eps"], H["weight_decay"]
+
+        if param_name not in C:
+            C[param_name] = {
+                "t": 0,
+                "mean": np.zeros_like(param_grad),
+                "var": np.zeros_like(param_grad),
+            }
+
+        param_grad = self._clip(param_grad)
+
+        t = C[param_name]["t"] + 1
+        var = d2 * C[param_name]["var"] + (1 - d2) * param_grad ** 2
+        mean = d1 * C[param_name]["mean"] + (1 - d1) * param_grad
+
+        # update cache
+        C[param_name]["t"] = t
+        C[param_name]["var"] = var
+        C[param_name]["mean"] = mean
+
+        # Adam direction plus decoupled weight decay
+        v_hat = var / (1 - d2 ** t)
+        m_hat = mean / (1 - d1 ** t)
+        r = m_hat / (np.sqrt(v_hat) + eps)
+        if wd != 0:
+            r += wd * param
+
+        w_norm, r_norm = norm(param), norm(r)
+        trust = 1.0
+        if w_norm > 0 and r_norm > 0:
+            trust = w_norm / r_norm
+        return param - (lr * trust) * r
+
+
+class KFAC(OptimizerBase):
+    requires_factors = True
+
+    def __init__(
+        self,
+        lr=0.01,
+        momentum=0.9,
+        damping=1e-3,
+        decay=0.95,
+        inv_every=10,
+        kl_clip=1e-3,
+        clip_norm=None,
+        **kwargs
+    ):
+        """
+        Kronecker-factored approximate curvature (K-FAC) optimizer.
+        Approximates the Fisher information matrix for the weights of a
+        `FullyConnected` or `Conv2D` layer as the Kronecker product of the
+        covariance of the layer inputs, A, and the covariance of the gradient
+        of the loss wrt. the layer pre-activations, G. This makes the
+        preconditioned (natural) gradient cheap to compute from the inverses of
+        the two (small) factors.
+
+        The layers pass their inputs `a` (for `Conv2D`, the im2col patches) and
+        pre-activation gradients `g` to `update_factors` during the backward
+        pass, which maintains running averages of the factors:
+
+            A[t] = decay * A[t-1] + (1 - decay) * a.T @ a / n
+            G[t] = decay * G[t-1] + (1 - decay) * g.T @ g
+
+        where n is the number of rows of `a`. Since the losses in this
+        package sum over the examples in a batch, A (x) G approximates the
+        Fisher of the summed loss.
+
+        The damped factors are re-inverted every `inv_every` weight updates:
+
+            A_inv = inv(A + sqrt(damping) * I)
+            G_inv = inv(G + sqrt(damping) * I)
+
+        and used to precondition each gradient before a momentum step:
+
+            grad'[W]   = A_inv @ grad[W] @ G_inv
+            grad'[b]   = grad[b] @ G_inv
+            nu[t]      = min(1, sqrt(kl_clip / (lr ** 2 * <grad'[t], grad[t]>)))
+            update[t]  = cache[t] = momentum * cache[t-1] + lr * nu[t] * grad'[t]
+            param[t+1] = param[t] - update[t]
+
+        The factors are estimated from the observed gradients (ie., the
+        "empirical" Fisher), which becomes nearly singular as the training
+        loss falls. The trust-region scaling `nu` keeps the preconditioned
+        steps from blowing up when this happens.
+
+        For a grouped `Conv2D` layer, whose weights only connect the channels
+        within each group, the Fisher is approximated as block diagonal, with a
+        separate pair of factors for each group.
+
+        The bias is treated as a separate parameter with input covariance 1,
+        ignoring the weight-bias cross terms. Parameters for which no factors
+        have been collected (e.g., in other layer types) receive a plain SGD
+        momentum update.
+
+        Parameters
+        ----------
+        lr : float (default: 0.01)
+            Learning rate
+        momentum : float in range [0, 1] (default: 0.9)
+            The fraction of the previous update to add to the current update
+        damping : float (default: 1e-3)
+            The Tikhonov damping added to the Fisher approximation. Each factor
+            is damped by sqrt(damping).
+        decay : float in range [0, 1) (default: 0.95)
+            The decay rate for the running averages of the factors
+        inv_every : int (default: 10)
+            The number of weight updates between recomputing the factor
+            inverses
+        kl_clip : float or None (default: 1e-3)
+            The maximum predicted change in the model distribution per update.
+            If None, do not rescale the preconditioned gradients.
+        clip_norm : float (default: None)
+            If not None, all param gradients are scaled to have maximum l2 norm of
+            `clip_norm` before computing update.
+        """
+        super().__init__()
+
+        self.cache = {}
+        self.hyperparameters = {
+            "id": "KFAC",
+            "lr": lr,
+            "momentum": momentum,
+            "damping": damping,
+            "decay": decay,
+            "inv_every": inv_every,
+            "kl_clip": kl_clip,
+            "clip_norm": clip_norm,
+        }
+
+    def __str__(self):
+        H = self.hyperparameters
+        lr, mm, dp = H["lr"], H["momentum"], H["damping"]
+        dc, ie, kl, cn = H["decay"], H["inv_every"], H["kl_clip"], H["clip_norm"]
+        return "KFAC(lr={}, momentum={}, damping={}, decay={}, inv_every={}, kl_clip={}, clip_norm={})".format(
+            lr, mm, dp, dc, ie, kl, cn
+        )
+
+    def update_factors(self, a, g):
+        """
+        Update the running averages of the Kronecker factors for the layer.
+
+        Parameters
+        ----------
+        a : numpy array of shape (n, n_in) or (n_groups, n, n_in)
+            The layer inputs (or, for convolutional layers, the input patch
+            for each output location), with features ordered as the rows of
+            `W.reshape(n_in, n_out)`. For grouped layers, the patches for each
+            group of input channels.
+        g : numpy array of shape (n, n_out) or (n_groups, n, n_out // n_groups)
+            The gradient of the loss wrt. the layer pre-activations for each
+            row of `a`. For grouped layers, the gradients for each group of
+            output channels.
+        """
+        decay = self.hyperparameters["decay"]
+        A = np.swapaxes(a, -1, -2) @ a / a.shape[-2]
+        G = np.swapaxes(g, -1, -2) @ g
+
+        if "factors" not in self.cache:
+            self.cache["factors"] = {"n_steps": 0, "inv_step": None, "A": A, "G": G}
+            return
+
+        F = self.cache["factors"]
+        F["A"] = decay * F["A"] + (1 - decay) * A
+        F["G"] = decay * F["G"] + (1 - decay) * G
+
+    def _inverses(self, refresh):
+        # the inverses are only refreshed on weight updates, so the weight and
+        # bias of a layer are always preconditioned with the same factors
+        F = self.cache["factors"]
+        stale = F["n_steps"] - (F["inv_step"] or 0) >= self.hyperparameters["inv_every"]
+        if F["inv_step"] is None or (refresh and stale):
+            lam = np.sqrt(self.hyperparameters["damping"])
+            F["A_inv"] = np.linalg.inv(F["A"] + lam * np.eye(F["A"].shape[-1]))
+            F["G_inv"] = np.linalg.inv(F["G"] + lam * np.eye(F["G"].shape[-1]))
+            F["inv_step"] = F["n_steps"]
+        return F["A_inv"], F["G_inv"]
+
+    def update(self, param, param_grad, param_name):
+        """
+        Compute the K-FAC update for a given parameter.
+
+        Parameters
+        ----------
+        param : numpy array
+            The value of the parameter to be updated
+        param_grad : numpy array
+            The gradient of the loss function with respect to `param_name`
+        param_name : str
+            The name of the parameter
+
+        Returns
+        -------
+        updated_params : numpy array
+            The value of `param` after applying the K-FAC update
+        """
+        C = self.cache
+        H = self.hyperparameters
+        lr, momentum, kl_clip = H["lr"], H["momentum"], H["kl_clip"]
+
+        if param_name not in C:
+            C[param_name] = np.zeros_like(param_grad)
+
+        param_grad = self._clip(param_grad)
+
+        if "factors" in C and param_name in ["W", "b"]:
+            A_inv, G_inv = self._inverses(refresh=param_name == "W")
+
+            # split the output columns into groups (a single group unless the
+            # layer is grouped) and precondition each with its own factors
+            n_groups = G_inv.shape[0] if G_inv.ndim == 3 else 1
+            grad = param_grad.reshape(-1, n_groups, G_inv.shape[-1]).transpose(1, 0, 2)
+            if param_name == "W":
+                grad = A_inv @ grad
+                C["factors"]["n_steps"] += 1
+            grad = (grad @ G_inv).transpose(1, 0, 2).reshape(param_grad.shape)
+
+            # trust region: bound the predicted change in the model
+            # distribution, lr^2 * <grad', grad>, by `kl_clip`
+            kl = lr ** 2 * np.sum(grad * param_grad)
+            scale = 1.0
+            if kl_clip is not None and kl > kl_clip:
+                scale = np.sqrt(kl_clip / kl)
+            param_grad = scale * grad
+
+        update = momentum * C[param_name] + lr * param_grad
+        self.cache[param_name] = update
+        return param - update
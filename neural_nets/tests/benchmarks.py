@@ -0,0 +1,542 @@
+"""
+Performance benchmarks for the layers and modules in `neural_nets`.
+
+Each benchmark times the `forward`, `backward`, and `update` calls of a
+single layer / module separately over a set of realistic input shapes.
+
+Usage (from the `neural_nets` directory):
+
+    # run the suite and write the timings to a JSON file
+    python -m tests.benchmarks run -o results.json
+
+    # only run the benchmarks whose name contains "Conv"
+    python -m tests.benchmarks run -o results.json -k Conv
+
+    # flag any benchmark which is > 10% slower than the committed baseline
+    python -m tests.benchmarks compare results.json -t 0.1
+
+    # ... or than another stored set of results
+    python -m tests.benchmarks compare results.json -b other.json
+
+The committed baseline, `tests/benchmark_baseline.json`, records the timings
+of the suite at its default settings, along with the machine and library
+versions they were measured with (under `meta`). Timings are only comparable
+on the same hardware, so a CI runner (or any machine that compares against
+the baseline) should first record its own on an unchanged tree:
+
+    python -m tests.benchmarks run -o tests/benchmark_baseline.json
+
+and commit the result whenever the runner's hardware or the pinned numpy
+version changes.
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+from time import perf_counter, strftime
+from collections import OrderedDict
+
+import numpy as np
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+#######################################################################
+#                          Benchmark Cases                            #
+#######################################################################
+
+
+def _layer_case(layer, X):
+    """Wrap a single-input, single-output layer"""
+
+    def forward():
+        return layer.forward(X)
+
+    def backward(Y):
+        return layer.backward(np.ones_like(Y))
+
+    return forward, backward, layer.update
+
+
+def _recurrent_case(cell, X):
+    """Unroll a recurrent cell across the final (time) dimension of X"""
+    n_t = X.shape[2]
+
+    def forward():
+        cell.flush_gradients()
+        Y = [cell.forward(X[:, :, t]) for t in range(n_t)]
+        return [y[0] if isinstance(y, tuple) else y for y in Y]
+
+    def backward(Y):
+        for t in reversed(range(n_t)):
+            cell.backward(np.ones_like(Y[t]))
+
+    return forward, backward, cell.update
+
+
+def _wavenet_case(module, X_main, X_skip):
+    def forward():
+        return module.forward(X_main, X_skip)
+
+    def backward(Y):
+        Y_main, Y_skip = Y
+        return module.backward(np.ones_like(Y_skip), np.ones_like(Y_main))
+
+    return forward, backward, module.update
+
+
+def fully_connected(n_ex, n_in, n_out):
+    from layers import FullyConnected
+
+    L = FullyConnected(n_out=n_out, act_fn="ReLU")
+    return _layer_case(L, np.random.randn(n_ex, n_in))
+
+
+def conv1D(n_ex, l_in, in_ch, out_ch, kernel_width, dilation):
+    from layers import Conv1D
+
+    L = Conv1D(
+        out_ch=out_ch,
+        kernel_width=kernel_width,
+        pad="causal",
+        dilation=dilation,
+        act_fn="ReLU",
+    )
+    return _layer_case(L, np.random.randn(n_ex, l_in, in_ch))
+
+
+def conv2D(n_ex, in_rows, in_cols, in_ch, out_ch, kernel_shape, stride):
+    from layers import Conv2D
+
+    L = Conv2D(
+        out_ch=out_ch,
+        kernel_shape=kernel_shape,
+        pad="same",
+        stride=stride,
+        act_fn="ReLU",
+    )
+    return _layer_case(L, np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+def deconv2D(n_ex, in_rows, in_cols, in_ch, out_ch, kernel_shape, stride):
+    from layers import Deconv2D
+
+    L = Deconv2D(out_ch=out_ch, kernel_shape=kernel_shape, stride=stride)
+    return _layer_case(L, np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+def pool2D(n_ex, in_rows, in_cols, in_ch, kernel_shape, stride, mode):
+    from layers import Pool2D
+
+    L = Pool2D(kernel_shape=kernel_shape, stride=stride, mode=mode)
+    return _layer_case(L, np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+def batchnorm1D(n_ex, n_in):
+    from layers import BatchNorm1D
+
+    return _layer_case(BatchNorm1D(), np.random.randn(n_ex, n_in))
+
+
+def batchnorm2D(n_ex, in_rows, in_cols, in_ch):
+    from layers import BatchNorm2D
+
+    return _layer_case(BatchNorm2D(), np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+def rnn(n_ex, n_in, n_out, n_t):
+    from layers import RNNCell
+
+    return _recurrent_case(RNNCell(n_out=n_out), np.random.randn(n_ex, n_in, n_t))
+
+
+def lstm(n_ex, n_in, n_out, n_t):
+    from layers import LSTMCell
+
+    return _recurrent_case(LSTMCell(n_out=n_out), np.random.randn(n_ex, n_in, n_t))
+
+
+def bidirectional_lstm(n_ex, n_in, n_out, n_t):
+    from modules import BidirectionalLSTM
+
+    L = BidirectionalLSTM(n_out=n_out)
+    X = np.random.randn(n_ex, n_in, n_t)
+
+    def forward():
+        L.flush_gradients()
+        return L.forward(X)
+
+    def backward(Y):
+        return L.backward(np.ones_like(Y))
+
+    return forward, backward, L.update
+
+
+def wavenet(n_ex, l_in, ch_residual, ch_dilation, dilation):
+    from modules import WavenetResidualModule
+
+    L = WavenetResidualModule(
+        ch_residual=ch_residual,
+        ch_dilation=ch_dilation,
+        dilation=dilation,
+        kernel_width=2,
+    )
+    X_main = np.random.randn(n_ex, l_in, ch_residual)
+    X_skip = np.random.randn(n_ex, l_in, ch_residual)
+    return _wavenet_case(L, X_main, X_skip)
+
+
+def skip_identity(n_ex, in_rows, in_cols, in_ch, out_ch, kernel_shape):
+    from modules import SkipConnectionIdentityModule
+
+    L = SkipConnectionIdentityModule(
+        out_ch=out_ch,
+        kernel_shape1=kernel_shape,
+        kernel_shape2=kernel_shape,
+        act_fn=None,
+    )
+    return _layer_case(L, np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+def skip_conv(n_ex, in_rows, in_cols, in_ch, out_ch1, out_ch2, kernel_shape):
+    from modules import SkipConnectionConvModule
+
+    pad = (kernel_shape[0] // 2, kernel_shape[1] // 2)
+    L = SkipConnectionConvModule(
+        out_ch1=out_ch1,
+        out_ch2=out_ch2,
+        kernel_shape1=kernel_shape,
+        kernel_shape2=kernel_shape,
+        kernel_shape_skip=(1, 1),
+        pad1=pad,
+        pad2=pad,
+    )
+    return _layer_case(L, np.random.randn(n_ex, in_rows, in_cols, in_ch))
+
+
+# each entry is (benchmark name, case constructor, list of kwarg dicts)
+BENCHMARKS = [
+    (
+        "FullyConnected",
+        fully_connected,
+        [
+            {"n_ex": 128, "n_in": 784, "n_out": 256},
+            {"n_ex": 256, "n_in": 1024, "n_out": 1024},
+        ],
+    ),
+    (
+        "Conv1D",
+        conv1D,
+        [
+            {"n_ex": 16, "l_in": 1024, "in_ch": 32, "out_ch": 32, "kernel_width": 2, "dilation": 0},
+            {"n_ex": 16, "l_in": 1024, "in_ch": 32, "out_ch": 32, "kernel_width": 3, "dilation": 3},
+        ],
+    ),
+    (
+        "Conv2D",
+        conv2D,
+        [
+            {"n_ex": 32, "in_rows": 28, "in_cols": 28, "in_ch": 1, "out_ch": 32, "kernel_shape": (5, 5), "stride": 1},
+            {"n_ex": 16, "in_rows": 16, "in_cols": 16, "in_ch": 64, "out_ch": 64, "kernel_shape": (3, 3), "stride": 1},
+        ],
+    ),
+    (
+        "Deconv2D",
+        deconv2D,
+        [
+            {"n_ex": 16, "in_rows": 14, "in_cols": 14, "in_ch": 32, "out_ch": 16, "kernel_shape": (3, 3), "stride": 2},
+        ],
+    ),
+    (
+        "Pool2D",
+        pool2D,
+        [
+            {"n_ex": 8, "in_rows": 16, "in_cols": 16, "in_ch": 16, "kernel_shape": (2, 2), "stride": 2, "mode": "max"},
+            {"n_ex": 8, "in_rows": 16, "in_cols": 16, "in_ch": 16, "kernel_shape": (2, 2), "stride": 2, "mode": "average"},
+        ],
+    ),
+    (
+        "BatchNorm1D",
+        batchnorm1D,
+        [{"n_ex": 256, "n_in": 1024}],
+    ),
+    (
+        "BatchNorm2D",
+        batchnorm2D,
+        [{"n_ex": 32, "in_rows": 28, "in_cols": 28, "in_ch": 32}],
+    ),
+    (
+        "RNN",
+        rnn,
+        [{"n_ex": 64, "n_in": 128, "n_out": 256, "n_t": 32}],
+    ),
+    (
+        "LSTM",
+        lstm,
+        [{"n_ex": 64, "n_in": 128, "n_out": 256, "n_t": 32}],
+    ),
+    (
+        "BidirectionalLSTM",
+        bidirectional_lstm,
+        [{"n_ex": 32, "n_in": 64, "n_out": 128, "n_t": 16}],
+    ),
+    (
+        "WavenetResidualModule",
+        wavenet,
+        [
+            {"n_ex": 16, "l_in": 1024, "ch_residual": 32, "ch_dilation": 32, "dilation": 1},
+            {"n_ex": 16, "l_in": 1024, "ch_residual": 32, "ch_dilation": 32, "dilation": 7},
+        ],
+    ),
+    (
+        "SkipConnectionIdentityModule",
+        skip_identity,
+        [{"n_ex": 16, "in_rows": 16, "in_cols": 16, "in_ch": 32, "out_ch": 32, "kernel_shape": (3, 3)}],
+    ),
+    (
+        "SkipConnectionConvModule",
+        skip_conv,
+        [{"n_ex": 16, "in_rows": 16, "in_cols": 16, "in_ch": 32, "out_ch1": 32, "out_ch2": 64, "kernel_shape": (3, 3)}],
+    ),
+]
+
+
+#######################################################################
+#                             Runner                                  #
+#######################################################################
+
+
+def case_id(name, config):
+    args = ",".join("{}={}".format(k, v) for k, v in config.items())
+    return "{}[{}]".format(name, args).replace(" ", "")
+
+
+def _stats(times):
+    times = np.array(times)
+    return {
+        "median": float(np.median(times)),
+        "min": float(times.min()),
+        "mean": float(times.mean()),
+        "std": float(times.std()),
+        "n": len(times),
+    }
+
+
+def time_case(make_case, config, repeat=5, warmup=1, seed=12345):
+    """
+    Time the forward, backward, and update calls for a single benchmark case.
+    Each phase is timed in isolation: the untimed phases needed to set up a
+    call (e.g., a forward pass before each backward pass) run outside the
+    timer.
+
+    Parameters
+    ----------
+    make_case : callable
+        A function returning `forward`, `backward`, and `update` closures
+    config : dict
+        Keyword arguments for `make_case`
+    repeat : int (default: 5)
+        The number of timed calls per phase
+    warmup : int (default: 1)
+        The number of untimed iterations to run before timing
+    seed : int (default: 12345)
+        The seed for numpy's random number generator
+
+    Returns
+    -------
+    results : dict
+        Timing statistics (in seconds) for each phase
+    """
+    np.random.seed(seed)
+    forward, backward, update = make_case(**config)
+
+    for _ in range(warmup):
+        backward(forward())
+        update()
+
+    fwd, bwd, upd = [], [], []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        Y = forward()
+        fwd.append(perf_counter() - t0)
+
+        t0 = perf_counter()
+        backward(Y)
+        bwd.append(perf_counter() - t0)
+
+        t0 = perf_counter()
+        update()
+        upd.append(perf_counter() - t0)
+
+    return {"forward": _stats(fwd), "backward": _stats(bwd), "update": _stats(upd)}
+
+
+def run(keyword=None, repeat=5, warmup=1, verbose=True):
+    """
+    Run the benchmark suite.
+
+    Parameters
+    ----------
+    keyword : str (default: None)
+        If not None, only run benchmarks whose id contains `keyword`
+    repeat : int (default: 5)
+        The number of timed calls per phase
+    warmup : int (default: 1)
+        The number of untimed iterations to run before timing
+    verbose : bool (default: True)
+        Whether to print timings as each case finishes
+
+    Returns
+    -------
+    results : dict
+        A dictionary with `meta` (platform / library information) and
+        `results` (per-case timing statistics) entries
+    """
+    results = OrderedDict()
+    for name, make_case, configs in BENCHMARKS:
+        for config in configs:
+            cid = case_id(name, config)
+            if keyword is not None and keyword not in cid:
+                continue
+
+            results[cid] = time_case(make_case, config, repeat, warmup)
+
+            if verbose:
+                r = results[cid]
+                fstr = "{}\n\tforward: {:.2f}ms  backward: {:.2f}ms  update: {:.2f}ms"
+                print(
+                    fstr.format(
+                        cid,
+                        r["forward"]["median"] * 1e3,
+                        r["backward"]["median"] * 1e3,
+                        r["update"]["median"] * 1e3,
+                    )
+                )
+
+    meta = {
+        "timestamp": strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "repeat": repeat,
+        "warmup": warmup,
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(baseline, current, threshold=0.1, stat="median"):
+    """
+    Compare two sets of benchmark results.
+
+    Parameters
+    ----------
+    baseline : dict
+        The stored benchmark results, as returned by `run`
+    current : dict
+        The new benchmark results, as returned by `run`
+    threshold : float (default: 0.1)
+        The fractional slowdown beyond which a benchmark is flagged as a
+        regression (e.g., 0.1 flags anything > 10% slower than baseline)
+    stat : str (default: 'median')
+        The timing statistic to compare. Valid entries are {'median', 'min',
+        'mean'}.
+
+    Returns
+    -------
+    rows : list of dicts
+        One entry per (case, phase) present in both result sets, with the
+        baseline and current timings, their ratio, and whether the entry is a
+        regression
+    """
+    rows = []
+    base, cur = baseline["results"], current["results"]
+    for cid in cur:
+        if cid not in base:
+            continue
+
+        for phase in ["forward", "backward", "update"]:
+            t_base = base[cid][phase][stat]
+            t_cur = cur[cid][phase][stat]
+            ratio = t_cur / t_base if t_base > 0 else np.inf
+            rows.append(
+                {
+                    "case": cid,
+                    "phase": phase,
+                    "baseline": t_base,
+                    "current": t_cur,
+                    "ratio": ratio,
+                    "regression": ratio > 1 + threshold,
+                }
+            )
+    return rows
+
+
+def _format_comparison(rows):
+    fstr = "{:<3} {:<70} {:<9} {:>12} {:>12} {:>8}"
+    header = fstr.format("", "case", "phase", "base (ms)", "cur (ms)", "ratio")
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        lines.append(
+            fstr.format(
+                "!!" if r["regression"] else "",
+                r["case"][:70],
+                r["phase"],
+                "{:.3f}".format(r["baseline"] * 1e3),
+                "{:.3f}".format(r["current"] * 1e3),
+                "{:.2f}".format(r["ratio"]),
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="neural_nets benchmark suite")
+    sub = parser.add_subparsers(dest="command")
+
+    p_run = sub.add_parser("run", help="Run the benchmark suite")
+    p_run.add_argument("-o", "--out", default=None, help="Output JSON file")
+    p_run.add_argument("-k", "--keyword", default=None, help="Filter cases by name")
+    p_run.add_argument("-r", "--repeat", type=int, default=5)
+    p_run.add_argument("-w", "--warmup", type=int, default=1)
+
+    p_cmp = sub.add_parser("compare", help="Compare results against a baseline")
+    p_cmp.add_argument("current", help="Current results JSON")
+    p_cmp.add_argument("-b", "--baseline", default=BASELINE, help="Baseline results JSON")
+    p_cmp.add_argument("-t", "--threshold", type=float, default=0.1)
+    p_cmp.add_argument("-s", "--stat", default="median")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        results = run(args.keyword, args.repeat, args.warmup)
+        if args.out is not None:
+            with open(args.out, "w") as handle:
+                json.dump(results, handle, indent=2)
+        return 0
+
+    if args.command == "compare":
+        with open(args.baseline, "r") as handle:
+            baseline = json.load(handle)
+        with open(args.current, "r") as handle:
+            current = json.load(handle)
+
+        for key in ["platform", "processor", "numpy"]:
+            if baseline["meta"].get(key) != current["meta"].get(key):
+                fstr = "WARNING: baseline and current results differ in {}: {} vs. {}\n"
+                print(fstr.format(key, baseline["meta"].get(key), current["meta"].get(key)))
+
+        rows = compare(baseline, current, args.threshold, args.stat)
+        print(_format_comparison(rows))
+
+        n_reg = sum(r["regression"] for r in rows)
+        print("\n{} regression(s) out of {} comparisons".format(n_reg, len(rows)))
+        return 1 if n_reg > 0 else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
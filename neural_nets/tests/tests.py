@@ -24,6 +24,7 @@ from .torch_models import (
     TorchAddLayer,
     TorchConv1DLayer,
     TorchConv2DLayer,
+    TorchDepthwiseSeparableConv2DLayer,
     TorchPool2DLayer,
     TorchWavenetModule,
     TorchMultiplyLayer,
@@ -126,6 +127,10 @@ def test_losses(N=50):
     test_cross_entropy(N)
     test_cross_entropy_grad(N)
 
+    print("Testing SoftmaxCrossEntropy loss")
+    time.sleep(1)
+    test_softmax_cross_entropy(N)
+
     print("Testing VAELoss")
     time.sleep(1)
     test_VAE_loss(N)
@@ -150,20 +155,60 @@ def test_activations(N=50):
     test_relu_activation(N)
     test_relu_grad(N)
 
+    print("Testing fused activation + gradient")
+    time.sleep(1)
+    test_fn_and_grad(N)
+
 
 def test_layers(N=50):
     print("Testing FullyConnected layer")
     time.sleep(1)
     test_FullyConnected(N)
 
+    print("Testing FullyConnected layer with a softmax activation")
+    time.sleep(1)
+    test_FullyConnected_softmax(N)
+
+    print("Testing fused bias + activation epilogue")
+    time.sleep(1)
+    test_fused_epilogue(N)
+
+    print("Testing Embedding layer")
+    time.sleep(1)
+    test_Embedding(N)
+
+    print("Testing RestrictedBoltzmannMachine layer")
+    time.sleep(1)
+    test_RestrictedBoltzmannMachine(N)
+
+    print("Testing RestrictedBoltzmannMachine sampling")
+    time.sleep(1)
+    test_RBM_sample(N)
+
+    print("Testing Dropout wrapper")
+    time.sleep(1)
+    test_Dropout(N)
+
     print("Testing Conv1D layer")
     time.sleep(1)
     test_Conv1D(N)
 
+    print("Testing streaming Conv1D")
+    time.sleep(1)
+    test_Conv1D_stream(N)
+
     print("Testing Conv2D layer")
     time.sleep(1)
     test_Conv2D(N)
 
+    print("Testing grouped Conv2D layer")
+    time.sleep(1)
+    test_Conv2D_groups(N)
+
+    print("Testing DepthwiseSeparableConv2D layer")
+    time.sleep(1)
+    test_DepthwiseSeparableConv2D(N)
+
     print("Testing Pool2D layer")
     time.sleep(1)
     test_Pool2D(N)
@@ -197,6 +242,20 @@ def test_layers(N=50):
     test_RNNCell(N)
 
 
+def test_optimizers(N=50):
+    print("Testing LARS optimizer")
+    time.sleep(1)
+    test_LARS(N)
+
+    print("Testing LAMB optimizer")
+    time.sleep(1)
+    test_LAMB(N)
+
+    print("Testing KFAC optimizer")
+    time.sleep(1)
+    test_KFAC(N)
+
+
 def test_utils(N=50):
     print("Testing pad1D util")
     time.sleep(1)
@@ -206,6 +265,42 @@ def test_utils(N=50):
     time.sleep(1)
     test_conv(N)
 
+    print("Testing shape-only padding planners")
+    time.sleep(1)
+    test_plan_pad(N)
+
+    print("Testing im2col_1D / col2im_1D utils")
+    time.sleep(1)
+    test_im2col_1D(N)
+
+    print("Testing MemoryPlanner util")
+    time.sleep(1)
+    test_MemoryPlanner(N)
+
+    print("Testing Profiler util")
+    time.sleep(1)
+    test_Profiler(N)
+
+    print("Testing checkpoint util")
+    time.sleep(1)
+    test_checkpoint(N)
+
+    print("Testing global gradient norm clipping")
+    time.sleep(1)
+    test_clip_grad_norm(N)
+
+    print("Testing post-training quantization")
+    time.sleep(1)
+    test_quantization(N)
+
+    print("Testing magnitude pruning")
+    time.sleep(1)
+    test_pruning(N)
+
+    print("Testing BatchingServer util")
+    time.sleep(1)
+    test_BatchingServer(N)
+
 
 def test_modules(N=50):
     print("Testing BidirectionalLSTM module")
@@ -216,6 +311,10 @@ def test_modules(N=50):
     time.sleep(1)
     test_WaveNetModule(N)
 
+    print("Testing WaveNet incremental generation")
+    time.sleep(1)
+    test_wavenet_generate(N)
+
     print("Testing SkipConnectionIdentity module")
     time.sleep(1)
     test_SkipConnectionIdentityModule(N)
@@ -224,6 +323,20 @@ def test_modules(N=50):
     time.sleep(1)
     test_SkipConnectionConvModule(N)
 
+    print("Testing BatchNorm folding")
+    time.sleep(1)
+    test_fold_batchnorm(N)
+
+    print("Testing parallel branch execution")
+    time.sleep(1)
+    test_parallel_branches(N)
+
+
+def test_models(N=50):
+    print("Testing BernoulliVAE inference")
+    time.sleep(1)
+    test_VAE_inference(N)
+
 
 #######################################################################
 #                         Loss Functions                              #
@@ -386,6 +499,47 @@ def test_cross_entropy_grad(N=None):
         i += 1
 
 
+def test_softmax_cross_entropy(N=None):
+    from losses import SoftmaxCrossEntropy
+
+    N = np.inf if N is None else N
+
+    mine = SoftmaxCrossEntropy()
+
+    i = 1
+    while i < N + 1:
+        n_classes = np.random.randint(2, 100)
+        n_examples = np.random.randint(1, 1000)
+
+        labels = np.random.randint(0, n_classes, size=n_examples)
+        y = np.eye(n_classes)[labels]
+
+        # include large logits, which overflow an unfused softmax + log
+        z = random_tensor((n_examples, n_classes), standardize=True)
+        z[0] *= 1000
+
+        tz = torch.tensor(z, requires_grad=True)
+        gold_loss = F.cross_entropy(tz, torch.LongTensor(labels), reduction="sum")
+        gold_loss.backward()
+        gold_grad = tz.grad.numpy()
+
+        for targets in [y, labels]:
+            loss, grad = mine.loss_and_grad(targets, z)
+            assert_almost_equal(loss, gold_loss.item(), decimal=6)
+            assert_almost_equal(grad, gold_grad)
+            assert_almost_equal(mine.loss(targets, z), gold_loss.item(), decimal=6)
+            assert_almost_equal(mine.grad(targets, z), gold_grad)
+
+        # writing the gradient into the logits buffer
+        Z = z.copy()
+        loss, grad = mine.loss_and_grad(labels, Z, out=Z)
+        assert grad is Z
+        assert_almost_equal(loss, gold_loss.item(), decimal=6)
+        assert_almost_equal(Z, gold_grad)
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                          Activations                                #
 #######################################################################
@@ -501,6 +655,75 @@ def test_relu_grad(N=None):
         i += 1
 
 
+def test_fn_and_grad(N=None):
+    from activations import Sigmoid, Tanh, ReLU, LeakyReLU, Affine, Softmax
+
+    N = np.inf if N is None else N
+
+    i = 0
+    while i < N:
+        n_ex = np.random.randint(1, 100)
+        n_dims = np.random.randint(1, 100)
+        alpha = np.random.uniform(0, 1)
+        slope, intercept = np.random.uniform(-2, 2, size=2)
+
+        acts = [
+            Sigmoid(),
+            Tanh(),
+            ReLU(),
+            LeakyReLU(alpha=alpha),
+            Affine(slope=slope, intercept=intercept),
+        ]
+
+        z = random_tensor((n_ex, n_dims))
+        for act in acts:
+            y_gold, grad_gold = act.fn(z), act.grad(z)
+
+            # output-based derivatives agree with the input-based ones
+            assert act.output_grad
+            assert_almost_equal(act.grad_from_output(y_gold), grad_gold)
+
+            # fused activation + gradient
+            y, dydz = act.fn_and_grad(z)
+            assert_almost_equal(y, y_gold)
+            assert_almost_equal(dydz, grad_gold)
+
+            # writing into an output buffer (including in-place)
+            buf = np.empty_like(z)
+            assert act.fn(z, out=buf) is buf
+            assert_almost_equal(buf, y_gold)
+
+            Z = z.copy()
+            y, dydz = act.fn_and_grad(Z, out=Z)
+            assert y is Z
+            assert_almost_equal(Z, y_gold)
+            assert_almost_equal(dydz, grad_gold)
+
+        # softmax has no elementwise derivative; its fused pass returns a
+        # jacobian-vector product instead
+        sm = Softmax()
+        assert not sm.output_grad
+
+        dLdy = random_tensor((n_ex, n_dims))
+        y_gold = sm.fn(z)
+        J = np.stack([np.diag(r) - np.outer(r, r) for r in y_gold])
+        dLdz_gold = np.einsum("nij,nj->ni", J, dLdy)
+
+        Z = z.copy()
+        y, jvp = sm.fn_and_grad(Z, out=Z)
+        assert y is Z
+        assert_almost_equal(y, y_gold)
+        assert_almost_equal(jvp(dLdy), dLdz_gold)
+        try:
+            sm.grad(z)
+            assert False, "Softmax.grad should raise"
+        except NotImplementedError:
+            pass
+
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                          Layers                                     #
 #######################################################################
@@ -564,6 +787,297 @@ def test_FullyConnected(N=None):
         i += 1
 
 
+def test_FullyConnected_softmax(N=None):
+    from layers import FullyConnected
+    from activations import Softmax
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 100)
+        n_in = np.random.randint(1, 100)
+        n_out = np.random.randint(1, 100)
+        X = random_tensor((n_ex, n_in), standardize=True)
+        dLdy = random_tensor((n_ex, n_out), standardize=True)
+
+        L1 = FullyConnected(n_out=n_out, act_fn=Softmax())
+        y_pred = L1.forward(X)
+        dLdX = L1.backward(dLdy)
+
+        # gold standard: backprop the same upstream gradient through torch
+        W = torch.tensor(L1.parameters["W"], requires_grad=True)
+        b = torch.tensor(L1.parameters["b"], requires_grad=True)
+        X_t = torch.tensor(X, requires_grad=True)
+        Z = X_t @ W + b
+        Z.retain_grad()
+        Y = F.softmax(Z, dim=1)
+        (Y * torch.tensor(dLdy)).sum().backward()
+
+        golds = {
+            "y": Y.detach().numpy(),
+            "dLdZ": Z.grad.numpy(),
+            "dLdW": W.grad.numpy(),
+            "dLdB": b.grad.numpy(),
+            "dLdX": X_t.grad.numpy(),
+        }
+        params = [
+            (y_pred, "y"),
+            (L1.gradients["Z"], "dLdZ"),
+            (L1.gradients["W"], "dLdW"),
+            (L1.gradients["b"], "dLdB"),
+            (dLdX, "dLdX"),
+        ]
+
+        print("\nTrial {}".format(i))
+        for ix, (mine, label) in enumerate(params):
+            assert_almost_equal(
+                mine, golds[label], err_msg=err_fmt(params, golds, ix), decimal=5
+            )
+            print("\tPASSED {}".format(label))
+        i += 1
+
+
+def test_fused_epilogue(N=None):
+    from layers import FullyConnected, Conv2D
+    from activations import Tanh, ReLU, Sigmoid, Affine, LeakyReLU
+
+    N = np.inf if N is None else N
+
+    acts = [Tanh(), ReLU(), Sigmoid(), Affine(slope=2, intercept=1), LeakyReLU()]
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 20)
+        n_in = np.random.randint(1, 20)
+        n_out = np.random.randint(1, 20)
+        act_fn = acts[np.random.randint(0, len(acts))]
+
+        X = random_tensor((n_ex, n_in), standardize=True)
+        dLdY = random_tensor((n_ex, n_out), standardize=True)
+
+        # unfused reference: Y = act_fn(X . W + b)
+        L = FullyConnected(n_out=n_out, act_fn=act_fn)
+        L.forward(X)
+        L.parameters["b"] = random_tensor((1, n_out), standardize=True)
+        W, b = L.parameters["W"], L.parameters["b"]
+        Z = np.dot(X, W) + b
+        dZ_gold = dLdY * act_fn.grad(Z)
+
+        assert_almost_equal(L.forward(X), act_fn.fn(Z))
+        assert_almost_equal(L.backward(dLdY), np.dot(dZ_gold, W.T))
+        assert_almost_equal(L.gradients["W"], np.dot(X.T, dZ_gold))
+
+        # ReLU layers should only cache a bit-packed mask
+        if isinstance(act_fn, ReLU):
+            conv = Conv2D(out_ch=n_out, kernel_shape=(3, 3), pad="same", act_fn=act_fn)
+            conv.forward(random_tensor((n_ex, 5, 5, n_in), standardize=True))
+            packed, shape = conv.derived_variables["act_cache"]
+            assert packed.nbytes == int(np.ceil(np.prod(shape) / 8))
+
+        print("PASSED")
+        i += 1
+
+
+def test_Embedding(N=None):
+    from layers import Embedding, FullyConnected
+    from optimizers import SGD, AdaGrad, RMSProp, Adam
+
+    N = np.inf if N is None else N
+
+    optimizers = [
+        lambda: SGD(lr=0.1, momentum=0.9),
+        lambda: AdaGrad(lr=0.1),
+        lambda: RMSProp(lr=0.1),
+        lambda: Adam(lr=0.1),
+    ]
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 10)
+        n_t = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 10)
+        vocab_size = np.random.randint(2, 50)
+        pool = [None, "sum", "mean"][np.random.randint(0, 3)]
+        opt = optimizers[np.random.randint(0, len(optimizers))]
+
+        X = np.random.randint(0, vocab_size, size=(n_ex, n_t))
+
+        # gold standard: a bias-free FullyConnected layer on one-hot inputs
+        if pool is None:
+            X_oh = np.eye(vocab_size)[X.ravel()]
+        else:
+            X_oh = np.eye(vocab_size)[X].sum(axis=1)
+            X_oh = X_oh / n_t if pool == "mean" else X_oh
+
+        L1 = Embedding(n_out=n_out, vocab_size=vocab_size, pool=pool, optimizer=opt())
+        L2 = FullyConnected(n_out=n_out, optimizer=opt())
+        L2.forward(X_oh)
+        L2.parameters["W"] = L1.parameters["W"].copy()
+
+        y_pred = L1.forward(X)
+        y_gold = L2.forward(X_oh)
+        assert_almost_equal(y_pred.reshape(y_gold.shape), y_gold)
+
+        dLdy = random_tensor(y_gold.shape, standardize=True)
+        L1.backward(dLdy.reshape(y_pred.shape))
+        L2.backward(dLdy)
+
+        ix, dW = L1.gradients["W"]
+        assert_almost_equal(dW, L2.gradients["W"][ix])
+        assert len(ix) == len(np.unique(X))
+
+        # a single lazy update matches the dense update, since the optimizer
+        # state for untouched rows is still zero
+        L1.update()
+        L2.update()
+        assert_almost_equal(L1.parameters["W"], L2.parameters["W"])
+
+        print("PASSED")
+        i += 1
+
+
+def test_RestrictedBoltzmannMachine(N=None):
+    from layers import RestrictedBoltzmannMachine
+    from optimizers import SGD
+
+    N = np.inf if N is None else N
+
+    def free_energy(L, V):
+        W, b_in, b_out = L.parameters["W"], L.parameters["b_in"], L.parameters["b_out"]
+        return -np.dot(V, b_in.T)[:, 0] - np.logaddexp(0, np.dot(V, W) + b_out).sum(axis=1)
+
+    i = 1
+    while i < N + 1:
+        n_in = np.random.randint(10, 30)
+        n_out = np.random.randint(5, 20)
+        n_ex = np.random.randint(10, 40)
+        n_particles = np.random.randint(10, 40)
+        n_temps = np.random.randint(1, 5)
+
+        # noisy copies of a few binary prototypes
+        protos = (np.random.rand(3, n_in) < 0.5).astype(float)
+
+        def data(n):
+            X = protos[np.random.randint(0, len(protos), n)]
+            return np.abs(X - (np.random.rand(*X.shape) < 0.05))
+
+        L = RestrictedBoltzmannMachine(
+            n_out=n_out,
+            K=1,
+            persistent=True,
+            n_particles=n_particles,
+            n_temperatures=n_temps,
+            optimizer=SGD(lr=0.01),
+        )
+
+        for _ in range(500):
+            L.CD_update(data(n_ex))
+            for k, v in L.gradients.items():
+                assert v.shape == L.parameters[k].shape
+            L.update()
+
+        # the fantasy particles persist across updates
+        assert L.chains.shape == (n_temps, n_particles, n_in)
+        assert set(np.unique(L.chains)) <= {0.0, 1.0}
+
+        # PCD-1 should assign the training patterns lower free energy than
+        # random binary vectors
+        rand = (np.random.rand(100, n_in) < 0.5).astype(float)
+        assert free_energy(L, protos).mean() < free_energy(L, rand).mean()
+
+        print("PASSED")
+        i += 1
+
+
+def test_RBM_sample(N=None):
+    from itertools import product
+    from layers import RestrictedBoltzmannMachine
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_in = np.random.randint(1, 5)
+        n_out = np.random.randint(1, 5)
+
+        L = RestrictedBoltzmannMachine(n_out=n_out)
+        L.n_in = n_in
+        L._init_params()
+        L.parameters["W"] = random_tensor((n_in, n_out), standardize=True)
+        L.parameters["b_in"] = random_tensor((1, n_in), standardize=True)
+        L.parameters["b_out"] = random_tensor((1, n_out), standardize=True)
+        W, b_in, b_out = L.parameters["W"], L.parameters["b_in"], L.parameters["b_out"]
+
+        # exact marginal p(v) by enumerating every visible state
+        states = np.array(list(product([0, 1], repeat=n_in)), dtype=float)
+        F = -np.dot(states, b_in.T)[:, 0] - np.logaddexp(0, states @ W + b_out).sum(axis=1)
+        p_gold = np.exp(-F - np.max(-F))
+        p_gold /= p_gold.sum()
+
+        n_chains = np.random.randint(100, 1000)
+        S = L.sample(20000, n_chains=n_chains, burn_in=20, thin=2, anneal=0.5, seed=i)
+        p_emp = np.array([np.all(S == v, axis=1).mean() for v in states])
+
+        assert S.shape == (20000, n_in)
+        assert 0.5 * np.abs(p_gold - p_emp).sum() < 0.05
+
+        # the same seed reproduces the same samples
+        S2 = L.sample(20000, n_chains=n_chains, burn_in=20, thin=2, anneal=0.5, seed=i)
+        assert_almost_equal(S, S2)
+
+        print("PASSED")
+        i += 1
+
+
+def test_Dropout(N=None):
+    from layers import FullyConnected
+    from wrappers import Dropout
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 100)
+        n_in = np.random.randint(1, 100)
+        n_out = np.random.randint(1, 20)
+        p = [0.5, np.random.rand() * 0.9][np.random.randint(0, 2)]
+
+        X = random_tensor((n_ex, n_in), standardize=True)
+        L1 = FullyConnected(n_out=n_out, act_fn="Tanh")
+        L1.forward(X)
+        L2 = Dropout(deepcopy(L1), p)
+
+        y_pred = L2.forward(X)
+        mask = L2._unpack_mask()
+        packed, _ = L2._mask
+        assert packed.nbytes == int(np.ceil(X.size / 8))
+
+        # the mask is applied to the layer input and the output is rescaled
+        scaler = 1.0 / (1.0 - p)
+        y_gold = scaler * L1.forward(X * mask)
+        assert_almost_equal(y_pred, y_gold)
+
+        # the same mask gates the gradient wrt. the input
+        dLdy = random_tensor(y_gold.shape, standardize=True)
+        dLdy_orig = dLdy.copy()
+        dX_pred = L2.backward(dLdy)
+        dX_gold = L1.backward(dLdy * scaler) * mask
+        assert_almost_equal(dX_pred, dX_gold)
+        assert_almost_equal(dLdy, dLdy_orig)
+
+        # the fraction of dropped units should be roughly p
+        L2.forward(random_tensor((1000, n_in)))
+        assert abs((1 - L2._unpack_mask().mean()) - p) < 0.05
+
+        # frozen layers compute the identity
+        L2.freeze()
+        assert_almost_equal(L2.forward(X), L1.forward(X))
+
+        print("PASSED")
+        i += 1
+
+
 def test_BatchNorm1D(N=None):
     from layers import BatchNorm1D
 
@@ -845,6 +1359,52 @@ def test_RNNCell(N=None):
         i += 1
 
 
+def test_Conv1D_stream(N=None):
+    from layers import Conv1D
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 5)
+        l_in = np.random.randint(1, 100)
+        in_ch, out_ch = np.random.randint(1, 10), np.random.randint(1, 10)
+        kernel_width = np.random.randint(1, 5)
+        dilation = np.random.randint(0, 4)
+        act_fn = np.random.choice(["ReLU", "Tanh", "Affine(slope=1, intercept=0)"])
+
+        L = Conv1D(
+            out_ch=out_ch,
+            kernel_width=kernel_width,
+            pad="causal",
+            dilation=dilation,
+            act_fn=act_fn,
+        )
+
+        # initialize the layer, then use a nonzero bias
+        X = random_tensor((n_ex, l_in, in_ch), standardize=True)
+        L.forward(X)
+        L.parameters["b"] = np.random.randn(*L.parameters["b"].shape)
+        Y_offline = L.forward(X)
+
+        # process the stream in one call, then in random chunks
+        L.reset_stream()
+        Y_full = L.forward_stream(X)
+        assert np.array_equal(Y_full, Y_offline)
+
+        L.reset_stream()
+        chunks, t = [], 0
+        while t < l_in:
+            size = np.random.randint(1, 8)
+            chunks.append(L.forward_stream(X[:, t : t + size]))
+            t += size
+
+        Y_stream = np.concatenate(chunks, axis=1)
+        assert np.array_equal(Y_stream, Y_full)
+        print("PASSED")
+        i += 1
+
+
 def test_Conv2D(N=None):
     from layers import Conv2D
     from activations import Tanh, ReLU, Sigmoid, Affine
@@ -931,8 +1491,8 @@ def test_Conv2D(N=None):
         i += 1
 
 
-def test_Conv1D(N=None):
-    from layers import Conv1D
+def test_Conv2D_groups(N=None):
+    from layers import Conv2D
     from activations import Tanh, ReLU, Sigmoid, Affine
 
     N = np.inf if N is None else N
@@ -949,42 +1509,51 @@ def test_Conv1D(N=None):
     i = 1
     while i < N + 1:
         n_ex = np.random.randint(1, 10)
-        l_in = np.random.randint(1, 10)
-        n_in, n_out = np.random.randint(1, 3), np.random.randint(1, 3)
-        f_width = min(l_in, np.random.randint(1, 5))
+        in_rows = np.random.randint(1, 10)
+        in_cols = np.random.randint(1, 10)
+        groups = np.random.randint(2, 5)
+        n_in = groups * np.random.randint(1, 3)
+        n_out = groups * np.random.randint(1, 3)
+        f_shape = (
+            min(in_rows, np.random.randint(1, 5)),
+            min(in_cols, np.random.randint(1, 5)),
+        )
         p, s = np.random.randint(0, 5), np.random.randint(1, 3)
         d = np.random.randint(0, 5)
 
-        fc = f_width * (d + 1) - d
-        l_out = int(1 + (l_in + 2 * p - fc) / s)
+        fr, fc = f_shape[0] * (d + 1) - d, f_shape[1] * (d + 1) - d
+        out_rows = int(1 + (in_rows + 2 * p - fr) / s)
+        out_cols = int(1 + (in_cols + 2 * p - fc) / s)
 
-        if l_out <= 0:
+        if out_rows <= 0 or out_cols <= 0:
             continue
 
-        X = random_tensor((n_ex, l_in, n_in), standardize=True)
+        X = random_tensor((n_ex, in_rows, in_cols, n_in), standardize=True)
 
         # randomly select an activation function
         act_fn, torch_fn, act_fn_name = acts[np.random.randint(0, len(acts))]
 
-        # initialize Conv2D layer
-        L1 = Conv1D(
+        # initialize grouped Conv2D layer
+        L1 = Conv2D(
             out_ch=n_out,
-            kernel_width=f_width,
+            kernel_shape=f_shape,
             act_fn=act_fn,
             pad=p,
             stride=s,
             dilation=d,
+            groups=groups,
         )
 
         # forward prop
         y_pred = L1.forward(X)
+        assert L1.parameters["W"].shape == f_shape + (n_in // groups, n_out)
 
         # backprop
         dLdy = np.ones_like(y_pred)
         dLdX = L1.backward(dLdy)
 
         # get gold standard gradients
-        gold_mod = TorchConv1DLayer(
+        gold_mod = TorchConv2DLayer(
             n_in, n_out, torch_fn, L1.parameters, L1.hyperparameters
         )
         golds = gold_mod.extract_grads(X)
@@ -1000,20 +1569,26 @@ def test_Conv1D(N=None):
         ]
 
         print("\nTrial {}".format(i))
-        print("pad={}, stride={}, f_width={}, n_ex={}".format(p, s, f_width, n_ex))
-        print("l_in={}, n_in={}".format(l_in, n_in))
-        print("l_out={}, n_out={}".format(l_out, n_out))
-        print("dilation={}".format(d))
+        print("pad={}, stride={}, f_shape={}, n_ex={}".format(p, s, f_shape, n_ex))
+        print("in_rows={}, in_cols={}, n_in={}".format(in_rows, in_cols, n_in))
+        print("out_rows={}, out_cols={}, n_out={}".format(out_rows, out_cols, n_out))
+        print("dilation={}, groups={}".format(d, groups))
         for ix, (mine, label) in enumerate(params):
             assert_almost_equal(
                 mine, golds[label], err_msg=err_fmt(params, golds, ix), decimal=4
             )
             print("\tPASSED {}".format(label))
+
+        # the naive backward pass handles groups too
+        dW, dB = L1.gradients["W"], L1.gradients["b"]
+        assert_almost_equal(L1._backward_naive(dLdy), dLdX)
+        assert_almost_equal(L1.gradients["W"], dW)
+        assert_almost_equal(L1.gradients["b"], dB)
         i += 1
 
 
-def test_Deconv2D(N=None):
-    from layers import Deconv2D
+def test_DepthwiseSeparableConv2D(N=None):
+    from layers import DepthwiseSeparableConv2D
     from activations import Tanh, ReLU, Sigmoid, Affine
 
     N = np.inf if N is None else N
@@ -1032,15 +1607,18 @@ def test_Deconv2D(N=None):
         n_ex = np.random.randint(1, 10)
         in_rows = np.random.randint(1, 10)
         in_cols = np.random.randint(1, 10)
-        n_in, n_out = np.random.randint(1, 3), np.random.randint(1, 3)
+        n_in, n_out = np.random.randint(1, 5), np.random.randint(1, 5)
+        dm = np.random.randint(1, 3)
         f_shape = (
             min(in_rows, np.random.randint(1, 5)),
             min(in_cols, np.random.randint(1, 5)),
         )
         p, s = np.random.randint(0, 5), np.random.randint(1, 3)
+        d = np.random.randint(0, 5)
 
-        out_rows = s * (in_rows - 1) - 2 * p + f_shape[0]
-        out_cols = s * (in_cols - 1) - 2 * p + f_shape[1]
+        fr, fc = f_shape[0] * (d + 1) - d, f_shape[1] * (d + 1) - d
+        out_rows = int(1 + (in_rows + 2 * p - fr) / s)
+        out_cols = int(1 + (in_cols + 2 * p - fc) / s)
 
         if out_rows <= 0 or out_cols <= 0:
             continue
@@ -1050,11 +1628,179 @@ def test_Deconv2D(N=None):
         # randomly select an activation function
         act_fn, torch_fn, act_fn_name = acts[np.random.randint(0, len(acts))]
 
-        # initialize Deconv2D layer
-        L1 = Deconv2D(
-            out_ch=n_out, kernel_shape=f_shape, act_fn=act_fn, pad=p, stride=s
-        )
-
+        # initialize DepthwiseSeparableConv2D layer
+        L1 = DepthwiseSeparableConv2D(
+            out_ch=n_out,
+            kernel_shape=f_shape,
+            act_fn=act_fn,
+            pad=p,
+            stride=s,
+            dilation=d,
+            depth_multiplier=dm,
+        )
+
+        # forward prop
+        y_pred = L1.forward(X)
+
+        # backprop
+        dLdy = np.ones_like(y_pred)
+        dLdX = L1.backward(dLdy)
+
+        # get gold standard gradients
+        gold_mod = TorchDepthwiseSeparableConv2DLayer(
+            n_in, n_out, torch_fn, L1.parameters, L1.hyperparameters
+        )
+        golds = gold_mod.extract_grads(X)
+
+        params = [
+            (L1.X, "X"),
+            (y_pred, "y"),
+            (L1.parameters["W_depthwise"], "W_depthwise"),
+            (L1.parameters["W_pointwise"], "W_pointwise"),
+            (L1.parameters["b"], "b"),
+            (L1.gradients["W_depthwise"], "dLdW_depthwise"),
+            (L1.gradients["W_pointwise"], "dLdW_pointwise"),
+            (L1.gradients["b"], "dLdB"),
+            (dLdX, "dLdX"),
+        ]
+
+        print("\nTrial {}".format(i))
+        print("pad={}, stride={}, f_shape={}, n_ex={}".format(p, s, f_shape, n_ex))
+        print("in_rows={}, in_cols={}, n_in={}".format(in_rows, in_cols, n_in))
+        print("out_rows={}, out_cols={}, n_out={}".format(out_rows, out_cols, n_out))
+        print("dilation={}, depth_multiplier={}".format(d, dm))
+        for ix, (mine, label) in enumerate(params):
+            assert_almost_equal(
+                mine, golds[label], err_msg=err_fmt(params, golds, ix), decimal=4
+            )
+            print("\tPASSED {}".format(label))
+        i += 1
+
+
+def test_Conv1D(N=None):
+    from layers import Conv1D
+    from activations import Tanh, ReLU, Sigmoid, Affine
+
+    N = np.inf if N is None else N
+
+    np.random.seed(12345)
+
+    acts = [
+        (Tanh(), nn.Tanh(), "Tanh"),
+        (Sigmoid(), nn.Sigmoid(), "Sigmoid"),
+        (ReLU(), nn.ReLU(), "ReLU"),
+        (Affine(), TorchLinearActivation(), "Affine"),
+    ]
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 10)
+        l_in = np.random.randint(1, 10)
+        n_in, n_out = np.random.randint(1, 3), np.random.randint(1, 3)
+        f_width = min(l_in, np.random.randint(1, 5))
+        p, s = np.random.randint(0, 5), np.random.randint(1, 3)
+        d = np.random.randint(0, 5)
+
+        fc = f_width * (d + 1) - d
+        l_out = int(1 + (l_in + 2 * p - fc) / s)
+
+        if l_out <= 0:
+            continue
+
+        X = random_tensor((n_ex, l_in, n_in), standardize=True)
+
+        # randomly select an activation function
+        act_fn, torch_fn, act_fn_name = acts[np.random.randint(0, len(acts))]
+
+        # initialize Conv2D layer
+        L1 = Conv1D(
+            out_ch=n_out,
+            kernel_width=f_width,
+            act_fn=act_fn,
+            pad=p,
+            stride=s,
+            dilation=d,
+        )
+
+        # forward prop
+        y_pred = L1.forward(X)
+
+        # backprop
+        dLdy = np.ones_like(y_pred)
+        dLdX = L1.backward(dLdy)
+
+        # get gold standard gradients
+        gold_mod = TorchConv1DLayer(
+            n_in, n_out, torch_fn, L1.parameters, L1.hyperparameters
+        )
+        golds = gold_mod.extract_grads(X)
+
+        params = [
+            (L1.X, "X"),
+            (y_pred, "y"),
+            (L1.parameters["W"], "W"),
+            (L1.parameters["b"], "b"),
+            (L1.gradients["W"], "dLdW"),
+            (L1.gradients["b"], "dLdB"),
+            (dLdX, "dLdX"),
+        ]
+
+        print("\nTrial {}".format(i))
+        print("pad={}, stride={}, f_width={}, n_ex={}".format(p, s, f_width, n_ex))
+        print("l_in={}, n_in={}".format(l_in, n_in))
+        print("l_out={}, n_out={}".format(l_out, n_out))
+        print("dilation={}".format(d))
+        for ix, (mine, label) in enumerate(params):
+            assert_almost_equal(
+                mine, golds[label], err_msg=err_fmt(params, golds, ix), decimal=4
+            )
+            print("\tPASSED {}".format(label))
+        i += 1
+
+
+def test_Deconv2D(N=None):
+    from layers import Deconv2D
+    from activations import Tanh, ReLU, Sigmoid, Affine
+
+    N = np.inf if N is None else N
+
+    np.random.seed(12345)
+
+    acts = [
+        (Tanh(), nn.Tanh(), "Tanh"),
+        (Sigmoid(), nn.Sigmoid(), "Sigmoid"),
+        (ReLU(), nn.ReLU(), "ReLU"),
+        (Affine(), TorchLinearActivation(), "Affine"),
+    ]
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 10)
+        in_rows = np.random.randint(1, 10)
+        in_cols = np.random.randint(1, 10)
+        n_in, n_out = np.random.randint(1, 3), np.random.randint(1, 3)
+        f_shape = (
+            min(in_rows, np.random.randint(1, 5)),
+            min(in_cols, np.random.randint(1, 5)),
+        )
+        p, s = np.random.randint(0, 5), np.random.randint(1, 3)
+
+        out_rows = s * (in_rows - 1) - 2 * p + f_shape[0]
+        out_cols = s * (in_cols - 1) - 2 * p + f_shape[1]
+
+        if out_rows <= 0 or out_cols <= 0:
+            continue
+
+        X = random_tensor((n_ex, in_rows, in_cols, n_in), standardize=True)
+
+        # randomly select an activation function
+        act_fn, torch_fn, act_fn_name = acts[np.random.randint(0, len(acts))]
+
+        # initialize Deconv2D layer
+        L1 = Deconv2D(
+            out_ch=n_out, kernel_shape=f_shape, act_fn=act_fn, pad=p, stride=s
+        )
+
         # forward prop
         try:
             y_pred = L1.forward(X)
@@ -1270,6 +2016,66 @@ def grad_check_RNN(model, loss_func, param_name, n_t, X, epsilon=1e-7):
 #######################################################################
 
 
+def test_wavenet_generate(N=None):
+    from modules import WavenetResidualModule, wavenet_generate
+
+    N = np.inf if N is None else N
+
+    def run_stack(modules, X):
+        X_main, X_skip = X, np.zeros_like(X)
+        for m in modules:
+            X_main, X_skip = m.forward(X_main, X_skip)
+        return X_main, X_skip
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 5)
+        n_layers = np.random.randint(1, 5)
+        l_in = np.random.randint(1, 30)
+        ch_residual, ch_dilation = np.random.randint(1, 5), np.random.randint(1, 5)
+
+        modules = [
+            WavenetResidualModule(
+                ch_residual=ch_residual,
+                ch_dilation=ch_dilation,
+                kernel_width=2,
+                dilation=2 ** k - 1,
+            )
+            for k in range(n_layers)
+        ]
+        for m in modules:
+            m.conv_dilation.parameters["b"] = np.random.randn(1, 1, ch_dilation)
+
+        # stepping through a sequence reproduces the full causal forward pass
+        X = np.random.randn(n_ex, l_in, ch_residual)
+        gold_main, gold_skip = run_stack(modules, X)
+
+        for m in modules:
+            m.reset_queue()
+
+        for t in range(l_in):
+            x_main, x_skip = X[:, t], None
+            for m in modules:
+                x_main, x_skip = m.forward_step(x_main, x_skip)
+            assert_almost_equal(x_main, gold_main[:, t])
+            assert_almost_equal(x_skip, gold_skip[:, t])
+
+        # autoregressive generation matches rerunning the full forward pass on
+        # the sequence generated so far
+        next_input = lambda y: np.tanh(y)
+        x0 = np.random.randn(n_ex, ch_residual)
+        Y_gen = wavenet_generate(modules, x0, l_in, next_input)
+
+        seq = x0[:, None, :]
+        for t in range(l_in):
+            _, Y_skip = run_stack(modules, seq)
+            assert_almost_equal(Y_gen[:, t], Y_skip[:, -1])
+            seq = np.concatenate([seq, next_input(Y_skip[:, -1:])], axis=1)
+
+        print("PASSED")
+        i += 1
+
+
 def test_SkipConnectionIdentityModule(N=None):
     from modules import SkipConnectionIdentityModule
     from activations import Tanh, ReLU, Sigmoid, Affine
@@ -1400,6 +2206,89 @@ def test_SkipConnectionIdentityModule(N=None):
         i += 1
 
 
+def test_parallel_branches(N=None):
+    from concurrent.futures import ThreadPoolExecutor
+    from modules import SkipConnectionConvModule, BidirectionalLSTM
+    from activations import ReLU
+
+    N = np.inf if N is None else N
+
+    def flat_grads(module):
+        grads = []
+        for c in module.components:
+            for k in sorted(c.gradients):
+                grads.append(c.gradients[k])
+        return grads
+
+    pool = ThreadPoolExecutor(max_workers=2)
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 10)
+        n_in = np.random.randint(1, 5)
+
+        conv = SkipConnectionConvModule(
+            out_ch1=np.random.randint(1, 5),
+            out_ch2=np.random.randint(1, 5),
+            kernel_shape1=(2, 2),
+            kernel_shape2=(2, 2),
+            kernel_shape_skip=(1, 1),
+            pad1=1,
+            pad2=0,
+            act_fn=ReLU(),
+        )
+        X_conv = random_tensor((n_ex, 6, 6, n_in), standardize=True)
+
+        lstm = BidirectionalLSTM(n_out=np.random.randint(1, 10))
+        X_lstm = random_tensor((n_ex, n_in, np.random.randint(1, 10)), standardize=True)
+
+        for serial, X in [(conv, X_conv), (lstm, X_lstm)]:
+            serial.forward(X)
+            serial.flush_gradients()
+
+            # a copy of an initialized module has the same parameters
+            parallel = deepcopy(serial)
+            assert parallel.enable_parallel_branches(pool) is pool
+
+            Y_serial, Y_parallel = serial.forward(X), parallel.forward(X)
+            assert np.array_equal(Y_serial, Y_parallel)
+
+            dLdY = random_tensor(Y_serial.shape, standardize=True)
+            assert np.array_equal(serial.backward(dLdY), parallel.backward(dLdY))
+            for g1, g2 in zip(flat_grads(serial), flat_grads(parallel)):
+                assert np.array_equal(g1, g2)
+
+            # copies of a parallel module run serially
+            assert deepcopy(parallel)._executor is None
+
+            # a pool created by the module is shut down when it is replaced
+            # or disabled; a shared pool is left running
+            own = parallel.enable_parallel_branches()
+            assert own is not pool
+            parallel.enable_parallel_branches(pool)
+            parallel.disable_parallel_branches()
+            assert parallel._executor is None
+            for executor, running in [(own, False), (pool, True)]:
+                try:
+                    executor.submit(int).result()
+                    assert running
+                except RuntimeError:
+                    assert not running
+
+            own = parallel.enable_parallel_branches()
+            parallel.disable_parallel_branches()
+            try:
+                own.submit(int)
+                assert False, "Expected RuntimeError"
+            except RuntimeError:
+                pass
+
+        print("PASSED")
+        i += 1
+
+    pool.shutdown()
+
+
 def test_SkipConnectionConvModule(N=None):
     from modules import SkipConnectionConvModule
     from activations import Tanh, ReLU, Sigmoid, Affine
@@ -1568,6 +2457,99 @@ def test_SkipConnectionConvModule(N=None):
         i += 1
 
 
+def test_fold_batchnorm(N=None):
+    import tempfile
+    from utils import save_checkpoint, load_checkpoint
+    from layers import FullyConnected, Conv2D, BatchNorm1D, BatchNorm2D
+    from modules import SkipConnectionIdentityModule, SkipConnectionConvModule
+    from activations import Affine, ReLU
+
+    N = np.inf if N is None else N
+
+    def warmup(layers, X_fn, n_iter=3):
+        # run a few training passes so the running statistics are non-trivial
+        for _ in range(n_iter):
+            Y = X_fn()
+            for layer in layers:
+                Y = layer.forward(Y)
+        for layer in layers:
+            layer.freeze()
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 10)
+        n_in = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 10)
+        in_rows = np.random.randint(3, 10)
+        in_cols = np.random.randint(3, 10)
+        f_shape = (np.random.randint(1, 4), np.random.randint(1, 4))
+        act_fn = [Affine(), ReLU()][np.random.randint(0, 2)]
+
+        # FullyConnected -> BatchNorm1D
+        X = random_tensor((n_ex, n_in), standardize=True)
+        FC, BN = FullyConnected(n_out=n_out, act_fn=Affine(slope=2, intercept=1)), BatchNorm1D()
+        warmup([FC, BN], lambda: random_tensor((n_ex, n_in), standardize=True))
+        y_gold = BN.forward(FC.forward(X))
+        assert_almost_equal(FC.fold_batchnorm(BN).forward(X), y_gold)
+
+        # Conv2D -> BatchNorm2D
+        X = random_tensor((n_ex, in_rows, in_cols, n_in), standardize=True)
+        conv = Conv2D(out_ch=n_out, kernel_shape=f_shape, pad="same", act_fn=None)
+        BN = BatchNorm2D()
+        warmup([conv, BN], lambda: random_tensor(X.shape, standardize=True))
+        y_gold = BN.forward(conv.forward(X))
+        assert_almost_equal(conv.fold_batchnorm(BN).forward(X), y_gold)
+
+        # folding through a nonlinearity should fail
+        conv = Conv2D(out_ch=n_out, kernel_shape=f_shape, pad="same", act_fn=ReLU())
+        BN = BatchNorm2D()
+        warmup([conv, BN], lambda: random_tensor(X.shape, standardize=True))
+        try:
+            conv.fold_batchnorm(BN)
+            raise AssertionError("Expected ValueError")
+        except ValueError:
+            pass
+
+        # residual modules
+        def make_modules():
+            M1 = SkipConnectionIdentityModule(
+                out_ch=n_out, kernel_shape1=f_shape, kernel_shape2=f_shape, act_fn=act_fn
+            )
+            M2 = SkipConnectionConvModule(
+                out_ch1=n_out,
+                out_ch2=n_out,
+                kernel_shape1=f_shape,
+                kernel_shape2=f_shape,
+                kernel_shape_skip=(1, 1),
+                pad1=(f_shape[0] // 2, f_shape[1] // 2),
+                pad2=(f_shape[0] // 2, f_shape[1] // 2),
+                act_fn=act_fn,
+            )
+            return [M1, M2]
+
+        for M, M_fresh in zip(make_modules(), make_modules()):
+            warmup([M], lambda: random_tensor(X.shape, standardize=True))
+            y_gold = M.forward(X)
+            M.fold_batchnorm()
+            assert_almost_equal(M.forward(X), y_gold)
+
+            n_folded = 2 if isinstance(M, SkipConnectionConvModule) else 1
+            n_folded += isinstance(act_fn, Affine)
+            assert len(M._folded) == n_folded
+
+            # the folded state survives a checkpoint round trip into a freshly
+            # built module
+            warmup([M_fresh], lambda: random_tensor(X.shape, standardize=True), 1)
+            with tempfile.TemporaryDirectory() as path:
+                save_checkpoint(M, path)
+                load_checkpoint(M_fresh, path, mmap_mode=None)
+            assert sorted(M_fresh._folded) == sorted(M._folded)
+            assert_almost_equal(M_fresh.forward(X), y_gold)
+
+        print("PASSED")
+        i += 1
+
+
 def test_BidirectionalLSTM(N=None):
     from modules import BidirectionalLSTM
 
@@ -1877,11 +2859,921 @@ def test_conv(N=None):
         i += 1
 
 
+def test_plan_pad(N=None):
+    from utils import plan_pad1D, plan_pad2D, plan_conv2D, calc_conv_out_dims, conv1D
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 5)
+        in_rows = np.random.randint(5, 12)
+        in_cols = np.random.randint(5, 12)
+        in_ch = np.random.randint(1, 4)
+        out_ch = np.random.randint(1, 4)
+        fr, fc = [int(k) for k in np.random.randint(1, 5, size=2)]
+        s = np.random.randint(1, 3)
+        d = np.random.randint(0, 2)
+
+        pads = [
+            np.random.randint(0, 3),
+            tuple(np.random.randint(0, 3, size=2)),
+            tuple(np.random.randint(0, 3, size=4)),
+            "same",
+        ]
+        p = pads[np.random.randint(len(pads))]
+
+        # 2D: the planner agrees with the padding utility and the convolution
+        X = np.random.rand(n_ex, in_rows, in_cols, in_ch)
+        W = np.random.rand(fr, fc, in_ch, out_ch)
+
+        X_pad, gold_p = pad2D(X, p, (fr, fc), s, d)
+        assert plan_pad2D(X.shape, p, (fr, fc), s, d) == gold_p
+
+        try:
+            Z = conv2D(X, W, s, p, d)
+        except ValueError:
+            continue
+
+        p2, out_rows, out_cols = plan_conv2D(X.shape, W.shape, s, p, d)
+        assert p2 == gold_p
+        assert Z.shape == (n_ex, out_rows, out_cols, out_ch)
+        assert calc_conv_out_dims(X.shape, W.shape, s, p, d) == Z.shape
+
+        # 1D, including causal padding
+        p1 = [np.random.randint(0, 3), tuple(np.random.randint(0, 3, size=2)), "same", "causal"]
+        p1 = p1[np.random.randint(len(p1))]
+        s1 = 1 if p1 == "causal" else s
+
+        X1 = np.random.rand(n_ex, in_rows, in_ch)
+        W1 = np.random.rand(fc, in_ch, out_ch)
+        _, gold_p1 = pad1D(X1, p1, fc, s1, d)
+        assert plan_pad1D(X1.shape, p1, fc, s1, d) == gold_p1
+
+        try:
+            Z1 = conv1D(X1, W1, s1, p1, d)
+        except ValueError:
+            continue
+        assert calc_conv_out_dims(X1.shape, W1.shape, s1, p1, d) == Z1.shape
+
+        print("PASSED")
+        i += 1
+
+
+def test_im2col_1D(N=None):
+    from utils import im2col_1D, col2im_1D, conv1D
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 5)
+        l_in = np.random.randint(2, 20)
+        in_ch = np.random.randint(1, 5)
+        out_ch = np.random.randint(1, 5)
+        fw = int(np.random.randint(1, 5))
+        d = np.random.randint(0, 3)
+
+        pads = [np.random.randint(0, 4), tuple(np.random.randint(0, 4, size=2)), "same", "causal"]
+        p = pads[np.random.randint(len(pads))]
+        s = 1 if p == "causal" else np.random.randint(1, 3)
+
+        X = np.random.randn(n_ex, l_in, in_ch)
+        W = np.random.randn(fw, in_ch, out_ch)
+
+        try:
+            X_col, p1 = im2col_1D(X, W.shape, p, s, d)
+        except ValueError:
+            continue
+
+        # the convolution matches a direct loop over the output frames
+        X_pad, _ = pad1D(X, p1)
+        _fw = fw * (d + 1) - d
+        gold = np.zeros((n_ex, X_col.shape[1], out_ch))
+        for t in range(X_col.shape[1]):
+            window = X_pad[:, t * s : t * s + _fw : d + 1]
+            gold[:, t] = np.einsum("nkc,kco->no", window, W)
+        assert_almost_equal(conv1D(X, W, s, p, d), gold)
+
+        # col2im_1D is the adjoint of im2col_1D: <im2col(X), C> = <X, col2im(C)>
+        C = np.random.randn(*X_col.shape)
+        assert_almost_equal(
+            np.sum(X_col * C), np.sum(X * col2im_1D(C, X.shape, W.shape, p1, s, d))
+        )
+
+        print("PASSED")
+        i += 1
+
+
+def test_MemoryPlanner(N=None):
+    from utils import MemoryPlanner
+    from layers import FullyConnected, BatchNorm1D
+    from activations import Tanh, ReLU, Sigmoid
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 50)
+        n_layers = np.random.randint(1, 6)
+        dims = np.random.randint(1, 50, size=n_layers + 1)
+        acts = [Tanh(), ReLU(), Sigmoid()]
+
+        X = random_tensor((n_ex, dims[0]), standardize=True)
+        L1 = [
+            FullyConnected(n_out=d, act_fn=acts[np.random.randint(0, 3)])
+            for d in dims[1:]
+        ]
+
+        # plain forward / backward pass
+        y_gold = X
+        for layer in L1:
+            y_gold = layer.forward(y_gold)
+        L2 = deepcopy(L1)
+
+        dLdy = np.ones_like(y_gold)
+        dX_gold = dLdy
+        for layer in reversed(L1):
+            dX_gold = layer.backward(dX_gold)
+
+        # planned forward / backward pass. the first pass records the tensor
+        # shapes, later passes write directly into the planned buffers
+        MP = MemoryPlanner(L2, mode="train")
+        for _ in range(3):
+            y_pred = MP.forward(X).copy()
+            dX = MP.backward(dLdy)
+            if _ == 1:
+                buffers = list(MP._buffers)
+
+        # once planned, no new buffers are allocated
+        assert all(b1 is b2 for b1, b2 in zip(buffers, MP._buffers))
+        assert len(buffers) == len(MP._buffers)
+
+        report = MP.report()
+        assert report["naive_peak_bytes"] <= report["total_bytes"]
+        assert report["planned_peak_bytes"] <= report["total_bytes"]
+        assert_almost_equal(y_pred, y_gold)
+        assert_almost_equal(dX, dX_gold)
+        for l1, l2 in zip(L1, L2):
+            assert_almost_equal(l1.gradients["W"], l2.gradients["W"])
+            assert_almost_equal(l1.gradients["b"], l2.gradients["b"])
+
+        # activations are applied in place in the planned buffers
+        for ix, l2 in enumerate(L2):
+            if isinstance(l2.act_fn, (Tanh, Sigmoid)):
+                b = MP._buffers[report["assignments"]["Y[{}]".format(ix + 1)]]
+                assert np.shares_memory(l2.derived_variables["act_cache"], b)
+
+        # in inference mode two alternating buffers suffice
+        MP = MemoryPlanner(L2, mode="inference")
+        for _ in range(2):
+            assert_almost_equal(MP.forward(X), y_gold)
+        assert MP.report()["n_buffers"] <= 2
+
+        # layers without `out` support are left out of the plan
+        L3 = [FullyConnected(n_out=dims[1]), BatchNorm1D(), FullyConnected(n_out=dims[-1])]
+        y_gold = X
+        for layer in L3:
+            y_gold = layer.forward(y_gold)
+        L4 = deepcopy(L3)
+
+        dX_gold = np.ones_like(y_gold)
+        for layer in reversed(L3):
+            dX_gold = layer.backward(dX_gold)
+
+        MP = MemoryPlanner(L4, mode="train")
+        for _ in range(2):
+            y_pred = MP.forward(X).copy()
+            dX = MP.backward(np.ones_like(y_gold))
+        assert_almost_equal(y_pred, y_gold)
+        assert_almost_equal(dX, dX_gold)
+
+        report = MP.report()
+        assert report["unplanned"] == ["Y[2]", "dX[2]"]
+        assert sorted(report["assignments"]) == ["Y[1]", "Y[3]", "dX[1]", "dX[3]"]
+        assert report["savings"] >= 0
+
+        print("PASSED")
+        i += 1
+
+
+def test_Profiler(N=None):
+    from utils import Profiler
+    from layers import FullyConnected
+    from modules import WavenetResidualModule
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 50)
+        n_in = np.random.randint(1, 50)
+        n_out = np.random.randint(1, 50)
+        n_calls = np.random.randint(1, 5)
+        X = random_tensor((n_ex, n_in), standardize=True)
+
+        L1 = FullyConnected(n_out=n_out, act_fn="ReLU")
+        L1.forward(X)
+        L2 = deepcopy(L1)
+        P = L2.enable_profiling(Profiler(track_memory=True), name="fc")
+
+        for _ in range(n_calls):
+            y_gold, y_pred = L1.forward(X), L2.forward(X)
+            dX_gold = L1.backward(np.ones_like(y_gold))
+            dX_pred = L2.backward(np.ones_like(y_pred))
+            assert_almost_equal(y_pred, y_gold)
+            assert_almost_equal(dX_pred, dX_gold)
+
+        report = P.report()
+        assert report["fc"]["forward"]["calls"] == n_calls
+        assert report["fc"]["backward"]["calls"] == n_calls
+        assert report["fc"]["forward"]["flops"] >= 2 * n_calls * n_ex * n_in * n_out
+        assert len(P.to_chrome_trace()["traceEvents"]) == 2 * n_calls
+
+        # copies of a profiled layer are independent and not profiled
+        L3 = deepcopy(L2)
+        assert L3._profiler is None and "forward" not in L3.__dict__
+        assert_almost_equal(L3.forward(X), y_gold)
+        assert len(P.events) == 2 * n_calls
+
+        # detaching should restore the original (uninstrumented) methods
+        L2.disable_profiling()
+        assert "forward" not in L2.__dict__
+        L2.forward(X)
+        assert len(P.events) == 2 * n_calls
+
+        # copies of a profiled module, including its components
+        M1 = WavenetResidualModule(
+            ch_residual=n_out, ch_dilation=n_out, dilation=1, kernel_width=2
+        )
+        X_main = random_tensor((n_ex, 4, n_out), standardize=True)
+        M1.enable_profiling(P, name="wavenet")
+        M1.forward(X_main, X_main)
+        n_events = len(P.events)
+        M2 = deepcopy(M1)
+        main_gold, skip_gold = M1.forward(X_main, X_main)
+        main, skip = M2.forward(X_main, X_main)
+        assert_almost_equal(main, main_gold)
+        assert_almost_equal(skip, skip_gold)
+        assert len(P.events) > n_events
+        n_events = len(P.events)
+        M2.forward(X_main, X_main)
+        assert len(P.events) == n_events
+        M1.disable_profiling()
+
+        print("PASSED")
+        i += 1
+
+
+def test_checkpoint(N=None):
+    import tempfile
+    from utils import save_checkpoint, load_checkpoint
+    from layers import FullyConnected, BatchNorm1D
+    from modules import WavenetResidualModule
+    from optimizers import RMSProp
+
+    N = np.inf if N is None else N
+
+    def make_model(n_out, ch):
+        return {
+            "fc1": FullyConnected(n_out=n_out, act_fn="ReLU", optimizer=RMSProp()),
+            "bn": BatchNorm1D(),
+            "fc2": FullyConnected(n_out=n_out, act_fn="Tanh"),
+            "wavenet": WavenetResidualModule(
+                ch_residual=ch, ch_dilation=ch, dilation=1, kernel_width=2
+            ),
+        }
+
+    def run(model, X, X_main, X_skip):
+        y = model["fc2"].forward(model["bn"].forward(model["fc1"].forward(X)))
+        main, skip = model["wavenet"].forward(X_main, X_skip)
+        return y, main, skip
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 20)
+        n_in = np.random.randint(1, 20)
+        n_out = np.random.randint(1, 20)
+        ch = np.random.randint(1, 8)
+        l_in = np.random.randint(2, 20)
+
+        X = random_tensor((n_ex, n_in), standardize=True)
+        X_main = random_tensor((n_ex, l_in, ch), standardize=True)
+        X_skip = random_tensor((n_ex, l_in, ch), standardize=True)
+
+        # take a training step so the optimizer caches are populated
+        M1 = make_model(n_out, ch)
+        y, main, skip = run(M1, X, X_main, X_skip)
+        M1["fc1"].backward(M1["bn"].backward(M1["fc2"].backward(np.ones_like(y))))
+        M1["wavenet"].backward(np.ones_like(skip), np.ones_like(main))
+        for layer in M1.values():
+            layer.update()
+
+        with tempfile.TemporaryDirectory() as path:
+            save_checkpoint(M1, path)
+
+            for mmap_mode in [None, "r"]:
+                M2 = load_checkpoint(make_model(n_out, ch), path, mmap_mode)
+
+                W = M2["fc1"].parameters["W"]
+                assert isinstance(W.base, np.memmap) == (mmap_mode is not None)
+
+                C1, C2 = M1["fc1"].optimizer.cache, M2["fc1"].optimizer.cache
+                assert set(C1.keys()) == set(C2.keys())
+                for k in C1:
+                    assert_almost_equal(C1[k], C2[k])
+
+                for gold, pred in zip(run(M1, X, X_main, X_skip), run(M2, X, X_main, X_skip)):
+                    assert_almost_equal(gold, pred)
+                del M2, W
+
+        print("PASSED")
+        i += 1
+
+
+def test_clip_grad_norm(N=None):
+    from utils import clip_grad_norm, global_grad_norm
+    from layers import FullyConnected, Embedding
+    from optimizers import SGD
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 20)
+        n_in = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 20)
+        vocab_size = np.random.randint(2, 50)
+        lr = np.random.uniform(0.001, 0.1)
+
+        emb = Embedding(n_out=n_in, vocab_size=vocab_size, pool="sum", optimizer=SGD(lr=lr))
+        fc1 = FullyConnected(n_out=n_out, act_fn="Tanh", optimizer=SGD(lr=lr))
+        fc2 = FullyConnected(n_out=n_out, act_fn="Affine(slope=1, intercept=0)")
+        model = [emb, fc1, fc2]
+
+        X = np.random.randint(0, vocab_size, size=(n_ex, 3))
+        y = fc2.forward(fc1.forward(emb.forward(X)))
+        emb.backward(fc1.backward(fc2.backward(random_tensor(y.shape, standardize=True))))
+
+        # the frozen layer does not contribute to the global norm
+        fc2.freeze()
+
+        ix, dW_rows = emb.gradients["W"]
+        dW_emb = np.zeros_like(emb.parameters["W"])
+        dW_emb[ix] = dW_rows
+        grads = [dW_emb, fc1.gradients["W"], fc1.gradients["b"]]
+
+        tgrads = [torch.tensor(g, requires_grad=False) for g in grads]
+        tparams = [torch.zeros_like(g, requires_grad=True) for g in tgrads]
+        for p, g in zip(tparams, tgrads):
+            p.grad = g.clone()
+
+        gold_norm = np.sqrt(sum(np.sum(g ** 2) for g in grads))
+        assert_almost_equal(global_grad_norm(model), gold_norm)
+
+        max_norm = np.random.uniform(0.1, 2) * gold_norm
+        scale, norm = clip_grad_norm(model, max_norm)
+        assert_almost_equal(norm, gold_norm)
+        torch.nn.utils.clip_grad_norm_(tparams, max_norm)
+
+        # each update applies the global scale rather than per-tensor clipping
+        params = [emb.parameters["W"].copy(), fc1.parameters["W"].copy(), fc1.parameters["b"].copy()]
+        emb.update(grad_scale=scale)
+        fc1.update(grad_scale=scale)
+        updated = [emb.parameters["W"], fc1.parameters["W"], fc1.parameters["b"]]
+        for p0, p1, tp in zip(params, updated, tparams):
+            assert_almost_equal(p1, p0 - lr * tp.grad.numpy())
+
+        print("PASSED")
+        i += 1
+
+
+def test_quantization(N=None):
+    from utils import quantize_model, quantize, QuantizedLayer
+    from layers import FullyConnected, Conv2D, Flatten
+    from activations import ReLU, Tanh
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(5, 20)
+        in_rows = np.random.randint(4, 8)
+        in_cols = np.random.randint(4, 8)
+        in_ch = np.random.randint(1, 4)
+        out_ch = np.random.randint(1, 5)
+        n_classes = np.random.randint(2, 10)
+        act_bits = np.random.choice([8, 16])
+
+        conv = Conv2D(out_ch, (3, 3), pad="same", stride=1, act_fn=ReLU())
+        fc = FullyConnected(n_out=n_classes, act_fn=Tanh())
+        model = [conv, Flatten(), fc]
+
+        X = random_tensor((n_ex, in_rows, in_cols, in_ch), standardize=True)
+        y = np.random.randint(0, n_classes, n_ex)
+
+        X_train = random_tensor((n_ex, in_rows, in_cols, in_ch), standardize=True)
+        fc.forward(model[1].forward(conv.forward(X_train)))
+        fc_X = fc.X
+
+        qmodel, report = quantize_model(model, X, act_bits=act_bits, y_calib=y)
+
+        # calibration does not overwrite the cached training inputs
+        assert conv.X is X_train
+        assert fc.X is fc_X
+
+        # non-quantizable layers are shared with the float model
+        assert qmodel[1] is model[1]
+
+        # the integer forward pass matches a float computation on the
+        # fake-quantized inputs and weights
+        for ql, fl, X_in in [
+            (qmodel[0], conv, X),
+            (qmodel[2], fc, model[1].forward(conv.forward(X))),
+        ]:
+            W_q, W_scale = ql.parameters["W"], ql.parameters["W_scale"]
+            assert W_q.dtype == np.int8
+            X_fq = quantize(X_in, ql.act_scale, act_bits) * ql.act_scale
+            W_fq = W_q * W_scale
+
+            if isinstance(fl, Conv2D):
+                Z = conv2D(X_fq, W_fq, 1, "same")
+            else:
+                Z = np.dot(X_fq, W_fq)
+            gold = fl.act_fn.fn(Z + fl.parameters["b"])
+            assert_almost_equal(ql.forward(X_in), gold)
+
+        assert report["rel_error"] < 0.05
+        assert 0 <= report["top1_agreement"] <= 1
+        assert_almost_equal(
+            report["accuracy_drift"],
+            report["float_accuracy"] - report["quantized_accuracy"],
+        )
+
+        # unsupported layer types are rejected
+        try:
+            QuantizedLayer(model[1], X)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        print("PASSED")
+        i += 1
+
+
+def test_pruning(N=None):
+    import tempfile
+    from utils import iterative_prune, sparsify_model, sparsity_schedule, estimate_flops
+    from utils import SparseFullyConnected, save_checkpoint, load_checkpoint
+    from initializers import OptimizerInitializer
+    from layers import FullyConnected, Flatten
+    from activations import ReLU, Sigmoid
+    from optimizers import Adam
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 20)
+        n_in = np.random.randint(5, 50)
+        n_hid = np.random.randint(5, 50)
+        n_out = np.random.randint(1, 10)
+        n_steps = np.random.randint(1, 5)
+        sparsity = np.random.uniform(0.5, 0.95)
+
+        fc1 = FullyConnected(n_out=n_hid, act_fn=ReLU(), optimizer=Adam(lr=0.01))
+        fc2 = FullyConnected(n_out=n_out, act_fn=Sigmoid(), optimizer=Adam(lr=0.01))
+        model = [fc1, fc2]
+
+        X = random_tensor((n_ex, n_in), standardize=True)
+        fc2.forward(fc1.forward(X))
+
+        def fine_tune(step, s):
+            # pruned weights stay at zero through the optimizer updates
+            W_prev = [l.parameters["W"].copy() for l in model]
+            dLdY = random_tensor((n_ex, n_out), standardize=True)
+            fc1.backward(fc2.backward(dLdY))
+            fc1.update()
+            fc2.update()
+
+            for l, W in zip(model, W_prev):
+                W_new = l.parameters["W"]
+                np.testing.assert_array_equal(W_new[W == 0], 0)
+
+            fc2.forward(fc1.forward(X))
+
+        schedule = sparsity_schedule(sparsity, n_steps)
+        assert np.all(np.diff(schedule) >= 0)
+        assert_almost_equal(schedule[-1], sparsity)
+
+        masks = iterative_prune(model, sparsity, n_steps, fine_tune=fine_tune)
+        for l, mask in zip(model, masks.values()):
+            W = l.parameters["W"]
+            n_pruned = int(round(sparsity * W.size))
+            assert np.sum(~mask) == n_pruned
+            np.testing.assert_array_equal(W[~mask], 0)
+
+        # CSR inference matches the dense layers, with cost proportional to
+        # the number of nonzero weights
+        sparse_model = sparsify_model(model)
+        Y = fc2.forward(fc1.forward(X))
+        Y_sparse = sparse_model[1].forward(sparse_model[0].forward(X))
+        assert_almost_equal(Y_sparse, Y)
+
+        for l, sl in zip(model, sparse_model):
+            nnz = np.count_nonzero(l.parameters["W"])
+            assert sl.nnz == nnz
+            X_in = random_tensor((n_ex, l.n_in))
+            Y_in = sl.forward(X_in)
+            dense_flops = estimate_flops(l, "forward", (X_in,), Y_in)
+            sparse_flops = estimate_flops(sl, "forward", (X_in,), Y_in)
+            assert sparse_flops == dense_flops - 2 * n_ex * (l.n_in * l.n_out - nnz)
+
+        # the masks survive rebuilding the optimizer from the layer summary
+        # and a checkpoint round trip
+        opt = OptimizerInitializer(fc1.hyperparameters["optimizer"])()
+        np.testing.assert_array_equal(opt.masks["W"], masks["0"])
+
+        with tempfile.TemporaryDirectory() as path:
+            save_checkpoint(model, path)
+            fresh = [FullyConnected(n_out=n_hid, optimizer=Adam()), FullyConnected(n_out=n_out, optimizer=Adam())]
+            load_checkpoint(fresh, path, mmap_mode=None)
+            for l, mask in zip(fresh, masks.values()):
+                np.testing.assert_array_equal(l.optimizer.masks["W"], mask)
+
+        # unsupported layer types are rejected
+        try:
+            SparseFullyConnected(Flatten())
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        print("PASSED")
+        i += 1
+
+
+def test_BatchingServer(N=None):
+    from threading import Thread
+    from utils import BatchingServer
+    from layers import FullyConnected
+    from activations import ReLU
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 50)
+        n_in = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 10)
+        max_batch_size = np.random.randint(1, 10)
+
+        fc1 = FullyConnected(n_out=n_out, act_fn=ReLU())
+        fc2 = FullyConnected(n_out=n_out)
+        X = random_tensor((n_ex, n_in), standardize=True)
+        Y = fc2.forward(fc1.forward(X))
+        fc1.X = fc2.X = None
+
+        # requests queued before the server starts are served in full batches
+        server = BatchingServer([fc1, fc2], max_batch_size=max_batch_size)
+        futures = [server.submit(x) for x in X]
+        assert server.stats()["queue_depth"] == n_ex
+
+        with server.start():
+            for x, y, f in zip(X, Y, futures):
+                assert_almost_equal(f.result(), y)
+
+            stats = server.stats()
+            assert stats["n_served"] == stats["n_requests"] == n_ex
+            assert stats["n_batches"] == int(np.ceil(n_ex / max_batch_size))
+            assert stats["max_queue_depth"] == n_ex
+            assert stats["queue_depth"] == 0
+
+            # inference does not cache anything for the backward pass
+            assert fc1.X is None and fc2.X is None
+
+            # concurrent single-example requests
+            server.reset_stats()
+            Y_pred = [None] * n_ex
+
+            def client(ix):
+                Y_pred[ix] = server.predict(X[ix], timeout=10)
+
+            clients = [Thread(target=client, args=(ix,)) for ix in range(n_ex)]
+            for c in clients:
+                c.start()
+            for c in clients:
+                c.join()
+
+            assert_almost_equal(np.stack(Y_pred), Y)
+            stats = server.stats()
+            assert stats["n_served"] == n_ex
+            assert stats["max_batch_size"] <= max_batch_size
+
+        try:
+            server.submit(X[0])
+            assert False, "Submitting to a stopped server should raise"
+        except RuntimeError:
+            pass
+
+        # requests racing with `stop` are either served or rejected, but
+        # never left pending
+        server = BatchingServer([fc1, fc2], max_batch_size=max_batch_size).start()
+        racing = []
+
+        def submitter():
+            for x in X:
+                try:
+                    racing.append(server.submit(x))
+                except RuntimeError:
+                    break
+
+        clients = [Thread(target=submitter) for _ in range(4)]
+        for c in clients:
+            c.start()
+        server.stop()
+        for c in clients:
+            c.join()
+        for f in racing:
+            assert f.done()
+
+        # stopping a server which was never started fails its requests
+        server = BatchingServer([fc1, fc2])
+        f = server.submit(X[0])
+        server.stop()
+        try:
+            f.result(timeout=1)
+            assert False, "Expected RuntimeError"
+        except RuntimeError:
+            pass
+
+        print("PASSED")
+        i += 1
+
+
+#######################################################################
+#                             Optimizers                              #
+#######################################################################
+
+
+def _check_optimizer_round_trip(opt, param, grads):
+    from initializers import OptimizerInitializer
+
+    # an optimizer rebuilt from its string representation or from its
+    # hyperparameters + cache continues the same trajectory
+    from_str = OptimizerInitializer(str(opt))()
+    assert str(from_str) == str(opt)
+
+    summary = {"hyperparameters": opt.hyperparameters, "cache": deepcopy(opt.cache)}
+    from_dict = OptimizerInitializer(summary)()
+    assert from_dict.hyperparameters == opt.hyperparameters
+
+    p1, p2 = param.copy(), param.copy()
+    for g in grads:
+        p1 = opt(p1, g, "W")
+        p2 = from_dict(p2, g, "W")
+    assert_almost_equal(p1, p2)
+
+
+def test_LARS(N=None):
+    from optimizers import LARS
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        shape = (np.random.randint(1, 20), np.random.randint(1, 20))
+        lr = np.random.uniform(0.01, 1)
+        momentum = np.random.uniform(0, 0.99)
+        eta = np.random.uniform(0.0001, 0.01)
+        wd = np.random.choice([0, np.random.uniform(0, 0.01)])
+
+        opt = LARS(lr=lr, momentum=momentum, eta=eta, weight_decay=wd)
+
+        W = np.random.randn(*shape)
+        grads = [np.random.randn(*shape) * 10 ** np.random.uniform(-3, 3) for _ in range(5)]
+
+        W_mine, W_gold, v = W.copy(), W.copy(), np.zeros(shape)
+        for g in grads:
+            w_norm, g_norm = np.linalg.norm(W_gold), np.linalg.norm(g)
+            trust = eta * w_norm / (g_norm + wd * w_norm + opt.hyperparameters["eps"])
+            v = momentum * v + lr * trust * (g + wd * W_gold)
+            W_gold = W_gold - v
+            W_mine = opt(W_mine, g, "W")
+            assert_almost_equal(W_mine, W_gold)
+
+        # the update norm is independent of the gradient scale
+        opt1, opt2 = LARS(lr=lr, momentum=0, eta=eta), LARS(lr=lr, momentum=0, eta=eta)
+        assert_almost_equal(opt1(W, grads[0], "W"), opt2(W, 1000 * grads[0], "W"))
+
+        # zero parameters fall back to a trust ratio of 1
+        W0 = np.zeros(shape)
+        assert_almost_equal(LARS(lr=lr, momentum=0)(W0, grads[0], "W"), -lr * grads[0])
+
+        _check_optimizer_round_trip(opt, W_mine, grads)
+        print("PASSED")
+        i += 1
+
+
+def test_LAMB(N=None):
+    from optimizers import LAMB
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        shape = (np.random.randint(1, 20), np.random.randint(1, 20))
+        lr = np.random.uniform(0.0001, 0.1)
+        d1, d2 = np.random.uniform(0.5, 0.99), np.random.uniform(0.9, 0.999)
+        eps = 1e-6
+        wd = np.random.choice([0, np.random.uniform(0, 0.1)])
+
+        opt = LAMB(lr=lr, decay1=d1, decay2=d2, eps=eps, weight_decay=wd)
+
+        W = np.random.randn(*shape)
+        grads = [np.random.randn(*shape) for _ in range(5)]
+
+        # with lr = 1, a step of torch's AdamW moves the parameters by the
+        # LAMB update direction (the Adam step plus decoupled weight decay)
+        tW = torch.tensor(W, requires_grad=True)
+        adamw = torch.optim.AdamW([tW], lr=1, betas=(d1, d2), eps=eps, weight_decay=wd)
+
+        W_mine = W.copy()
+        for g in grads:
+            W_prev = tW.detach().numpy().copy()
+            assert_almost_equal(W_mine, W_prev)
+
+            tW.grad = torch.tensor(g)
+            adamw.step()
+            r = W_prev - tW.detach().numpy()
+            trust = np.linalg.norm(W_prev) / np.linalg.norm(r)
+
+            W_mine = opt(W_mine, g, "W")
+            assert_almost_equal(W_mine, W_prev - lr * trust * r)
+
+            # rescale the torch parameters to follow the LAMB trajectory
+            with torch.no_grad():
+                tW.copy_(torch.tensor(W_mine))
+
+        _check_optimizer_round_trip(opt, W_mine, grads)
+        print("PASSED")
+        i += 1
+
+
+def test_KFAC(N=None):
+    from optimizers import KFAC
+    from layers import FullyConnected, Conv2D
+    from activations import Tanh
+
+    class RecordingKFAC(KFAC):
+        def update_factors(self, a, g):
+            self.factors = (a, g)
+            super().update_factors(a, g)
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(2, 10)
+        n_in = np.random.randint(1, 10)
+        n_out = np.random.randint(1, 10)
+        in_rows, in_cols = np.random.randint(3, 7, size=2)
+        fr, fc = np.random.randint(1, 4, size=2)
+        lr = np.random.uniform(0.001, 0.1)
+        damping = np.random.uniform(1e-4, 1e-1)
+        decay = np.random.uniform(0.5, 0.99)
+        kl_clip = [None, 1e-4][np.random.randint(2)]
+        lam = np.sqrt(damping)
+
+        n_groups = np.random.randint(2, 4)
+
+        fc_layer = FullyConnected(n_out, act_fn=Tanh())
+        conv = Conv2D(n_out, (fr, fc), pad="same", act_fn=Tanh())
+        grouped = Conv2D(n_out * n_groups, (fr, fc), pad="same", groups=n_groups, act_fn=Tanh())
+        X_fc = random_tensor((n_ex, n_in), standardize=True)
+        X_conv = random_tensor((n_ex, in_rows, in_cols, n_in), standardize=True)
+        X_grouped = random_tensor((n_ex, in_rows, in_cols, n_in * n_groups), standardize=True)
+
+        def T(x):
+            return np.swapaxes(x, -1, -2)
+
+        for layer, X in [(fc_layer, X_fc), (conv, X_conv), (grouped, X_grouped)]:
+            opt = RecordingKFAC(
+                lr=lr, momentum=0, damping=damping, decay=decay, inv_every=2, kl_clip=kl_clip
+            )
+            layer.optimizer = opt
+
+            A = G = None
+            for step in range(4):
+                Y = layer.forward(X)
+                layer.backward(random_tensor(Y.shape, standardize=True))
+
+                # the factors are built from inputs / pre-activation gradients
+                # ordered consistently with the weight gradient, with one set
+                # of factors per group for grouped layers
+                a, g = opt.factors
+                if a.ndim == 2:
+                    a, g = a[None], g[None]
+
+                n_g, out_g = g.shape[0], g.shape[2]
+                assert n_g == getattr(layer, "groups", 1)
+
+                dW, dB = layer.gradients["W"], layer.gradients["b"]
+                dW_g = dW.reshape(-1, n_g, out_g).transpose(1, 0, 2)
+                dB_g = dB.reshape(-1, n_g, out_g).transpose(1, 0, 2)
+                assert_almost_equal(T(a) @ g, dW_g)
+
+                A_t, G_t = T(a) @ a / a.shape[1], T(g) @ g
+                A = A_t if A is None else decay * A + (1 - decay) * A_t
+                G = G_t if G is None else decay * G + (1 - decay) * G_t
+
+                # the factor inverses are refreshed every other update
+                if step % 2 == 0:
+                    A_inv = np.linalg.inv(A + lam * np.eye(A.shape[-1]))
+                    G_inv = np.linalg.inv(G + lam * np.eye(G.shape[-1]))
+
+                W0, b0 = layer.parameters["W"].copy(), layer.parameters["b"].copy()
+                layer.update()
+
+                dW_pre = (A_inv @ dW_g @ G_inv).transpose(1, 0, 2).reshape(W0.shape)
+                dB_pre = (dB_g @ G_inv).transpose(1, 0, 2).reshape(b0.shape)
+                if kl_clip is not None:
+                    dW_pre *= min(1, np.sqrt(kl_clip / (lr ** 2 * np.sum(dW_pre * dW))))
+                    dB_pre *= min(1, np.sqrt(kl_clip / (lr ** 2 * np.sum(dB_pre * dB))))
+                assert_almost_equal(layer.parameters["W"], W0 - lr * dW_pre)
+                assert_almost_equal(layer.parameters["b"], b0 - lr * dB_pre)
+
+        opt = KFAC(lr=lr, damping=damping, decay=decay)
+        W = np.random.randn(n_in, n_out)
+        _check_optimizer_round_trip(opt, W, [np.random.randn(n_in, n_out) for _ in range(3)])
+
+        print("PASSED")
+        i += 1
+
+
 #######################################################################
 #                               Models                                #
 #######################################################################
 
 
+def test_VAE_inference(N=None):
+    from models.vae import BernoulliVAE
+
+    N = np.inf if N is None else N
+
+    i = 1
+    while i < N + 1:
+        n_ex = np.random.randint(1, 20)
+        in_rows, in_cols = np.random.randint(8, 12, size=2)
+        T = np.random.randint(1, 5)
+
+        V = BernoulliVAE(
+            T=T,
+            latent_dim=np.random.randint(2, 10),
+            enc_conv1_out_ch=2,
+            enc_conv2_out_ch=3,
+            enc_conv1_kernel_shape=(3, 3),
+            enc_conv2_kernel_shape=(3, 3),
+        )
+        X = np.random.rand(n_ex, in_rows, in_cols, 1)
+
+        # inference requires a fitted model
+        try:
+            V.encode(X)
+            assert False, "Expected ValueError"
+        except ValueError:
+            pass
+
+        # initialize the model with a training forward pass
+        V.N = in_rows * in_cols
+        V.forward(X)
+        t_mean = V.derived_variables["t_mean"]
+        t_log_var = V.derived_variables["t_log_var"]
+        cached_X = [l.X for l in V.encoder.values() if hasattr(l, "X")]
+
+        chunksize = np.random.randint(1, n_ex + 1)
+        n_workers = np.random.randint(1, 4)
+        mean, log_var = V.encode(X, chunksize=chunksize, n_workers=n_workers)
+        assert_almost_equal(mean, t_mean)
+        assert_almost_equal(log_var, t_log_var)
+
+        # inference does not overwrite the cached training values
+        for layer, X_prev in zip(V.encoder.values(), cached_X):
+            assert layer.X is X_prev
+
+        X_recon = V.decode(mean, chunksize=chunksize, n_workers=n_workers)
+        gold = mean
+        for layer in V.decoder.values():
+            gold = layer.forward(gold)
+        assert_almost_equal(X_recon, gold)
+
+        samples = V.sample(n_ex, chunksize=chunksize, n_workers=n_workers, seed=i)
+        assert samples.shape == (n_ex, in_rows * in_cols)
+        assert np.all((samples >= 0) & (samples <= 1))
+        assert_almost_equal(samples, V.sample(n_ex, seed=i))
+        print("PASSED")
+        i += 1
+
+
 def test_VAE():
     # for testing
     from keras.datasets import mnist
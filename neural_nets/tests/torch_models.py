@@ -1030,6 +1030,7 @@ class TorchConv2DLayer(nn.Module):
             padding=hparams["pad"],
             stride=hparams["stride"],
             dilation=hparams["dilation"] + 1,
+            groups=hparams.get("groups", 1),
             bias=True,
         )
 
@@ -1038,14 +1039,17 @@ class TorchConv2DLayer(nn.Module):
         assert self.layer1.weight.shape == W.shape
         assert self.layer1.bias.shape == b.flatten().shape
 
-        self.layer1.weight = nn.Parameter(torch.FloatTensor(W))
-        self.layer1.bias = nn.Parameter(torch.FloatTensor(b.flatten()))
+        self.layer1.weight = nn.Parameter(torch.DoubleTensor(W))
+        self.layer1.bias = nn.Parameter(torch.DoubleTensor(b.flatten()))
 
     def forward(self, X):
         # (N, H, W, C) -> (N, C, H, W)
         self.X = np.moveaxis(X, [0, 1, 2, 3], [0, -2, -1, -3])
         if not isinstance(self.X, torch.Tensor):
-            self.X = torchify(self.X)
+            # compute the reference in double precision, so that large
+            # gradient sums are not dominated by float32 rounding error
+            self.X = torch.tensor(self.X, dtype=torch.float64, requires_grad=True)
+            self.X = self.X.contiguous()
 
         self.X.retain_grad()
 
@@ -1079,6 +1083,87 @@ class TorchConv2DLayer(nn.Module):
         return grads
 
 
+class TorchDepthwiseSeparableConv2DLayer(nn.Module):
+    def __init__(self, in_channels, out_channels, act_fn, params, hparams, **kwargs):
+        super(TorchDepthwiseSeparableConv2DLayer, self).__init__()
+
+        W_dw = params["W_depthwise"]
+        W_pw = params["W_pointwise"]
+        b = params["b"]
+        self.act_fn = act_fn
+
+        fr, fc, n_in, dm = W_dw.shape
+        self.layer1 = nn.Conv2d(
+            in_channels,
+            in_channels * dm,
+            hparams["kernel_shape"],
+            padding=hparams["pad"],
+            stride=hparams["stride"],
+            dilation=hparams["dilation"] + 1,
+            groups=in_channels,
+            bias=False,
+        )
+        self.layer2 = nn.Conv2d(in_channels * dm, out_channels, 1, bias=True)
+
+        # (f[0], f[1], n_in, dm) -> (n_in * dm, 1, f[0], f[1])
+        W_dw = W_dw.reshape(fr, fc, n_in * dm).transpose(2, 0, 1)[:, None]
+        # (n_in * dm, n_out) -> (n_out, n_in * dm, 1, 1)
+        W_pw = W_pw.T[:, :, None, None]
+        assert self.layer1.weight.shape == W_dw.shape
+        assert self.layer2.weight.shape == W_pw.shape
+        assert self.layer2.bias.shape == b.flatten().shape
+
+        self.layer1.weight = nn.Parameter(torch.DoubleTensor(W_dw))
+        self.layer2.weight = nn.Parameter(torch.DoubleTensor(W_pw))
+        self.layer2.bias = nn.Parameter(torch.DoubleTensor(b.flatten()))
+
+    def forward(self, X):
+        # (N, H, W, C) -> (N, C, H, W)
+        self.X = np.moveaxis(X, [0, 1, 2, 3], [0, -2, -1, -3])
+        if not isinstance(self.X, torch.Tensor):
+            # compute the reference in double precision, so that large
+            # gradient sums are not dominated by float32 rounding error
+            self.X = torch.tensor(self.X, dtype=torch.float64, requires_grad=True)
+            self.X = self.X.contiguous()
+
+        self.X.retain_grad()
+
+        self.Z = self.layer2(self.layer1(self.X))
+        self.Z.retain_grad()
+
+        self.Y = self.act_fn(self.Z)
+        self.Y.retain_grad()
+        return self.Y
+
+    def extract_grads(self, X):
+        self.forward(X)
+        self.loss = self.Y.sum()
+        self.loss.backward()
+
+        W_dw = self.layer1.weight
+        fr, fc = W_dw.shape[2:]
+
+        def dw(W):
+            # (n_in * dm, 1, f[0], f[1]) -> (f[0], f[1], n_in, dm)
+            return W[:, 0].transpose(1, 2, 0).reshape(fr, fc, self.X.shape[1], -1)
+
+        orig, X_swap = [0, 1, 2, 3], [0, -1, -3, -2]
+        grads = {
+            "X": np.moveaxis(self.X.detach().numpy(), orig, X_swap),
+            "W_depthwise": dw(W_dw.detach().numpy()),
+            "W_pointwise": self.layer2.weight.detach().numpy()[:, :, 0, 0].T,
+            "b": self.layer2.bias.detach().numpy().reshape(1, 1, 1, -1),
+            "y": np.moveaxis(self.Y.detach().numpy(), orig, X_swap),
+            "dLdY": np.moveaxis(self.Y.grad.numpy(), orig, X_swap),
+            "dLdZ": np.moveaxis(self.Z.grad.numpy(), orig, X_swap),
+            "dLdW_depthwise": dw(W_dw.grad.numpy()),
+            "dLdW_pointwise": self.layer2.weight.grad.numpy()[:, :, 0, 0].T,
+            "dLdB": self.layer2.bias.grad.numpy().reshape(1, 1, 1, -1),
+            "dLdX": np.moveaxis(self.X.grad.numpy(), orig, X_swap),
+        }
+        return grads
+
+
 class TorchConv1DLayer(nn.Module):
     def __init__(self, in_channels, out_channels, act_fn, params, hparams, **kwargs):
         super(TorchConv1DLayer, self).__init__()
@@ -1 +1,8 @@
 from .utils import *
+from .memory import *
+from .profiling import *
+from .checkpoint import *
+from .clipping import *
+from .quantization import *
+from .pruning import *
+from .serving import *
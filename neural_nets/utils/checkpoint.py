@@ -0,0 +1,294 @@
+import os
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+
+# byte alignment for each array in the data file. aligning to a cache line
+# keeps memory-mapped views suitable for vectorized numpy ops
+ALIGNMENT = 64
+
+MANIFEST_FILE = "manifest.json"
+DATA_FILE = "arrays.bin"
+
+# hyperparameter entries which are saved in their own sections of the
+# manifest, or which cannot be restored by attribute assignment
+_SKIP_HPARAMS = ["layer", "optimizer", "components", "component_ids", "wrappers"]
+
+
+def _jsonable(v):
+    if isinstance(v, dict):
+        return {k: _jsonable(vv) for k, vv in v.items() if not isinstance(vv, np.ndarray)}
+    if isinstance(v, (list, tuple)):
+        return [_jsonable(vv) for vv in v]
+    if isinstance(v, np.generic):
+        return v.item()
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    return str(v)
+
+
+def _from_json(v):
+    # the repo stores shapes, pads, and strides as tuples; JSON round-trips
+    # them as lists
+    if isinstance(v, list):
+        return tuple(_from_json(vv) for vv in v)
+    return v
+
+
+def _encode_state(v, add_array):
+    # optimizer caches may nest dicts of arrays and scalars (e.g., Adam)
+    if isinstance(v, np.ndarray):
+        return {"__array__": add_array(v)}
+    if isinstance(v, dict):
+        return {k: _encode_state(vv, add_array) for k, vv in v.items()}
+    return _jsonable(v)
+
+
+def _decode_state(v, get_array):
+    if isinstance(v, dict) and "__array__" in v:
+        return get_array(v["__array__"])
+    if isinstance(v, dict):
+        return {k: _decode_state(vv, get_array) for k, vv in v.items()}
+    return v
+
+
+def _unwrap(layer):
+    return layer._base_layer if hasattr(layer, "_base_layer") else layer
+
+
+def _normalize(model):
+    if isinstance(model, dict):
+        return OrderedDict(model)
+    if isinstance(model, (list, tuple)):
+        return OrderedDict((str(i), l) for i, l in enumerate(model))
+    return OrderedDict([("model", model)])
+
+
+def _walk(name, layer):
+    """
+    Yield (name, layer) pairs for `layer` and, if it is a module, each of its
+    components (recursively). Component names have the form
+    ``<name>.<component_id>``.
+    """
+    layer = _unwrap(layer)
+    yield name, layer
+
+    try:
+        cids = layer.hyperparameters.get("component_ids", [])
+    except AttributeError:
+        cids = []
+
+    for c in cids:
+        comp = getattr(layer, c, None)
+        if comp is not None:
+            for item in _walk("{}.{}".format(name, c), comp):
+                yield item
+
+
+def _is_module(layer):
+    return "component_ids" in layer.hyperparameters
+
+
+def save_checkpoint(model, path):
+    """
+    Save the parameters, hyperparameters, and optimizer state for a model to
+    a flat binary checkpoint.
+
+    A checkpoint is a directory containing two files:
+
+        manifest.json : The hyperparameters for each layer, along with the
+                        dtype, shape, and byte offset of each saved array
+        arrays.bin    : The raw bytes for every parameter, optimizer cache,
+                        and pruning mask array, each aligned to a 64-byte
+                        boundary
+
+    Since the arrays are stored uncompressed at fixed offsets, they can be
+    memory-mapped directly on load (see `load_checkpoint`).
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model to save. Lists are treated as a sequential stack of layers
+        and dicts as a collection of named layers.
+    path : str
+        The directory to write the checkpoint to. Created if it does not
+        exist.
+
+    Returns
+    -------
+    manifest : dict
+        The checkpoint manifest
+    """
+    os.makedirs(path, exist_ok=True)
+
+    arrays, offset = [], 0
+    manifest = {"version": CHECKPOINT_VERSION, "layers": OrderedDict()}
+
+    def add_array(arr):
+        nonlocal offset
+        arr = np.ascontiguousarray(arr)
+        offset = int(np.ceil(offset / ALIGNMENT) * ALIGNMENT)
+        entry = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        arrays.append((offset, arr))
+        offset += arr.nbytes
+        return entry
+
+    for root, layer in _normalize(model).items():
+        for name, l in _walk(root, layer):
+            H = l.hyperparameters
+            hp = {k: v for k, v in H.items() if k not in _SKIP_HPARAMS}
+            entry = {"layer": H["layer"], "hyperparameters": _jsonable(hp)}
+
+            if not _is_module(l):
+                entry["parameters"] = OrderedDict(
+                    (k, add_array(v))
+                    for k, v in l.parameters.items()
+                    if isinstance(v, np.ndarray)
+                )
+
+            opt = getattr(l, "optimizer", None)
+            if opt is not None:
+                entry["optimizer"] = {
+                    "hyperparameters": _jsonable(opt.hyperparameters),
+                    "cache": _encode_state(opt.cache, add_array),
+                    "masks": _encode_state(opt.masks, add_array),
+                }
+            manifest["layers"][name] = entry
+
+    with open(os.path.join(path, DATA_FILE), "wb") as handle:
+        for start, arr in arrays:
+            handle.write(b"\x00" * (start - handle.tell()))
+            handle.write(arr.tobytes())
+
+    with open(os.path.join(path, MANIFEST_FILE), "w") as handle:
+        json.dump(manifest, handle, indent=2)
+    return manifest
+
+
+def _restore_hyperparameters(layer, hparams):
+    for k, v in hparams.items():
+        if not hasattr(layer, k):
+            continue
+
+        # only restore plain-valued attributes; objects such as activation
+        # functions are fixed by the layer constructor
+        cur = getattr(layer, k)
+        if cur is None or isinstance(cur, (bool, int, float, str, tuple, list)):
+            setattr(layer, k, _from_json(v))
+
+
+def load_checkpoint(model, path, mmap_mode="r"):
+    """
+    Load a checkpoint written by `save_checkpoint` into an existing model.
+
+    The model must have the same architecture as the saved one, although its
+    layers need not have been initialized (ie., run on any data) yet. When
+    `mmap_mode` is not None, parameters are views into a memory-mapped copy
+    of the data file, so loading takes time independent of the model size and
+    separate processes loading the same checkpoint share physical pages.
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model to load parameters into, structured as it was when saved
+    path : str
+        The checkpoint directory
+    mmap_mode : {None, 'r', 'c'} (default: 'r')
+        How to map the checkpoint data. If 'r', parameters are read-only views
+        of the file (training updates still work, since optimizers return new
+        arrays). If 'c', parameters are copy-on-write views. If None, the data
+        is read into memory. Optimizer caches are always copied into memory.
+
+    Returns
+    -------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model with restored parameters, hyperparameters, and optimizer
+        state
+    """
+    if mmap_mode not in [None, "r", "c"]:
+        raise ValueError("Unrecognized mmap_mode: {}".format(mmap_mode))
+
+    with open(os.path.join(path, MANIFEST_FILE), "r") as handle:
+        manifest = json.load(handle)
+
+    if manifest["version"] != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version: {}".format(manifest["version"]))
+
+    fp = os.path.join(path, DATA_FILE)
+    if os.path.getsize(fp) == 0:
+        data = np.zeros(0, dtype=np.uint8)
+    elif mmap_mode is None:
+        data = np.fromfile(fp, dtype=np.uint8)
+    else:
+        data = np.memmap(fp, dtype=np.uint8, mode=mmap_mode)
+
+    def get_array(entry):
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        start = entry["offset"]
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return data[start : start + nbytes].view(dtype).reshape(shape)
+
+    saved = manifest["layers"]
+    for root, layer in _normalize(model).items():
+        folded = []
+        for name, l in _walk(root, layer):
+            if name not in saved:
+                raise ValueError("Layer `{}` not found in checkpoint".format(name))
+
+            entry = saved[name]
+            if entry["layer"] != l.hyperparameters["layer"]:
+                fstr = "Layer `{}` is a {} in the checkpoint but a {} in the model"
+                raise ValueError(fstr.format(name, entry["layer"], l.hyperparameters["layer"]))
+
+            # batchnorm layers folded into the (saved) conv weights must stay
+            # folded, or they would be applied twice
+            if len(entry["hyperparameters"].get("folded", [])) > 0:
+                folded.append((l, entry["hyperparameters"]["folded"]))
+
+            if "parameters" in entry:
+                if not getattr(l, "is_initialized", True):
+                    _restore_hyperparameters(l, entry["hyperparameters"])
+                    l._init_params()
+
+                for k, arr_entry in entry["parameters"].items():
+                    arr = get_array(arr_entry)
+                    if k in l.parameters and l.parameters[k] is not None:
+                        if l.parameters[k].shape != arr.shape:
+                            fstr = "Shape mismatch for `{}.{}`: {} vs. {}"
+                            raise ValueError(
+                                fstr.format(name, k, l.parameters[k].shape, arr.shape)
+                            )
+                    l.parameters[k] = arr
+
+            if "optimizer" in entry and getattr(l, "optimizer", None) is not None:
+                opt, opt_entry = l.optimizer, entry["optimizer"]
+                opt_id = opt_entry["hyperparameters"].get("id")
+                if opt_id != opt.hyperparameters.get("id"):
+                    fstr = "Layer `{}` uses {} in the checkpoint but {} in the model"
+                    raise ValueError(fstr.format(name, opt_id, opt.hyperparameters.get("id")))
+
+                opt.hyperparameters.update(opt_entry["hyperparameters"])
+                # some optimizers update their cache in-place, so always copy
+                # it out of the mapped file
+                opt.cache = _decode_state(opt_entry["cache"], lambda e: np.array(get_array(e)))
+
+                masks = _decode_state(opt_entry.get("masks", {}), get_array)
+                opt.masks = {}
+                for k, mask in masks.items():
+                    opt.set_mask(k, mask)
+
+        # lazily-built module components (e.g., `conv_skip`) cannot be
+        # reconstructed from the manifest alone
+        missing = [n for n in saved if n.startswith(root + ".")]
+        missing = set(missing) - set(n for n, _ in _walk(root, layer))
+        if len(missing) > 0:
+            fstr = "Components {} are missing from the model. Run a forward pass before loading."
+            raise ValueError(fstr.format(sorted(missing)))
+
+        for l, bns in folded:
+            l._restore_folded(bns)
+    return model
@@ -0,0 +1,83 @@
+import numpy as np
+
+from .checkpoint import _normalize, _walk, _is_module
+
+
+def _param_grads(model):
+    """
+    Yield the gradient for each trainable parameter in `model`, in the order
+    the layers would apply their updates. Sparse (row-wise) gradients are
+    yielded as their array of gradient rows.
+    """
+    for root, layer in _normalize(model).items():
+        for name, l in _walk(root, layer):
+            if _is_module(l) or not getattr(l, "trainable", True):
+                continue
+
+            for k, g in l.gradients.items():
+                if k not in l.parameters or g is None:
+                    continue
+                yield g[1] if isinstance(g, tuple) else g
+
+
+def global_grad_norm(model):
+    """
+    Compute the l2 norm of the concatenation of every parameter gradient in
+    `model`.
+
+    The squared norm of each gradient is accumulated with a single dot
+    product over its flattened values, so the computation makes exactly one
+    pass over each gradient and allocates no temporaries.
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model whose gradients to measure
+
+    Returns
+    -------
+    norm : float
+        The global gradient norm
+    """
+    sq_norm = 0.0
+    for g in _param_grads(model):
+        g = g.ravel()
+        sq_norm += float(np.dot(g, g))
+    return np.sqrt(sq_norm)
+
+
+def clip_grad_norm(model, max_norm):
+    """
+    Compute the scale factor that clips the global norm of the gradients in
+    `model` to at most `max_norm`.
+
+    Unlike the per-parameter `clip_norm` option of the optimizers, global
+    clipping scales every gradient by the same amount and so preserves the
+    direction of the full update. The gradients are not modified; instead,
+    the returned scale is passed to each layer's `update` method, which hands
+    it to the optimizer in place of its per-parameter clipping:
+
+        >>> scale, norm = clip_grad_norm(layers, max_norm=5.0)
+        >>> for layer in layers:
+        ...     layer.update(grad_scale=scale)
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model whose gradients to clip
+    max_norm : float
+        The maximum allowed global gradient norm
+
+    Returns
+    -------
+    scale : float
+        The factor to multiply each gradient by. This is 1 if the global norm
+        is already at most `max_norm`.
+    norm : float
+        The global gradient norm before clipping
+    """
+    grad_norm = global_grad_norm(model)
+    scale = 1.0
+    if grad_norm > max_norm:
+        scale = max_norm / grad_norm
+    return scale, grad_norm
@@ -0,0 +1,261 @@
+import inspect
+from functools import partial
+
+import numpy as np
+
+
+def _accepts(fn, arg):
+    try:
+        return arg in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+class MemoryPlanner(object):
+    def __init__(self, layers, mode="train"):
+        """
+        A liveness-based memory planner for a sequential stack of layers /
+        modules.
+
+        By default, every `forward` call allocates a fresh output array and
+        every `backward` call allocates a fresh input gradient, so peak memory
+        is the sum of all activations and gradients in the stack. The planner
+        instead computes the interval over which each tensor is live and
+        assigns tensors with non-overlapping lifetimes to the same buffer from
+        a small, reusable pool.
+
+        Schedule [train]:
+            F[1], ..., F[n], B[n], ..., B[1]
+
+            Y[i]  (output of layer i) is written at F[i] and is read at F[i+1],
+                  at B[i+1] (layer i+1 caches its input for backprop), and at
+                  B[i] (layer i may cache its own output for its activation
+                  gradient)
+            dX[i] (gradient wrt. the input of layer i) is written at B[i] and
+                  is read at B[i-1]
+
+        Schedule [inference]:
+            F[1], ..., F[n]
+
+            Y[i] is written at F[i] and is dead after F[i+1]
+
+        Buffers are assigned greedily in the order tensors are produced,
+        choosing the smallest free buffer that fits (or growing the largest
+        free buffer if none fits).
+
+        Only the methods that accept an `out` argument (e.g., the `forward`
+        and `backward` methods of `FullyConnected`) are planned: they write
+        their result directly into the planned buffer, with the bias and
+        activation applied in place, so the planned pass allocates none of
+        their outputs. Since such a layer writes its output while still
+        reading its inputs, its buffer must be free strictly before the step
+        at which it runs. The results of methods without `out` support (e.g.,
+        those of the convolution, normalization, and pooling layers) are
+        allocated by the layer as usual and left out of the plan, since
+        copying them into the pool would add a copy without saving any
+        memory. They are listed under `unplanned` in `report`.
+
+        The shape of each tensor is recorded the first time the stack is run
+        on a given input shape. That pass allocates as usual and does not use
+        the pool; the plan is built on the following pass and reused by every
+        pass after it.
+
+        NB. The arrays returned by `forward` and `backward` are views into the
+        buffer pool and will be overwritten by subsequent calls. Copy them if
+        they need to persist.
+
+        Parameters
+        ----------
+        layers : list of `LayerBase` or `ModuleBase` instances
+            The layers in the stack, in the order they are applied. Each layer
+            must accept a single input array and return a single output array.
+        mode : str (default: 'train')
+            The execution schedule to plan for. Valid entries are {'train',
+            'inference'}.
+        """
+        if mode not in ["train", "inference"]:
+            raise ValueError("Unrecognized mode: {}".format(mode))
+
+        self.mode = mode
+        self.layers = layers
+
+        self._buffers = []
+        self._free_at = []
+        self._tensors = {}
+        self._unplanned = []
+
+        # the (shape, dtype) and buffer of each tensor, for the current input
+        # shape
+        self._plan_shape = None
+        self._specs = {}
+        self._plan = {}
+
+    @property
+    def hyperparameters(self):
+        return {
+            "mode": self.mode,
+            "layers": [l.hyperparameters["layer"] for l in self.layers],
+        }
+
+    def _lifetime(self, name, i):
+        """
+        Return the (write, last read) steps for either the output of layer `i`
+        (name = "Y") or the gradient wrt. the input of layer `i` (name = "dX").
+        Layers are 1-indexed; F[i] is step i - 1 and B[i] is step 2n - i.
+        """
+        n = len(self.layers)
+        if self.mode == "inference":
+            return i - 1, i
+        if name == "Y":
+            return i - 1, 2 * n - i
+        return 2 * n - i, 2 * n - i + 1 if i > 1 else 2 * n
+
+    def _assign(self, start, nbytes):
+        free = [b for b, t in enumerate(self._free_at) if t < start]
+
+        # best fit: the smallest free buffer large enough to hold the tensor
+        fits = [b for b in free if self._buffers[b].nbytes >= nbytes]
+        if len(fits) > 0:
+            return min(fits, key=lambda b: self._buffers[b].nbytes)
+
+        # otherwise, grow the largest free buffer
+        if len(free) > 0:
+            b = max(free, key=lambda b: self._buffers[b].nbytes)
+            self._buffers[b] = np.empty(nbytes, dtype=np.uint8)
+            return b
+
+        self._buffers.append(np.empty(nbytes, dtype=np.uint8))
+        self._free_at.append(-1)
+        return len(self._buffers) - 1
+
+    def _buffer(self, name, i, shape, dtype):
+        key = "{}[{}]".format(name, i)
+        start, end = self._lifetime(name, i)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+        # each tensor keeps its buffer across passes, so the pool stops
+        # changing once every tensor has been planned
+        if key not in self._plan:
+            self._plan[key] = self._assign(start, nbytes)
+        b = self._plan[key]
+        self._free_at[b] = end
+
+        self._tensors[key] = {
+            "buffer": b,
+            "start": start,
+            "end": end,
+            "shape": shape,
+            "nbytes": nbytes,
+        }
+        return self._buffers[b][:nbytes].view(dtype).reshape(shape)
+
+    def _run(self, name, i, fn, arg):
+        key = "{}[{}]".format(name, i)
+
+        # results of methods without `out` support are not planned
+        if not _accepts(fn, "out"):
+            self._unplanned.append(key)
+            return fn(arg)
+
+        # the first pass for an input shape only records the tensor shapes
+        if key not in self._specs:
+            res = fn(arg)
+            self._specs[key] = (res.shape, res.dtype)
+            return res
+
+        out = self._buffer(name, i, *self._specs[key])
+        return fn(arg, out=out)
+
+    def forward(self, X):
+        """
+        Run a forward pass through the stack, writing each layer output into
+        its planned buffer.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, ...)
+            The input to the first layer in the stack
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, ...)
+            The output of the final layer in the stack. This is a view into
+            the buffer pool.
+        """
+        if X.shape != self._plan_shape:
+            self._plan_shape = X.shape
+            self._specs, self._plan = {}, {}
+
+        self._tensors, self._unplanned = {}, []
+        self._free_at = [-1] * len(self._buffers)
+
+        Y = X
+        for i, layer in enumerate(self.layers):
+            fn = layer.forward
+            if self.mode == "inference" and _accepts(fn, "retain_derived"):
+                fn = partial(fn, retain_derived=False)
+            Y = self._run("Y", i + 1, fn, Y)
+        return Y
+
+    def backward(self, dLdY):
+        """
+        Run a backward pass through the stack, writing each input gradient
+        into its planned buffer.
+
+        Parameters
+        ----------
+        dLdY : numpy array of shape (n_ex, ...)
+            The gradient of the loss wrt. the output of the final layer
+
+        Returns
+        -------
+        dLdX : numpy array of shape (n_ex, ...)
+            The gradient of the loss wrt. the input to the first layer. This
+            is a view into the buffer pool.
+        """
+        assert self.mode == "train", "Backward pass requires mode = 'train'"
+
+        dX = dLdY
+        for i in reversed(range(len(self.layers))):
+            dX = self._run("dX", i + 1, self.layers[i].backward, dX)
+        return dX
+
+    def report(self):
+        """
+        Summarize the most recent plan.
+
+        Returns
+        -------
+        report : dict
+            A dictionary containing the total bytes of the planned tensors
+            (`total_bytes`), the peak bytes of live planned tensors if every
+            tensor received its own allocation and was freed right after its
+            last read (`naive_peak_bytes`), the total bytes in the buffer pool
+            (`planned_peak_bytes`), the buffer assignment for each planned
+            tensor, and the tensors left out of the plan (`unplanned`). Greedy
+            assignment can fragment the pool so that `planned_peak_bytes`
+            exceeds `naive_peak_bytes`; `savings` is then clamped to 0 and
+            `fragmented` is True.
+        """
+        tensors = self._tensors.values()
+        steps = set(t["start"] for t in tensors)
+        naive = max(
+            [
+                sum(t["nbytes"] for t in tensors if t["start"] <= s <= t["end"])
+                for s in steps
+            ]
+            + [0]
+        )
+        planned = sum(b.nbytes for b in self._buffers)
+        return {
+            "mode": self.mode,
+            "n_tensors": len(self._tensors),
+            "n_buffers": len(self._buffers),
+            "total_bytes": sum(t["nbytes"] for t in tensors),
+            "naive_peak_bytes": naive,
+            "planned_peak_bytes": planned,
+            "savings": max(0.0, 1.0 - planned / naive) if naive > 0 else 0.0,
+            "fragmented": planned > naive,
+            "assignments": {k: v["buffer"] for k, v in self._tensors.items()},
+            "unplanned": list(self._unplanned),
+        }
@@ -0,0 +1,385 @@
+import json
+import threading
+import tracemalloc
+from time import perf_counter
+from collections import OrderedDict
+
+import numpy as np
+
+# rough per-element FLOP counts for each optimizer's update rule
+OPTIMIZER_FLOPS = {"SGD": 4, "AdaGrad": 6, "RMSProp": 8, "Adam": 14, "LARS": 10, "LAMB": 20}
+
+
+def _numel(x):
+    if isinstance(x, (list, tuple)):
+        return sum(_numel(i) for i in x)
+    return x.size if isinstance(x, np.ndarray) else 0
+
+
+def _nbytes(x):
+    if isinstance(x, (list, tuple)):
+        return sum(_nbytes(i) for i in x)
+    return x.nbytes if isinstance(x, np.ndarray) else 0
+
+
+def _first(x):
+    return x[0] if isinstance(x, (list, tuple)) else x
+
+
+def _component_ids(layer):
+    try:
+        return layer.hyperparameters.get("component_ids", [])
+    except AttributeError:
+        # some modules only initialize their components on the first forward
+        # pass, and cannot report hyperparameters until then
+        return []
+
+
+def estimate_flops(layer, phase, inputs, outputs):
+    """
+    Estimate the number of floating point operations performed during a
+    single `forward`, `backward`, or `update` call for a layer, using the
+    layer hyperparameters and the shapes of the arrays passed in / out.
+
+    Parameters
+    ----------
+    layer : `LayerBase` or `ModuleBase` instance
+        The layer being profiled
+    phase : str
+        The method being profiled. Valid entries are {'forward', 'backward',
+        'update'}.
+    inputs : tuple
+        The positional arguments passed to the method
+    outputs : numpy array, tuple, or None
+        The value returned by the method
+
+    Returns
+    -------
+    flops : int
+        The estimated FLOP count. Modules return 0, since their work is
+        accounted for by their components.
+    """
+    H = layer.hyperparameters
+    name = H["layer"]
+
+    if phase == "update":
+        opt = H.get("optimizer", {})
+        opt_id = opt.get("hyperparameters", {}).get("id", "SGD")
+        n_params = sum(_numel(v) for v in layer.parameters.values())
+        return OPTIMIZER_FLOPS.get(opt_id, 4) * n_params
+
+    if "components" in H:
+        return 0
+
+    # for backward, the "input" of the layer is the returned gradient and the
+    # "output" of the layer is the incoming gradient
+    X, Y = inputs[0] if len(inputs) > 0 else None, outputs
+    if phase == "backward":
+        X, Y = Y, X
+
+    X, Y = _first(X), _first(Y)
+    if not isinstance(Y, np.ndarray) or not isinstance(X, np.ndarray):
+        return 0
+
+    n_ex, n_out = X.shape[0], Y.size
+    if name == "FullyConnected":
+        flops = 2 * n_ex * X.shape[1] * Y.shape[1]
+    elif name == "SparseFullyConnected":
+        flops = 2 * n_ex * H["nnz"]
+    elif name == "Conv1D":
+        flops = 2 * n_out * H["kernel_width"] * H["in_ch"]
+    elif name in ["Conv2D", "Deconv2D"]:
+        fr, fc = H["kernel_shape"]
+        flops = 2 * n_out * fr * fc * H["in_ch"] // H.get("groups", 1)
+    elif name == "DepthwiseSeparableConv2D":
+        fr, fc = H["kernel_shape"]
+        n_mid = H["in_ch"] * H["depth_multiplier"]
+        flops = 2 * (n_out // H["out_ch"]) * n_mid * (fr * fc + H["out_ch"])
+    elif name == "RNNCell":
+        flops = 2 * n_ex * (H["n_in"] + H["n_out"]) * H["n_out"]
+    elif name == "LSTMCell":
+        flops = 8 * n_ex * (H["n_in"] + H["n_out"]) * H["n_out"]
+    elif name == "RNN":
+        flops = 2 * n_ex * (H["n_in"] + H["n_out"]) * H["n_out"] * X.shape[2]
+    elif name == "LSTM":
+        flops = 8 * n_ex * (H["n_in"] + H["n_out"]) * H["n_out"] * X.shape[2]
+    elif name == "RestrictedBoltzmannMachine":
+        flops = 2 * n_ex * H["n_in"] * H["n_out"] * (2 * H["K"] + 1)
+    elif name in ["BatchNorm1D", "BatchNorm2D"]:
+        flops = 5 * X.size
+    elif name == "Pool2D":
+        fr, fc = H["kernel_shape"]
+        flops = n_out * fr * fc
+    elif name in ["Sum", "Multiply"]:
+        flops = n_out * max(len(inputs[0]) - 1, 1) if phase == "forward" else n_out
+    else:
+        flops = 0
+
+    # elementwise bias + activation
+    if "act_fn" in H and H["act_fn"] is not None:
+        flops += 2 * n_out
+
+    # the backward pass computes gradients wrt. both the weights and inputs
+    if phase == "backward" and any(k.startswith("W") for k in layer.parameters):
+        flops *= 2
+    return int(flops)
+
+
+class Profiler(object):
+    def __init__(self, track_memory=True):
+        """
+        An opt-in profiler recording the wall time, estimated FLOPs, and bytes
+        allocated for each `forward`, `backward`, and `update` call on a
+        collection of layers / modules.
+
+        Profiling works by shadowing the instrumented methods on the layer
+        *instance* when it is attached. Detaching a layer removes the shadowing
+        methods entirely, so layers which are not being profiled incur no
+        overhead.
+
+        Parameters
+        ----------
+        track_memory : bool (default: True)
+            Whether to use `tracemalloc` to measure the peak bytes allocated
+            during each call. If False, only the bytes of the returned arrays
+            are recorded.
+        """
+        self.track_memory = track_memory
+        self.events = []
+
+        self._t0 = perf_counter()
+        self._local = threading.local()
+        self._attached = OrderedDict()
+        self._started_tracemalloc = False
+
+    @property
+    def hyperparameters(self):
+        return {"track_memory": self.track_memory}
+
+    def attach(self, layer, name=None):
+        """
+        Begin profiling the `forward`, `backward`, and `update` calls of
+        `layer`. If `layer` is a module, its components are attached as well,
+        with names of the form ``<name>.<component_id>``.
+
+        Parameters
+        ----------
+        layer : `LayerBase` or `ModuleBase` instance
+            The layer to profile
+        name : str (default: None)
+            The name to use for the layer in the profiling report. If None,
+            use ``<layer>_<id(layer)>``.
+        """
+        if id(layer) in self._attached:
+            return
+
+        if name is None:
+            name = "{}_{}".format(type(layer).__name__, id(layer))
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        for phase in ["forward", "backward", "update"]:
+            setattr(layer, phase, self._instrument(layer, name, phase))
+
+        layer._profiler = self
+        self._attached[id(layer)] = (layer, name)
+        self._attach_components(layer, name)
+
+    def _attach_components(self, layer, name):
+        for c in _component_ids(layer):
+            comp = getattr(layer, c, None)
+            if comp is not None and hasattr(comp, "hyperparameters"):
+                self.attach(comp, "{}.{}".format(name, c))
+
+    def detach(self, layer):
+        """Stop profiling `layer` (and its components, if it is a module)."""
+        if id(layer) not in self._attached:
+            return
+
+        for phase in ["forward", "backward", "update"]:
+            if phase in layer.__dict__:
+                delattr(layer, phase)
+
+        layer._profiler = None
+        del self._attached[id(layer)]
+
+        for c in _component_ids(layer):
+            comp = getattr(layer, c, None)
+            if comp is not None:
+                self.detach(comp)
+
+        if len(self._attached) == 0 and self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def detach_all(self):
+        """Stop profiling all attached layers."""
+        for layer, name in list(self._attached.values()):
+            self.detach(layer)
+
+    def reset(self):
+        """Discard all recorded events."""
+        self.events = []
+        self._t0 = perf_counter()
+
+    def _instrument(self, layer, name, phase):
+        fn = getattr(layer, phase)
+
+        def profiled(*args, **kwargs):
+            stack = self._stack()
+            track = self.track_memory and tracemalloc.is_tracing()
+
+            # fold the parent's running peak into its frame before resetting
+            # the tracemalloc peak for this call
+            if track:
+                cur, peak = tracemalloc.get_traced_memory()
+                if len(stack) > 0:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+                tracemalloc.reset_peak()
+
+            frame = {"child_flops": 0, "peak": 0, "start_mem": cur if track else 0}
+            stack.append(frame)
+
+            t0 = perf_counter()
+            try:
+                out = fn(*args, **kwargs)
+            finally:
+                t1 = perf_counter()
+                stack.pop()
+
+            if track:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                n_bytes = max(peak - frame["start_mem"], 0)
+                if len(stack) > 0:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            else:
+                n_bytes = _nbytes(out)
+
+            flops = estimate_flops(layer, phase, args, out) + frame["child_flops"]
+            if len(stack) > 0:
+                stack[-1]["child_flops"] += flops
+
+            self.events.append(
+                {
+                    "name": name,
+                    "layer": layer.hyperparameters["layer"],
+                    "phase": phase,
+                    "start": t0 - self._t0,
+                    "duration": t1 - t0,
+                    "flops": flops,
+                    "bytes": n_bytes,
+                    "depth": len(stack),
+                    "tid": threading.get_ident(),
+                }
+            )
+
+            # attach any components that were lazily initialized during this call
+            if phase == "forward":
+                self._attach_components(layer, name)
+            return out
+
+        return profiled
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def report(self):
+        """
+        Aggregate the recorded events by layer and phase.
+
+        Returns
+        -------
+        report : OrderedDict
+            A dictionary mapping each layer name to a dictionary of
+            per-phase statistics (`calls`, `total_time`, `mean_time`,
+            `flops`, `bytes`, and `gflops_per_sec`).
+        """
+        report = OrderedDict()
+        for e in self.events:
+            entry = report.setdefault(e["name"], OrderedDict())
+            stats = entry.setdefault(
+                e["phase"],
+                {"calls": 0, "total_time": 0.0, "flops": 0, "bytes": 0},
+            )
+            stats["calls"] += 1
+            stats["total_time"] += e["duration"]
+            stats["flops"] += e["flops"]
+            stats["bytes"] += e["bytes"]
+
+        for entry in report.values():
+            for stats in entry.values():
+                t = stats["total_time"]
+                stats["mean_time"] = t / stats["calls"]
+                stats["gflops_per_sec"] = stats["flops"] / t / 1e9 if t > 0 else 0.0
+        return report
+
+    def summary(self):
+        """
+        Return the aggregated report formatted as a plain-text table, sorted
+        by descending total time.
+        """
+        rows = []
+        for name, entry in self.report().items():
+            for phase, s in entry.items():
+                rows.append((name, phase, s))
+        rows.sort(key=lambda r: -r[2]["total_time"])
+
+        fstr = "{:<40} {:<9} {:>6} {:>12} {:>12} {:>12} {:>10} {:>12}"
+        header = fstr.format(
+            "layer", "phase", "calls", "total (ms)", "mean (ms)", "MFLOPs", "GFLOP/s", "MB alloc"
+        )
+        lines = [header, "-" * len(header)]
+        for name, phase, s in rows:
+            lines.append(
+                fstr.format(
+                    name[:40],
+                    phase,
+                    s["calls"],
+                    "{:.3f}".format(s["total_time"] * 1e3),
+                    "{:.3f}".format(s["mean_time"] * 1e3),
+                    "{:.2f}".format(s["flops"] / 1e6),
+                    "{:.2f}".format(s["gflops_per_sec"]),
+                    "{:.2f}".format(s["bytes"] / 2 ** 20),
+                )
+            )
+        return "\n".join(lines)
+
+    def to_chrome_trace(self, path=None):
+        """
+        Export the recorded events in the Chrome trace event format (viewable
+        via chrome://tracing or https://ui.perfetto.dev).
+
+        Parameters
+        ----------
+        path : str (default: None)
+            If not None, write the trace JSON to this file.
+
+        Returns
+        -------
+        trace : dict
+            The trace, as a dictionary with a single `traceEvents` key.
+        """
+        events = []
+        for e in self.events:
+            events.append(
+                {
+                    "name": "{}.{}".format(e["name"], e["phase"]),
+                    "cat": e["layer"],
+                    "ph": "X",
+                    "ts": e["start"] * 1e6,
+                    "dur": e["duration"] * 1e6,
+                    "pid": 0,
+                    "tid": e["tid"],
+                    "args": {"flops": e["flops"], "bytes": e["bytes"]},
+                }
+            )
+
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path is not None:
+            with open(path, "w") as handle:
+                json.dump(trace, handle)
+        return trace
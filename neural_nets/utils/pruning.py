@@ -0,0 +1,241 @@
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .checkpoint import _normalize, _walk, _is_module, _unwrap
+
+
+def _prunable(model, layer_types):
+    for root, layer in _normalize(model).items():
+        for name, l in _walk(root, layer):
+            if _is_module(l) or l.hyperparameters["layer"] not in layer_types:
+                continue
+            yield name, l
+
+
+def magnitude_mask(W, sparsity):
+    """
+    Compute a mask zeroing the fraction `sparsity` of the entries of `W` with
+    the smallest magnitudes.
+
+    Parameters
+    ----------
+    W : numpy array
+        The weights to prune
+    sparsity : float in [0, 1]
+        The fraction of entries to prune
+
+    Returns
+    -------
+    mask : numpy array of bools with the same shape as `W`
+        False for each pruned entry
+    """
+    if not 0 <= sparsity <= 1:
+        raise ValueError("sparsity must be in [0, 1], but got: {}".format(sparsity))
+
+    mask = np.ones(W.shape, dtype=bool)
+    k = int(round(sparsity * W.size))
+    if k > 0:
+        ix = np.argpartition(np.abs(W), k - 1, axis=None)[:k]
+        mask.flat[ix] = False
+    return mask
+
+
+def magnitude_prune(model, sparsity, layer_types=("FullyConnected",)):
+    """
+    One-shot magnitude pruning. Zeroes the fraction `sparsity` of the
+    smallest-magnitude weights in each matching layer of `model`, and installs
+    the pruning mask on the layer's optimizer so that subsequent fine-tuning
+    updates keep the pruned weights at zero.
+
+    Since pruned weights have zero magnitude, pruning an already-pruned layer
+    to a higher sparsity only ever removes additional weights. The masks are
+    part of the optimizer state, so they are kept when the layer is rebuilt
+    from its `hyperparameters` (see `OptimizerInitializer`) or restored with
+    `load_checkpoint`.
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model to prune. Layers must be initialized.
+    sparsity : float in [0, 1]
+        The fraction of each layer's weights to prune
+    layer_types : tuple of str (default: ("FullyConnected",))
+        The layer types whose weights `W` are pruned
+
+    Returns
+    -------
+    masks : OrderedDict
+        The pruning mask for each pruned layer, keyed by layer name
+    """
+    masks = OrderedDict()
+    for name, layer in _prunable(model, layer_types):
+        W = layer.parameters["W"]
+        mask = magnitude_mask(W, sparsity)
+        layer.parameters["W"] = W * mask
+        layer.optimizer.set_mask("W", mask)
+        masks[name] = mask
+    return masks
+
+
+def sparsity_schedule(final_sparsity, n_steps, initial_sparsity=0.0):
+    """
+    The gradual pruning schedule of Zhu & Gupta (2017):
+
+        s[t] = s_f + (s_i - s_f) * (1 - t / n_steps) ** 3,  t = 1, ..., n_steps
+
+    which prunes aggressively at first, when there are many redundant
+    weights, and more slowly as the final sparsity is approached.
+
+    Parameters
+    ----------
+    final_sparsity : float in [0, 1]
+        The sparsity after the last step
+    n_steps : int
+        The number of pruning steps
+    initial_sparsity : float in [0, 1] (default: 0)
+        The sparsity before the first step
+
+    Returns
+    -------
+    schedule : list of floats of length `n_steps`
+        The target sparsity at each step
+    """
+    s_i, s_f = initial_sparsity, final_sparsity
+    return [s_f + (s_i - s_f) * (1 - t / n_steps) ** 3 for t in range(1, n_steps + 1)]
+
+
+def iterative_prune(
+    model, final_sparsity, n_steps, fine_tune=None, initial_sparsity=0.0, layer_types=("FullyConnected",)
+):
+    """
+    Iterative magnitude pruning. Alternates `magnitude_prune` with a
+    user-supplied fine-tuning routine, increasing the sparsity at each step
+    according to `sparsity_schedule`.
+
+    Parameters
+    ----------
+    model : `LayerBase` or `ModuleBase` instance, or list / dict of instances
+        The model to prune. Layers must be initialized.
+    final_sparsity : float in [0, 1]
+        The fraction of each layer's weights to prune by the last step
+    n_steps : int
+        The number of pruning steps
+    fine_tune : callable or None (default: None)
+        Called as `fine_tune(step, sparsity)` after each pruning step to
+        retrain the model. Updates made through the layer optimizers respect
+        the pruning masks.
+    initial_sparsity : float in [0, 1] (default: 0)
+        The sparsity before the first step
+    layer_types : tuple of str (default: ("FullyConnected",))
+        The layer types whose weights `W` are pruned
+
+    Returns
+    -------
+    masks : OrderedDict
+        The final pruning mask for each pruned layer, keyed by layer name
+    """
+    masks = OrderedDict()
+    schedule = sparsity_schedule(final_sparsity, n_steps, initial_sparsity)
+    for step, sparsity in enumerate(schedule):
+        masks = magnitude_prune(model, sparsity, layer_types)
+        if fine_tune is not None:
+            fine_tune(step, sparsity)
+    return masks
+
+
+class SparseFullyConnected(object):
+    def __init__(self, layer):
+        """
+        An inference-only copy of a (pruned) `FullyConnected` layer which
+        stores its weights in compressed sparse row (CSR) format.
+
+        The transposed weight matrix W.T is stored, so that the forward pass
+        is a CSR-times-dense product, which costs O(n_ex * nnz(W)) rather than
+        O(n_ex * n_in * n_out):
+
+            Y = act_fn( (W.T . X.T).T + b )
+
+        The CSR arrays are exposed in `parameters`, so both the reported model
+        size and the profiler's FLOP estimate scale with the number of
+        nonzero weights.
+
+        Parameters
+        ----------
+        layer : `FullyConnected` instance
+            The trained (and typically pruned) float layer
+        """
+        layer = _unwrap(layer)
+        if layer.hyperparameters["layer"] != "FullyConnected":
+            raise ValueError("Cannot sparsify {} layers".format(layer.hyperparameters["layer"]))
+
+        self.n_in = layer.n_in
+        self.n_out = layer.n_out
+        self.act_fn = layer.act_fn
+        self.trainable = False
+
+        W_t = csr_matrix(layer.parameters["W"].T)
+        W_t.eliminate_zeros()
+        self._W_t = W_t
+        self.parameters = {
+            "W_data": W_t.data,
+            "W_indices": W_t.indices,
+            "W_indptr": W_t.indptr,
+            "b": layer.parameters["b"].copy(),
+        }
+
+    @property
+    def nnz(self):
+        return self._W_t.nnz
+
+    @property
+    def hyperparameters(self):
+        return {
+            "layer": "SparseFullyConnected",
+            "n_in": self.n_in,
+            "n_out": self.n_out,
+            "nnz": self.nnz,
+            "density": self.nnz / (self.n_in * self.n_out),
+            "act_fn": str(self.act_fn),
+        }
+
+    def forward(self, X):
+        """
+        Compute the layer output on a single minibatch.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, n_in)
+            Layer input
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, n_out)
+            Layer output for each of the `n_ex` examples
+        """
+        Z = (self._W_t @ X.T).T
+        Z += self.parameters["b"]
+        return self.act_fn.fn(Z, out=Z)
+
+
+def sparsify_model(layers):
+    """
+    Replace each `FullyConnected` layer in a sequential stack with a
+    `SparseFullyConnected` copy for inference. All other layers are shared
+    with the original model, unchanged.
+
+    Parameters
+    ----------
+    layers : list of layers
+        The (pruned) float model
+
+    Returns
+    -------
+    sparse_layers : list of layers
+        The model with CSR fully-connected layers
+    """
+    return [
+        SparseFullyConnected(l) if _unwrap(l).hyperparameters["layer"] == "FullyConnected" else l
+        for l in layers
+    ]
@@ -0,0 +1,298 @@
+import numpy as np
+
+from .utils import conv2D
+from .memory import _accepts
+from .checkpoint import _unwrap
+
+# layer types with a quantized inference implementation
+QUANTIZABLE = ["FullyConnected", "Conv2D"]
+
+
+def _qinfo(n_bits):
+    if n_bits == 8:
+        return 2 ** 7 - 1, np.int8
+    if n_bits == 16:
+        return 2 ** 15 - 1, np.int16
+    raise ValueError("n_bits must be 8 or 16, but got: {}".format(n_bits))
+
+
+def quantize_weights(W, n_bits=8):
+    """
+    Symmetric per-output-channel quantization of a weight tensor.
+
+    Each output channel (the last axis of `W`) gets its own scale, chosen so
+    that the largest absolute weight in the channel maps to the largest
+    representable integer:
+
+        scale[c] = max(|W[..., c]|) / (2 ** (n_bits - 1) - 1)
+        W_q[..., c] = round(W[..., c] / scale[c])
+
+    Parameters
+    ----------
+    W : numpy array of shape (..., out_ch)
+        The float weights
+    n_bits : {8, 16} (default: 8)
+        The integer width of the quantized weights
+
+    Returns
+    -------
+    W_q : numpy array of shape (..., out_ch)
+        The quantized weights, as int8 or int16
+    scale : numpy array of shape (out_ch,)
+        The per-channel scale, such that W ~= W_q * scale
+    """
+    qmax, dtype = _qinfo(n_bits)
+    scale = np.max(np.abs(W), axis=tuple(range(W.ndim - 1))) / qmax
+    scale[scale == 0] = 1.0
+    W_q = np.clip(np.rint(W / scale), -qmax, qmax).astype(dtype)
+    return W_q, scale
+
+
+def calibrate(X, n_bits=8):
+    """
+    Compute a symmetric per-tensor activation scale from a calibration batch.
+
+    Parameters
+    ----------
+    X : numpy array
+        A representative batch of layer inputs
+    n_bits : {8, 16} (default: 8)
+        The integer width of the quantized activations
+
+    Returns
+    -------
+    scale : float
+        The activation scale, such that the largest absolute value in `X`
+        maps to the largest representable integer. Inputs outside the
+        calibrated range saturate when quantized.
+    """
+    qmax, _ = _qinfo(n_bits)
+    amax = float(np.max(np.abs(X)))
+    return amax / qmax if amax > 0 else 1.0
+
+
+def quantize(X, scale, n_bits=8, dtype=None):
+    """
+    Quantize `X` to `n_bits` signed integers with the given scale, saturating
+    values outside the representable range.
+
+    Parameters
+    ----------
+    X : numpy array
+        The float values to quantize
+    scale : float
+        The quantization scale (see `calibrate`)
+    n_bits : {8, 16} (default: 8)
+        The integer width of the quantized values
+    dtype : numpy dtype or None (default: None)
+        The integer dtype of the returned array. If None, use the smallest
+        dtype holding `n_bits`.
+
+    Returns
+    -------
+    X_q : numpy array
+        The quantized values, such that X ~= X_q * scale
+    """
+    qmax, qdtype = _qinfo(n_bits)
+    X_q = np.rint(X / scale)
+    np.clip(X_q, -qmax, qmax, out=X_q)
+    return X_q.astype(qdtype if dtype is None else dtype)
+
+
+class QuantizedLayer(object):
+    def __init__(self, layer, X_calib, act_bits=8):
+        """
+        An inference-only, post-training quantized copy of a `FullyConnected`
+        or `Conv2D` layer.
+
+        The weights are quantized to int8 with one scale per output channel
+        (see `quantize_weights`), and the layer input is quantized to int8 or
+        int16 with a single scale calibrated on `X_calib` (see `calibrate`).
+        The forward pass multiplies the integer-valued input and weights (as a
+        matrix product, or an im2col convolution), then dequantizes the
+        accumulator once before adding the (float) bias and applying the
+        activation:
+
+            Y = act_fn( (X_q . W_q) * (x_scale * w_scale) + b )
+
+        NB. numpy has no int8 GEMM with a wider accumulator, and its integer
+        products do not use BLAS. Only the int8 weights are kept at rest; on
+        each call the int8 / int16 operands are widened to float64 and
+        multiplied with the float BLAS GEMM. Every product and partial sum of
+        int8 / int16 values is an integer well below 2 ** 53, so the float64
+        accumulator holds exactly the result an integer accumulator would.
+
+        Parameters
+        ----------
+        layer : `FullyConnected` or `Conv2D` instance
+            The trained float layer. If it has not been initialized, it is
+            initialized by running it on `X_calib`.
+        X_calib : numpy array
+            A representative batch of inputs to the layer, used to calibrate
+            the activation scale
+        act_bits : {8, 16} (default: 8)
+            The integer width of the quantized activations
+        """
+        layer = _unwrap(layer)
+        name = layer.hyperparameters["layer"]
+        if name not in QUANTIZABLE:
+            raise ValueError("Cannot quantize {} layers".format(name))
+
+        if not layer.is_initialized:
+            layer.forward(X_calib, retain_derived=False)
+
+        self.act_bits = act_bits
+        self.act_fn = layer.act_fn
+        self.trainable = False
+        self.base_hyperparameters = {
+            k: v for k, v in layer.hyperparameters.items() if k != "optimizer"
+        }
+
+        W_q, W_scale = quantize_weights(layer.parameters["W"], n_bits=8)
+        self.parameters = {"W": W_q, "W_scale": W_scale, "b": layer.parameters["b"].copy()}
+        self.act_scale = calibrate(X_calib, n_bits=act_bits)
+
+    @property
+    def hyperparameters(self):
+        return {
+            "layer": "Quantized" + self.base_hyperparameters["layer"],
+            "act_bits": self.act_bits,
+            "act_scale": self.act_scale,
+            "act_fn": str(self.act_fn),
+            "base_layer": self.base_hyperparameters,
+        }
+
+    def forward(self, X):
+        """
+        Compute the layer output from the quantized input and weights.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_ex, n_in) or (n_ex, in_rows, in_cols, in_ch)
+            The float layer input
+
+        Returns
+        -------
+        Y : numpy array of shape (n_ex, n_out) or (n_ex, out_rows, out_cols, out_ch)
+            The (float) layer output
+        """
+        H = self.base_hyperparameters
+        W_q, W_scale, b = self.parameters["W"], self.parameters["W_scale"], self.parameters["b"]
+
+        # widen the integer operands so the product runs through float BLAS;
+        # the float64 accumulator is exact for int8 / int16 values
+        X_q = quantize(X, self.act_scale, self.act_bits).astype(np.float64)
+        W_q = W_q.astype(np.float64)
+
+        if H["layer"] == "FullyConnected":
+            Z = np.dot(X_q, W_q)
+        else:
+            Z = conv2D(X_q, W_q, H["stride"], H["pad"], H["dilation"], H.get("groups", 1))
+
+        # dequantize once, then apply the float bias + activation in-place
+        Z *= self.act_scale * W_scale
+        Z += b
+        return self.act_fn.fn(Z, out=Z)
+
+
+def _forward(layer, X):
+    # run inference without overwriting the layer's cached training variables
+    if _accepts(layer.forward, "retain_derived"):
+        return layer.forward(X, retain_derived=False)
+    return layer.forward(X)
+
+
+def _run(layers, X):
+    for layer in layers:
+        X = _forward(layer, X)
+    return X
+
+
+def quantization_drift(float_layers, quantized_layers, X, y=None):
+    """
+    Compare the outputs of a float model and its quantized counterpart.
+
+    Parameters
+    ----------
+    float_layers : list of layers
+        The float model, as a sequential stack of layers
+    quantized_layers : list of layers
+        The quantized model (see `quantize_model`)
+    X : numpy array
+        A batch of model inputs
+    y : numpy array of shape (n_ex,) or (n_ex, n_classes) or None (default: None)
+        Integer or one-hot class labels for `X`. If provided, the report
+        includes the classification accuracy of both models.
+
+    Returns
+    -------
+    report : dict
+        A dictionary with the entries
+
+            max_abs_error  : The largest absolute difference between outputs
+            rel_error      : ||Y_q - Y|| / ||Y|| over the whole batch
+            top1_agreement : The fraction of examples for which the argmax of
+                             the two outputs agree (2D outputs only)
+
+        and, if `y` is provided, `float_accuracy`, `quantized_accuracy`, and
+        `accuracy_drift` (the float accuracy minus the quantized accuracy).
+    """
+    Y = _run(float_layers, X)
+    Y_q = _run(quantized_layers, X)
+
+    err = Y_q - Y
+    Y_norm = np.linalg.norm(Y)
+    report = {
+        "max_abs_error": float(np.max(np.abs(err))),
+        "rel_error": float(np.linalg.norm(err) / Y_norm) if Y_norm > 0 else 0.0,
+    }
+
+    if Y.ndim == 2:
+        pred, pred_q = Y.argmax(axis=1), Y_q.argmax(axis=1)
+        report["top1_agreement"] = float(np.mean(pred == pred_q))
+
+        if y is not None:
+            y = y.argmax(axis=1) if y.ndim == 2 else y
+            report["float_accuracy"] = float(np.mean(pred == y))
+            report["quantized_accuracy"] = float(np.mean(pred_q == y))
+            report["accuracy_drift"] = report["float_accuracy"] - report["quantized_accuracy"]
+    return report
+
+
+def quantize_model(layers, X_calib, act_bits=8, y_calib=None):
+    """
+    Post-training quantization of a sequential stack of layers.
+
+    Runs `X_calib` through the float model, replacing each `FullyConnected`
+    and `Conv2D` layer with a `QuantizedLayer` calibrated on the float input
+    it receives. All other layers are shared with the float model, unchanged.
+
+    Parameters
+    ----------
+    layers : list of layers
+        The trained float model
+    X_calib : numpy array
+        A representative batch of model inputs
+    act_bits : {8, 16} (default: 8)
+        The integer width of the quantized activations
+    y_calib : numpy array or None (default: None)
+        Optional labels for `X_calib`, used to report the accuracy drift
+
+    Returns
+    -------
+    quantized_layers : list of layers
+        The quantized model
+    report : dict
+        The drift of the quantized model against the float model on
+        `X_calib` (see `quantization_drift`)
+    """
+    X, quantized_layers = X_calib, []
+    for layer in layers:
+        if _unwrap(layer).hyperparameters["layer"] in QUANTIZABLE:
+            quantized_layers.append(QuantizedLayer(layer, X, act_bits))
+        else:
+            quantized_layers.append(layer)
+        X = _forward(layer, X)
+
+    report = quantization_drift(layers, quantized_layers, X_calib, y_calib)
+    return quantized_layers, report
@@ -0,0 +1,263 @@
+import queue
+import inspect
+import threading
+from time import perf_counter
+from functools import partial
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def _inference_forward(model):
+    """
+    Build a function running a forward pass through `model` without caching
+    any values for the backward pass, where the layers support it.
+    """
+    if callable(model) and not hasattr(model, "forward"):
+        return model
+
+    fns = []
+    for layer in model if isinstance(model, (list, tuple)) else [model]:
+        if "retain_derived" in inspect.signature(layer.forward).parameters:
+            fns.append(partial(layer.forward, retain_derived=False))
+        else:
+            fns.append(layer.forward)
+
+    def forward(X):
+        for fn in fns:
+            X = fn(X)
+        return X
+
+    return forward
+
+
+class BatchingServer(object):
+    def __init__(self, model, max_batch_size=32, max_wait=0.005):
+        """
+        A local inference server which coalesces single-example requests
+        into minibatches.
+
+        Requests are placed on an in-process queue and served by a single
+        worker thread. The worker waits for the first request, then keeps
+        collecting requests until either `max_batch_size` have arrived or
+        `max_wait` seconds have passed since the first one arrived. It then
+        stacks the examples, runs one forward pass over the batch, and
+        scatters the output rows back to the individual requests. Under load,
+        this replaces many batch-size-1 matrix products with a few large ones.
+
+            >>> with BatchingServer(layers, max_batch_size=64) as server:
+            ...     y = server.predict(x)
+
+        `max_batch_size` and `max_wait` trade latency for throughput: larger
+        values produce larger batches at the cost of longer queueing delays
+        when the request rate is low.
+
+        Parameters
+        ----------
+        model : `LayerBase` or `ModuleBase` instance, list of instances, or callable
+            The model to serve. A list is treated as a sequential stack of
+            layers. Layers whose `forward` method accepts `retain_derived` are
+            run with `retain_derived=False`. Any other callable is called
+            directly on each batch.
+        max_batch_size : int (default: 32)
+            The maximum number of requests to serve in a single forward pass
+        max_wait : float (default: 0.005)
+            The maximum time, in seconds, to hold the first request of a batch
+            while waiting for more requests to arrive
+        """
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+
+        self._forward = _inference_forward(model)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.reset_stats()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        Start the worker thread. Requests submitted before the server starts
+        are queued and served once it does.
+        """
+        if self._closed:
+            raise RuntimeError("Server has been stopped")
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Serve all pending requests, then stop the worker thread. If the
+        server was never started, pending requests fail with a RuntimeError.
+        """
+        # closing and enqueueing the sentinel under the lock ensures that no
+        # request can be queued behind the sentinel
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+        if self._thread is not None:
+            self._thread.join()
+
+        # fail anything the worker did not serve, so no future is left pending
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is not None:
+                req[1].set_exception(RuntimeError("Server stopped before serving request"))
+
+    def submit(self, x):
+        """
+        Queue a single example for inference.
+
+        Parameters
+        ----------
+        x : numpy array
+            A single example, without the leading batch dimension
+
+        Returns
+        -------
+        future : `concurrent.futures.Future` instance
+            A future resolving to the model output for `x`, again without the
+            batch dimension
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Server has been stopped")
+
+            self._queue.put((x, future, perf_counter()))
+            self._n_requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def predict(self, x, timeout=None):
+        """
+        Run inference on a single example, blocking until the batch containing
+        it has been served.
+
+        Parameters
+        ----------
+        x : numpy array
+            A single example, without the leading batch dimension
+        timeout : float or None (default: None)
+            The maximum number of seconds to wait for the result
+
+        Returns
+        -------
+        y : numpy array
+            The model output for `x`
+        """
+        return self.submit(x).result(timeout)
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None, True
+
+        batch, stop = [first], False
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # once the deadline has passed, take only the requests which are
+            # already queued
+            timeout = deadline - perf_counter()
+            try:
+                if timeout > 0:
+                    req = self._queue.get(timeout=timeout)
+                else:
+                    req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if req is None:
+                stop = True
+                break
+            batch.append(req)
+        return batch, stop
+
+    def _serve(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch is None:
+                break
+
+            xs, futures, t_submit = zip(*batch)
+            try:
+                Y = self._forward(np.stack(xs))
+            except Exception as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+
+            # record the batch before releasing any of its requests, so the
+            # stats are current by the time a client sees its result
+            t_done = perf_counter()
+            latencies = [t_done - t for t in t_submit]
+            with self._lock:
+                self._n_served += len(batch)
+                self._n_batches += 1
+                self._max_batch = max(self._max_batch, len(batch))
+                self._total_latency += sum(latencies)
+                self._max_latency = max(self._max_latency, max(latencies))
+
+            for i, f in enumerate(futures):
+                f.set_result(Y[i])
+
+    def reset_stats(self):
+        """
+        Reset the counters reported by `stats`.
+        """
+        with self._lock:
+            self._n_requests = 0
+            self._n_served = 0
+            self._n_batches = 0
+            self._max_batch = 0
+            self._max_queue_depth = 0
+            self._total_latency = 0.0
+            self._max_latency = 0.0
+
+    def stats(self):
+        """
+        Report the server's queueing and batching metrics.
+
+        Returns
+        -------
+        stats : dict
+            A dictionary with the entries
+
+                n_requests      : Requests submitted
+                n_served        : Requests successfully served
+                n_batches       : Forward passes run
+                mean_batch_size : n_served / n_batches
+                max_batch_size  : The largest batch served
+                queue_depth     : Requests currently waiting
+                max_queue_depth : The most requests waiting at once
+                mean_latency    : Mean time from submission to result, in seconds
+                max_latency     : Max time from submission to result, in seconds
+        """
+        with self._lock:
+            n_served, n_batches = self._n_served, self._n_batches
+            return {
+                "n_requests": self._n_requests,
+                "n_served": n_served,
+                "n_batches": n_batches,
+                "mean_batch_size": n_served / n_batches if n_batches > 0 else 0.0,
+                "max_batch_size": self._max_batch,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "mean_latency": self._total_latency / n_served if n_served > 0 else 0.0,
+                "max_latency": self._max_latency,
+            }
@@ -192,6 +192,135 @@ def calc_pad_dims_1D(X_shape, l_out, kernel_width, stride, dilation=0, causal=Fa
     return (pw1, pw2)
 
 
+def plan_pad1D(X_shape, pad, kernel_width=None, stride=None, dilation=0):
+    """
+    Compute the padding that `pad1D` would apply to an input of shape
+    `X_shape`, without allocating or padding any arrays.
+
+    Parameters
+    ----------
+    X_shape : tuple of (n_ex, l_in, in_ch)
+        Dimensions of the input volume
+    pad : tuple, int, or {'same', 'causal'}
+        The padding amount (see `pad1D`)
+    kernel_width : int (default: None)
+        The width of the 1D convolution kernel. Only relevant if p='same' or
+        'causal'
+    stride : int (default: None)
+        The stride for the convolution kernel. Only relevant if p='same' or
+        'causal'
+    dilation : int (default: 0)
+        The dilation of the convolution kernel. Only relevant if p='same' or
+        'causal'
+
+    Returns
+    -------
+    p : 2-tuple
+        The number of 0-padded columns to add to the (left, right) of the
+        sequences in X
+    """
+    p = pad
+    if isinstance(p, int):
+        return (p, p)
+
+    if isinstance(p, tuple):
+        return (p[0], p[1])
+
+    # compute the correct padding dims for a 'same' or 'causal' convolution
+    if p in ["same", "causal"] and kernel_width and stride:
+        return calc_pad_dims_1D(
+            tuple(X_shape),
+            X_shape[1],
+            kernel_width,
+            stride,
+            causal=p == "causal",
+            dilation=dilation,
+        )
+    raise ValueError("Cannot compute padding for pad = {}".format(pad))
+
+
+def plan_pad2D(X_shape, pad, kernel_shape=None, stride=None, dilation=0):
+    """
+    Compute the padding that `pad2D` would apply to an input of shape
+    `X_shape`, without allocating or padding any arrays.
+
+    Parameters
+    ----------
+    X_shape : tuple of (n_ex, in_rows, in_cols, in_ch)
+        Dimensions of the input volume
+    pad : tuple, int, or 'same'
+        The padding amount (see `pad2D`)
+    kernel_shape : 2-tuple (default: None)
+        The dimension of the 2D convolution kernel. Only relevant if p='same'.
+    stride : int (default: None)
+        The stride for the convolution kernel. Only relevant if p='same'.
+    dilation : int (default: 0)
+        The dilation of the convolution kernel. Only relevant if p='same'.
+
+    Returns
+    -------
+    p : 4-tuple
+        The number of 0-padded rows to add to the (top, bottom, left, right)
+        of X
+    """
+    p = pad
+    if isinstance(p, int):
+        return (p, p, p, p)
+
+    if isinstance(p, tuple):
+        if len(p) == 2:
+            return (p[0], p[0], p[1], p[1])
+        return tuple(p)
+
+    # compute the correct padding dims for a 'same' convolution
+    if p == "same" and kernel_shape and stride is not None:
+        return calc_pad_dims_2D(
+            tuple(X_shape), tuple(X_shape[1:3]), tuple(kernel_shape), stride, dilation=dilation
+        )
+    raise ValueError("Cannot compute padding for pad = {}".format(pad))
+
+
+def plan_conv2D(X_shape, W_shape, stride, pad, dilation=0):
+    """
+    Compute the padding and output dimensions for a 2D convolution from the
+    input and kernel shapes alone.
+
+    Parameters
+    ----------
+    X_shape : tuple of (n_ex, in_rows, in_cols, in_ch)
+        Dimensions of the (unpadded) input volume
+    W_shape : tuple of (kernel_rows, kernel_cols, in_ch, out_ch)
+        Dimensions of the convolution kernels
+    stride : int
+        The stride of each convolution kernel
+    pad : tuple, int, or 'same'
+        The padding amount (see `pad2D`)
+    dilation : int (default: 0)
+        Number of pixels inserted between kernel elements.
+
+    Returns
+    -------
+    p : 4-tuple
+        The number of 0-padded rows to add to the (top, bottom, left, right)
+        of X
+    out_rows : int
+        The number of rows in the convolution output
+    out_cols : int
+        The number of columns in the convolution output
+    """
+    s, d = stride, dilation
+    fr, fc = W_shape[:2]
+    n_ex, in_rows, in_cols, in_ch = X_shape
+    pr1, pr2, pc1, pc2 = p = plan_pad2D(X_shape, pad, (fr, fc), s, d)
+
+    # update effective filter shape based on dilation factor
+    _fr, _fc = fr * (d + 1) - d, fc * (d + 1) - d
+
+    out_rows = int((in_rows + pr1 + pr2 - _fr) / s + 1)
+    out_cols = int((in_cols + pc1 + pc2 - _fc) / s + 1)
+    return p, out_rows, out_cols
+
+
 def pad1D(X, pad, kernel_width=None, stride=None, dilation=0):
     """
     One-dimensional zero-padding utility.
@@ -225,26 +354,10 @@ def pad1D(X, pad, kernel_width=None, stride=None, dilation=0):
         The number of 0-padded columns added to the (left, right) of the sequences
         in X
     """
-    p = pad
-    if isinstance(p, int):
-        p = (p, p)
-
-    if isinstance(p, tuple):
-        X_pad = np.pad(
-            X,
-            pad_width=((0, 0), (p[0], p[1]), (0, 0)),
-            mode="constant",
-            constant_values=0,
-        )
-
-    # compute the correct padding dims for a 'same' or 'causal' convolution
-    if p in ["same", "causal"] and kernel_width and stride:
-        causal = p == "causal"
-        p = calc_pad_dims_1D(
-            X.shape, X.shape[1], kernel_width, stride, causal=causal, dilation=dilation
-        )
-        X_pad, p = pad1D(X, p)
-
+    p = plan_pad1D(X.shape, pad, kernel_width, stride, dilation)
+    X_pad = np.pad(
+        X, pad_width=((0, 0), (p[0], p[1]), (0, 0)), mode="constant", constant_values=0
+    )
     return X_pad, p
 
 
@@ -279,27 +392,13 @@ def pad2D(X, pad, kernel_shape=None, stride=None, dilation=0):
         The number of 0-padded rows added to the (top, bottom, left, right) of
         X
     """
-    p = pad
-    if isinstance(p, int):
-        p = (p, p, p, p)
-
-    if isinstance(p, tuple):
-        if len(p) == 2:
-            p = (p[0], p[0], p[1], p[1])
-
-        X_pad = np.pad(
-            X,
-            pad_width=((0, 0), (p[0], p[1]), (p[2], p[3]), (0, 0)),
-            mode="constant",
-            constant_values=0,
-        )
-
-    # compute the correct padding dims for a 'same' convolution
-    if p == "same" and kernel_shape and stride is not None:
-        p = calc_pad_dims_2D(
-            X.shape, X.shape[1:3], kernel_shape, stride, dilation=dilation
-        )
-        X_pad, p = pad2D(X, p)
+    p = plan_pad2D(X.shape, pad, kernel_shape, stride, dilation)
+    X_pad = np.pad(
+        X,
+        pad_width=((0, 0), (p[0], p[1]), (p[2], p[3]), (0, 0)),
+        mode="constant",
+        constant_values=0,
+    )
     return X_pad, p
 
 
@@ -396,11 +495,9 @@ def calc_conv_out_dims(X_shape, W_shape, stride=1, pad=0, dilation=0):
         out_length, out_ch). If 4-tuple, entries are (n_ex, out_rows, out_cols,
         out_ch).
     """
-    dummy = np.zeros(X_shape)
     s, p, d = stride, pad, dilation
     if len(X_shape) == 3:
-        _, p = pad1D(dummy, p)
-        pw1, pw2 = p
+        pw1, pw2 = plan_pad1D(X_shape, p, W_shape[0], s, d)
         fw, in_ch, out_ch = W_shape
         n_ex, in_length, in_ch = X_shape
 
@@ -408,16 +505,8 @@ def calc_conv_out_dims(X_shape, W_shape, stride=1, pad=0, dilation=0):
         out_length = (in_length + pw1 + pw2 - _fw) // s + 1
         out_dims = (n_ex, out_length, out_ch)
     elif len(X_shape) == 4:
-        _, p = pad2D(dummy, p)
-        pr1, pr2, pc1, pc2 = p
-        fr, fc, in_ch, out_ch = W_shape
-        n_ex, in_rows, in_cols, in_ch = X_shape
-
-        # adjust effective filter size to account for dilation
-        _fr, _fc = fr * (d + 1) - d, fc * (d + 1) - d
-        out_rows = (in_rows + pr1 + pr2 - _fr) // s + 1
-        out_cols = (in_cols + pc1 + pc2 - _fc) // s + 1
-        out_dims = (n_ex, out_rows, out_cols, out_ch)
+        _, out_rows, out_cols = plan_conv2D(X_shape, W_shape, s, p, d)
+        out_dims = (X_shape[0], out_rows, out_cols, W_shape[3])
     else:
         raise ValueError("Unrecognized number of input dims: {}".format(len(X_shape)))
     return out_dims
@@ -506,12 +595,17 @@ def im2col(X, W_shape, pad, stride, dilation=0):
     s, p, d = stride, pad, dilation
     n_ex, in_rows, in_cols, n_in = X.shape
 
-    # zero-pad the input
-    X_pad, p = pad2D(X, p, W_shape[:2], stride=s, dilation=d)
+    # zero-pad the input, shuffling it to have channels as the first dim. the
+    # input is copied at most once, directly into the padded buffer
+    p = plan_pad2D(X.shape, p, W_shape[:2], stride=s, dilation=d)
     pr1, pr2, pc1, pc2 = p
 
-    # shuffle to have channels as the first dim
-    X_pad = X_pad.transpose(0, 3, 1, 2)
+    X_pad = X.transpose(0, 3, 1, 2)
+    if any(p):
+        X_pad = np.zeros(
+            (n_ex, n_in, in_rows + pr1 + pr2, in_cols + pc1 + pc2), dtype=X.dtype
+        )
+        X_pad[:, :, pr1 : pr1 + in_rows, pc1 : pc1 + in_cols] = X.transpose(0, 3, 1, 2)
 
     # get the indices for im2col
     k, i, j = _im2col_indices((n_ex, n_in, in_rows, in_cols), fr, fc, p, s, d)
@@ -570,7 +664,106 @@ def col2im(X_col, X_shape, W_shape, pad, stride, dilation=0):
     return X_pad[:, :, pr1:pr2, pc1:pc2]
 
 
-def conv2D(X, W, stride, pad, dilation=0):
+def im2col_1D(X, W_shape, pad, stride, dilation=0):
+    """
+    One-dimensional analog of `im2col`. Pads the input sequences once and
+    returns a (read-only) strided view of every kernel window, without
+    generating any index arrays.
+
+    Parameters
+    ----------
+    X : numpy array of shape (n_ex, l_in, in_ch)
+        Input volume (NOT padded)
+    W_shape: 3-tuple containing (kernel_width, in_ch, out_ch)
+        The dimensions of the weights/kernels in the present convolutional
+        layer
+    pad : tuple, int, or {'same', 'causal'}
+        The padding amount (see `pad1D`)
+    stride : int
+        The stride of each convolution kernel
+    dilation : int (default: 0)
+        Number of pixels inserted between kernel elements.
+
+    Returns
+    -------
+    X_col : numpy array of shape (n_ex, l_out, kernel_width, in_ch)
+        A view of the padded input where X_col[m, i, k] is the input frame
+        multiplied by W[k] when computing output frame i of example m
+    p : 2-tuple
+        The number of 0-padded columns added to the (left, right) of the
+        sequences in X
+    """
+    fw = W_shape[0]
+    s, d = stride, dilation
+    n_ex, l_in, in_ch = X.shape
+
+    p = plan_pad1D(X.shape, pad, fw, s, d)
+    X_pad = X
+    if any(p):
+        X_pad = np.zeros((n_ex, l_in + p[0] + p[1], in_ch), dtype=X.dtype)
+        X_pad[:, p[0] : p[0] + l_in] = X
+
+    # adjust effective filter size to account for dilation
+    _fw = fw * (d + 1) - d
+    l_out = (X_pad.shape[1] - _fw) // s + 1
+    if l_out <= 0:
+        raise ValueError("Dimension mismatch during convolution: l_out = {}".format(l_out))
+
+    sn, sl, sc = X_pad.strides
+    X_col = np.lib.stride_tricks.as_strided(
+        X_pad,
+        shape=(n_ex, l_out, fw, in_ch),
+        strides=(sn, s * sl, (d + 1) * sl, sc),
+        writeable=False,
+    )
+    return X_col, p
+
+
+def col2im_1D(X_col, X_shape, W_shape, pad, stride, dilation=0):
+    """
+    One-dimensional analog of `col2im` (the adjoint of `im2col_1D`). Sums the
+    windows in `X_col` back into a volume with the shape of the input.
+
+    The scatter is performed with one strided slice-add per kernel tap, which
+    is equivalent to (but much cheaper than) an `np.add.at` over every window
+    element.
+
+    Parameters
+    ----------
+    X_col : numpy array of shape (n_ex, l_out, kernel_width, in_ch)
+        The columnized volume
+    X_shape : 3-tuple containing (n_ex, l_in, in_ch)
+        The original dimensions of X (not including padding)
+    W_shape: 3-tuple containing (kernel_width, in_ch, out_ch)
+        The dimensions of the weights in the present convolutional layer
+    pad : 2-tuple of (left, right)
+        Number of zero-padding columns added to X
+    stride : int
+        The stride of each convolution kernel
+    dilation : int (default: 0)
+        Number of pixels inserted between kernel elements.
+
+    Returns
+    -------
+    X : numpy array of shape (n_ex, l_in, in_ch)
+        The reshaped X_col input matrix
+    """
+    if not (isinstance(pad, tuple) and len(pad) == 2):
+        raise TypeError("pad must be a 2-tuple, but got: {}".format(pad))
+
+    s, d = stride, dilation
+    pw1, pw2 = pad
+    n_ex, l_in, in_ch = X_shape
+    n_ex, l_out, fw, in_ch = X_col.shape
+
+    X_pad = np.zeros((n_ex, l_in + pw1 + pw2, in_ch), dtype=X_col.dtype)
+    for k in range(fw):
+        i0 = k * (d + 1)
+        X_pad[:, i0 : i0 + s * (l_out - 1) + 1 : s] += X_col[:, :, k]
+    return X_pad[:, pw1 : pw1 + l_in]
+
+
+def conv2D(X, W, stride, pad, dilation=0, groups=1):
     """
     A faster (but more memory intensive) implementation of the 2D "convolution"
     (technically, cross-correlation) of input X with a collection of kernels in
@@ -584,7 +777,7 @@ def conv2D(X, W, stride, pad, dilation=0):
     ----------
     X : numpy array of shape (n_ex, in_rows, in_cols, in_ch)
         Input volume (unpadded)
-    W: numpy array of shape (kernel_rows, kernel_cols, in_ch, out_ch)
+    W: numpy array of shape (kernel_rows, kernel_cols, in_ch // groups, out_ch)
         A volume of convolution weights/kernels for a given layer
     stride : int
         The stride of each convolution kernel
@@ -598,6 +791,11 @@ def conv2D(X, W, stride, pad, dilation=0):
         volume.
     dilation : int (default: 0)
         Number of pixels inserted between kernel elements.
+    groups : int (default: 1)
+        The number of groups to split the input and output channels into.
+        Each group of out_ch // groups output channels is computed from its
+        own group of in_ch // groups input channels only. If groups = in_ch,
+        this is a depthwise convolution.
 
     Returns
     -------
@@ -605,29 +803,27 @@ def conv2D(X, W, stride, pad, dilation=0):
         The covolution of X with W.
     """
     s, d = stride, dilation
-    _, p = pad2D(X, pad, W.shape[:2], s, dilation=dilation)
-
-    pr1, pr2, pc1, pc2 = p
     fr, fc, in_ch, out_ch = W.shape
     n_ex, in_rows, in_cols, in_ch = X.shape
 
-    # update effective filter shape based on dilation factor
-    _fr, _fc = fr * (d + 1) - d, fc * (d + 1) - d
-
-    # compute the dimensions of the convolution output
-    out_rows = int((in_rows + pr1 + pr2 - _fr) / s + 1)
-    out_cols = int((in_cols + pc1 + pc2 - _fc) / s + 1)
+    # compute the padding and the dimensions of the convolution output
+    p, out_rows, out_cols = plan_conv2D(X.shape, W.shape, s, pad, d)
 
     # convert X and W into the appropriate 2D matrices and take their product
     X_col, _ = im2col(X, W.shape, p, s, d)
-    W_col = W.transpose(3, 2, 0, 1).reshape(out_ch, -1)
-
-    Z = (
-        np.dot(W_col, X_col)
-        .reshape(out_ch, out_rows, out_cols, n_ex)
-        .transpose(3, 1, 2, 0)
-    )
 
+    if groups == 1:
+        W_col = W.transpose(3, 2, 0, 1).reshape(out_ch, -1)
+        Z = np.dot(W_col, X_col)
+    else:
+        # the rows of X_col are ordered by input channel, so each group's
+        # patches form a contiguous block and the groups can be multiplied
+        # in a single batched matmul
+        W_col = W.reshape(fr, fc, -1, groups, out_ch // groups)
+        W_col = W_col.transpose(3, 4, 2, 0, 1).reshape(groups, out_ch // groups, -1)
+        Z = np.matmul(W_col, X_col.reshape(groups, -1, X_col.shape[1]))
+
+    Z = Z.reshape(out_ch, out_rows, out_cols, n_ex).transpose(3, 1, 2, 0)
     return Z
 
 
@@ -640,8 +836,8 @@ def conv1D(X, W, stride, pad, dilation=0):
     """
     A faster (but more memory intensive) implementation of a 1D "convolution"
     (technically, cross-correlation) of input X with a collection of kernels in
-    W. Relies on the `im2col` function to perform the convolution as a single
-    matrix multiplication.
+    W. Relies on the `im2col_1D` function to perform the convolution as a
+    single matrix multiplication.
 
     For a helpful diagram:
     https://petewarden.com/2015/04/20/why-gemm-is-at-the-heart-of-deep-learning/
@@ -668,16 +864,12 @@ def conv1D(X, W, stride, pad, dilation=0):
     Z : numpy array of shape (n_ex, l_out, out_ch)
         The convolution of X with W.
     """
-    _, p = pad1D(X, pad, W.shape[0], stride, dilation=dilation)
-
-    # add a row dimension to X to permit us to use im2col/col2im
-    X2D = np.expand_dims(X, axis=1)
-    W2D = np.expand_dims(W, axis=0)
-    p2D = (0, 0, p[0], p[1])
-    Z2D = conv2D(X2D, W2D, stride, p2D, dilation)
+    fw, in_ch, out_ch = W.shape
+    X_col, p = im2col_1D(X, W.shape, pad, stride, dilation)
 
-    # drop the row dimension
-    return np.squeeze(Z2D, axis=1)
+    n_ex, l_out = X_col.shape[:2]
+    X_col = X_col.reshape(n_ex * l_out, fw * in_ch)
+    return np.dot(X_col, W.reshape(fw * in_ch, out_ch)).reshape(n_ex, l_out, out_ch)
 
 
 def deconv2D_naive(X, W, stride, pad, dilation=0):
@@ -719,14 +911,16 @@ def deconv2D_naive(X, W, stride, pad, dilation=0):
         X = dilate(X, stride - 1)
         stride = 1
 
-    # pad the input
-    X_pad, p = pad2D(X, pad, W.shape[:2], stride=stride, dilation=dilation)
+    # compute the input padding
+    p = plan_pad2D(X.shape, pad, W.shape[:2], stride=stride, dilation=dilation)
 
-    n_ex, in_rows, in_cols, n_in = X_pad.shape
     fr, fc, n_in, n_out = W.shape
     s, d = stride, dilation
     pr1, pr2, pc1, pc2 = p
 
+    n_ex, in_rows, in_cols, n_in = X.shape
+    in_rows, in_cols = in_rows + pr1 + pr2, in_cols + pc1 + pc2
+
     # update effective filter shape based on dilation factor
     _fr, _fc = fr * (d + 1) - d, fc * (d + 1) - d
 
@@ -735,9 +929,10 @@ def deconv2D_naive(X, W, stride, pad, dilation=0):
     out_cols = s * (in_cols - 1) - pc1 - pc2 + _fc
     out_dim = (out_rows, out_cols)
 
-    # add additional padding to achieve the target output dim
-    _p = calc_pad_dims_2D(X_pad.shape, out_dim, W.shape[:2], s, d)
-    X_pad, pad = pad2D(X_pad, _p, W.shape[:2], stride=s, dilation=dilation)
+    # add additional padding to achieve the target output dim, and pad the
+    # input once with the combined padding
+    _p = calc_pad_dims_2D((n_ex, in_rows, in_cols, n_in), out_dim, W.shape[:2], s, d)
+    X_pad, _ = pad2D(X, tuple(i + j for i, j in zip(p, _p)))
 
     # perform the forward convolution using the flipped weight matrix (note
     # we set pad to 0, since we've already added padding)
@@ -75,9 +75,9 @@ class WrapperBase(ABC):
         assert self.trainable, "Layer is frozen"
         self._base_layer.flush_gradients()
 
-    def update(self, lr):
+    def update(self, grad_scale=None):
         assert self.trainable, "Layer is frozen"
-        self._base_layer.update(lr)
+        self._base_layer.update(grad_scale)
         self._base_layer.flush_gradients()
 
     def _set_wrapper_params(self, pdict):
@@ -99,7 +99,7 @@ class WrapperBase(ABC):
 
 
 class Dropout(WrapperBase):
-    def __init__(self, wrapped_layer, p):
+    def __init__(self, wrapped_layer, p, seed=None):
         """
         A dropout regularization wrapper.
 
@@ -109,33 +109,66 @@ class Dropout(WrapperBase):
         training pass). At test time, does not adjust elements of the input at
         all (ie., simply computes the identity function).
 
+        The dropout mask is drawn in bulk from 16-bit random integers (or raw
+        random bytes when p = 0.5) and is stored bit-packed (1 bit per
+        element) for reuse in the backward pass.
+
         Parameters
         ----------
         wrapped_layer : `layers.LayerBase` instance
             The layer to apply dropout to.
         p : float in [0, 1)
             The dropout propbability during training
+        seed : int (default: None)
+            The seed for the dropout mask random number generator. If None,
+            draw a seed from numpy's global random state.
         """
         super().__init__(wrapped_layer)
         self.p = p
+
+        seed = np.random.randint(0, 2 ** 31) if seed is None else seed
+        self._rng = np.random.default_rng(seed)
+        self._mask = None
+
         self._init_wrapper_params()
         self._init_params()
 
     def _init_wrapper_params(self):
         self._wrapper_hyperparameters = {"wrapper": "Dropout", "p": self.p}
 
+    def _draw_mask(self, shape):
+        """Draw a bit-packed mask where each bit is 1 with probability 1 - p"""
+        n = int(np.prod(shape))
+        if self.p == 0.5:
+            return np.frombuffer(self._rng.bytes(int(np.ceil(n / 8))), dtype=np.uint8)
+
+        threshold = int(round(self.p * 2 ** 16))
+        R = self._rng.integers(0, 2 ** 16, size=n, dtype=np.uint16)
+        return np.packbits(R >= threshold)
+
+    def _unpack_mask(self):
+        packed, shape = self._mask
+        n = int(np.prod(shape))
+        return np.unpackbits(packed, count=n).reshape(shape).view(bool)
+
     def forward(self, X):
         scaler = 1.0
-        if self.trainable:
+        self._mask = None
+        if self.trainable and self.p > 0:
             scaler = 1.0 / (1.0 - self.p)
-            dropout_mask = np.random.rand(*X.shape) >= self.p
-            X = dropout_mask * X
+            self._mask = (self._draw_mask(X.shape), X.shape)
+            X = X * self._unpack_mask()
         return scaler * self._base_layer.forward(X)
 
     def backward(self, dLdy):
         assert self.trainable, "Layer is frozen"
-        dLdy *= 1.0 / (1.0 - self.p)
-        return self._base_layer.backward(dLdy)
+        dLdy = dLdy * (1.0 / (1.0 - self.p))
+        dX = self._base_layer.backward(dLdy)
+
+        # elements of X that were dropped receive no gradient
+        if self._mask is not None:
+            dX = dX * self._unpack_mask()
+        return dX
 
 
 def init_wrappers(layer, wrappers_list):